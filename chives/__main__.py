@@ -1,9 +1,20 @@
+import sys
+
 from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
+from chives.benchmark import (
+    DEFAULT_SQLITE_URI, benchmark, benchmark_inproc, order_tracing)
+from chives.candles import backfill_candles
 from chives.cli import parser as chives_parser
-from chives.matchingengine import start_engine
-from chives.models import Base
+from chives.fixedpoint import migrate_fixed_point
+from chives.history import backfill_trade_owners
+from chives.matchingengine import (
+    start_engine, start_engine_async, start_engine_pool)
+from chives.migrations import migrate
+from chives.models import Base, Company
 from chives.webserver import create_app
+from chives.workload import generate_workload, write_workload
 
 
 def main():
@@ -11,20 +22,92 @@ def main():
 
     if args.subcommand == "start_engine":
         sql_engine = create_engine(args.sql_uri, echo=args.verbose)
-        start_engine({
+        config = {
             "SQLALCHEMY_CONN": args.sql_uri,
-            "SQLALCHEMY_ECHO": args.verbose
-        })
+            "SQLALCHEMY_ECHO": args.verbose,
+            "ORDER_QUEUE_SHARDS": args.n_shards,
+            "MATCHING_ENGINE_SHARDS": args.shards,
+            "MATCHING_ENGINE_ORDER_BOOK": args.order_book,
+            "MATCHING_ENGINE_BATCH_SIZE": args.batch_size,
+            "MATCHING_ENGINE_BATCH_TIMEOUT_MS": args.batch_timeout_ms,
+            "MATCHING_ENGINE_JOURNAL": args.journal,
+            "MATCHING_ENGINE_SNAPSHOT_DIR": args.snapshot_dir,
+            "MATCHING_ENGINE_SNAPSHOT_EVERY": args.snapshot_every,
+            "MARKET_DATA": args.market_data
+        }
+        if args.workers > 1:
+            start_engine_pool(config, args.workers, use_async=args.use_async)
+        elif args.use_async:
+            start_engine_async(config)
+        else:
+            start_engine(config)
     if args.subcommand == "initdb":
         sql_engine = create_engine(args.sql_uri, echo=args.verbose)
         Base.metadata.create_all(sql_engine)
+    if args.subcommand == "fixed_point":
+        sql_engine = create_engine(args.sql_uri, echo=args.verbose)
+        tick_sizes = dict()
+        for tick in args.ticks:
+            symbol, tick_size = tick.split("=")
+            tick_sizes[symbol] = int(tick_size)
+        migrate_fixed_point(sql_engine, tick_sizes, 
+            minor_units=args.minor_units, 
+            fixed_point_cash=args.fixed_point_cash)
+    if args.subcommand == "backfill_candles":
+        sql_engine = create_engine(args.sql_uri, echo=args.verbose)
+        Base.metadata.create_all(sql_engine, checkfirst=True)
+        backfill_candles(sql_engine, symbol=args.symbol)
+    if args.subcommand == "backfill_trade_owners":
+        sql_engine = create_engine(args.sql_uri, echo=args.verbose)
+        backfill_trade_owners(sql_engine)
+    if args.subcommand == "migrate":
+        sql_engine = create_engine(args.sql_uri, echo=args.verbose)
+        migrate(sql_engine)
+    if args.subcommand == "benchmark":
+        if args.inproc:
+            result = benchmark_inproc(args.n_rounds, 
+                sql_uri=args.sql_uri or "sqlite://", 
+                batch_size=args.batch_size, use_order_book=args.order_book,
+                rate=args.rate, verify_integrity=args.verify,
+                workload=args.workload, replay_arrivals=args.replay_arrivals)
+        else:
+            result = benchmark(args.n_rounds, 
+                sql_uri=args.sql_uri or DEFAULT_SQLITE_URI, 
+                verify_integrity=args.verify, n_shards=args.n_shards)
+        print(result)
+    if args.subcommand == "workload":
+        market_prices = None
+        if args.sql_uri:
+            sql_engine = create_engine(args.sql_uri, echo=args.verbose)
+            session = sessionmaker(bind=sql_engine)()
+            market_prices = {c.symbol: c.market_price 
+                             for c in session.query(Company)}
+            session.close()
+        workload = generate_workload(args.n_orders, n_symbols=args.n_symbols,
+            zipf_s=args.zipf_s, n_users=args.n_users, rate=args.rate, 
+            market_ratio=args.market_ratio, aon_ratio=args.aon_ratio, 
+            ioc_ratio=args.ioc_ratio, volatility=args.volatility, 
+            market_prices=market_prices, seed=args.seed)
+        write_workload(args.output, workload)
+    if args.subcommand == "verify":
+        sql_engine = create_engine(args.sql_uri, echo=args.verbose)
+        session = sessionmaker(bind=sql_engine)()
+        errors = order_tracing(session)
+        session.close()
+        for error in errors:
+            print(error)
+        print(f"{len(errors)} inconsistencies found")
+        if errors:
+            sys.exit(1)
     if args.subcommand == "webserver":
         # Obtain the agruments that form the application configuration, then 
         # pass the configuration into the app factory before running the app
         sql_uri = args.sql_uri
         config={
             "SQLALCHEMY_CONN": args.sql_uri,
-            "SQLALCHEMY_ECHO": args.verbose
+            "SQLALCHEMY_ECHO": args.verbose,
+            "ORDER_QUEUE_SHARDS": args.n_shards,
+            "MARKET_DATA": args.market_data
         }
         
         app = create_app(config)
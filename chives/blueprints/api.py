@@ -1,30 +1,129 @@
-from collections import namedtuple
 import datetime as dt
-from math import floor
+import logging
 import random
 import typing as ty
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, json, jsonify, request
 from flask_login import login_required, current_user
+from sqlalchemy import func
+import numpy as np
 import pandas as pd
 
-from chives.db import get_db
-from chives.models import Company, Transaction
-
-CandleStickDataPoint = namedtuple(
-    # Respectively: dttm, open, high, low, close
-    "CandleStickDataPoint", ["t", "o", "h", "l", "c"])
-ZoomConfig = namedtuple("ZoomConfig", ['cutoff_offset', 'scale_unit', 'agg_tspan'])
-UNIX_START = dt.datetime(1970, 1, 1, 0, 0, 0)
-ZOOM_CONFIGS = {
-    'day': ZoomConfig(dt.timedelta(hours=24), "hour", dt.timedelta(minutes=10)),
-    'month': ZoomConfig(dt.timedelta(days=30), "day", dt.timedelta(hours=6)),
-    'year': ZoomConfig(dt.timedelta(days=365), "month", dt.timedelta(days=1)),
-    'max': ZoomConfig(dt.timedelta(days=3650), "year", dt.timedelta(days=7))
-}
+from chives.candles import (
+    CandleStickDataPoint, UNIX_START, ZOOM_CONFIGS, chart_data_points, 
+    price_stats, read_candles, sql_candles)
+from chives.db import get_db, get_market_data, get_publisher, get_response_cache
+from chives.marketdata import EMPTY_QUOTE, top_of_book
+from chives.models import Asset, Company, Order, Transaction
+from chives.portfolio import portfolio_json, value_portfolio
+from chives.responsecache import CachedResponse, etag_of
 
+logger = logging.getLogger("chives.webserver")
 bp = Blueprint("api", __name__, url_prefix="/api")
 
+
+def cached_json(group: str, version: ty.Optional[str], 
+                build: ty.Callable[[], ty.Dict],
+                last_modified: ty.Optional[dt.datetime] = None):
+    """Return a JSON response with an ETag, answering conditional requests 
+    with 304. If there is a response cache and a version, the response is 
+    read from the cache, or built and stored in it
+
+    :param group: identifies the request, such as "chart|X|day"
+    :type group: str
+    :param version: identifies the data the response is built from, such as 
+    the latest transaction_id of the security; None disables the cache
+    :type version: str, optional
+    :param build: returns the response data
+    :type build: ty.Callable[[], ty.Dict]
+    :param last_modified: when the data was last modified, defaults to None
+    :type last_modified: dt.datetime, optional
+    """
+    cache = get_response_cache()
+    key = f"{group}|{version}"
+    entry = None
+    if cache is not None and version is not None:
+        entry = cache.get(key)
+    if entry is None:
+        body = json.dumps(build()).encode("utf-8")
+        timestamp = None if last_modified is None \
+            else (last_modified - UNIX_START).total_seconds()
+        if cache is not None and version is not None:
+            entry = cache.put(key, group, body, timestamp)
+        else:
+            entry = CachedResponse(body, etag_of(body), timestamp)
+    response = current_app.response_class(
+        entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    if entry.last_modified is not None:
+        response.last_modified = entry.last_modified
+    # Browsers may keep the response, but must revalidate it every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def latest_transaction(db, symbol: str
+                       ) -> ty.Tuple[ty.Optional[int], ty.Optional[dt.datetime]]:
+    """Return the transaction_id and transact_dttm of the latest transaction 
+    of a security, or (None, None) if it has never been traded
+    """
+    latest = db.query(Transaction.transaction_id, Transaction.transact_dttm
+        ).filter(Transaction.security_symbol == symbol).order_by(
+            Transaction.transaction_id.desc()).first()
+    return (None, None) if latest is None else tuple(latest)
+
+def parse_order_batch(data, max_size: int
+                      ) -> ty.Tuple[ty.List[ty.Dict], ty.List[ty.Dict]]:
+    """Validate the JSON body of a batch of orders, which must be an array of 
+    objects with security_symbol, side ("ask" or "bid"), a positive integer 
+    size, and optionally a positive price (none for market orders), 
+    all_or_none and immediate_or_cancel
+
+    :param data: the decoded JSON body
+    :param max_size: the maximum number of orders in a batch
+    :type max_size: int
+    :return: the columns of the valid orders, and an error for each invalid 
+    one with its index in the array
+    :rtype: ty.Tuple[ty.List[ty.Dict], ty.List[ty.Dict]]
+    """
+    if not isinstance(data, list) or not data:
+        return [], [{"index": None, "error": "Expected a non-empty array"}]
+    if len(data) > max_size:
+        return [], [{"index": None, 
+                     "error": f"At most {max_size} orders per batch"}]
+    orders, errors = [], []
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            errors.append({"index": i, "error": "Expected an object"})
+            continue
+        symbol, side = item.get("security_symbol"), item.get("side")
+        size, price = item.get("size"), item.get("price")
+        flags = [item.get(k, False) 
+                 for k in ("all_or_none", "immediate_or_cancel")]
+        if not isinstance(symbol, str) or not symbol:
+            error = "security_symbol is required"
+        elif side not in ("ask", "bid"):
+            error = "side must be ask or bid"
+        elif isinstance(size, bool) or not isinstance(size, int) or size < 1:
+            error = "size must be a positive integer"
+        elif price is not None and (isinstance(price, bool) 
+                or not isinstance(price, (int, float)) or price <= 0):
+            error = "price must be positive"
+        elif not all(isinstance(flag, bool) for flag in flags):
+            error = "all_or_none and immediate_or_cancel must be booleans"
+        else:
+            orders.append(dict(
+                security_symbol=symbol, side=side, size=size, 
+                price=None if price is None else float(price),
+                all_or_none=flags[0], 
+                # Market orders are always immediate-or-cancel
+                immediate_or_cancel=flags[1] or price is None))
+            continue
+        errors.append({"index": i, "error": error})
+    return orders, errors
+
+
 @bp.route("/is_authenticated", methods=("GET",))
 @login_required
 def is_authenticated():
@@ -39,6 +138,107 @@ def autocomplete_companies():
     return jsonify(data)
 
 
+@bp.route("/orders/batch", methods=("POST",))
+@login_required
+def submit_order_batch():
+    """Submit a batch of orders (see parse_order_batch) for the current user. 
+    The batch is accepted or rejected as a whole: the shares of ask orders are 
+    reserved with one update per security, the orders are inserted in one 
+    flush, and published together once committed. Return the assigned 
+    order_ids in the order of the array
+    """
+    rows, errors = parse_order_batch(request.get_json(silent=True), 
+        int(current_app.config['ORDER_BATCH_MAX_SIZE']))
+    if errors:
+        return jsonify({"errors": errors}), 400
+    publisher = get_publisher()
+    if not publisher.healthy:
+        return jsonify({"error": "Webserver failed to connect to order queue"}
+                       ), 503
+
+    db = get_db()
+    symbols = set(row["security_symbol"] for row in rows)
+    listed = set(symbol for symbol, in db.query(Company.symbol).filter(
+        Company.symbol.in_(symbols)))
+    if symbols - listed:
+        return jsonify({"error": "Not listed: " 
+                        + ", ".join(sorted(symbols - listed))}), 400
+
+    reserved = dict()
+    for row in rows:
+        if row["side"] == "ask":
+            symbol = row["security_symbol"]
+            reserved[symbol] = reserved.get(symbol, 0) + row["size"]
+    for symbol, size in sorted(reserved.items()):
+        # Only subtracts the shares if the user has enough of them
+        updated = db.query(Asset).filter(
+            Asset.owner_id == current_user.user_id, 
+            Asset.asset_symbol == symbol, Asset.asset_amount >= size
+        ).update({Asset.asset_amount: Asset.asset_amount - size}, 
+                 synchronize_session=False)
+        if updated == 0:
+            db.rollback()
+            return jsonify({"error": f"Insufficient assets: {symbol}"}), 400
+
+    # The orders are flushed in the order of the array, and each one is 
+    # given its order_id as it is inserted
+    for row in rows:
+        row.update(owner_id=current_user.user_id, active=False)
+    orders = [Order(**row) for row in rows]
+    db.add_all(orders)
+    db.flush()
+    order_ids = [order.order_id for order in orders]
+    db.commit()
+
+    # Copies, since the committed orders would each be refreshed when read
+    publisher.publish([Order(order_id=order_id, **row) 
+                       for order_id, row in zip(order_ids, rows)])
+    logger.info(f"{len(rows)} orders of {current_user} submitted to order queue")
+    return jsonify({"order_ids": order_ids})
+
+
+@bp.route("/portfolio", methods=("GET",))
+@login_required
+def portfolio():
+    """Return the current user's cash, positions, market values and net worth
+    """
+    return jsonify(portfolio_json(value_portfolio(
+        get_db(), current_user.user_id, market_data=get_market_data())))
+
+
+@bp.route("/quote", methods=("GET",))
+@login_required
+def quote():
+    """Return the last price and the best bid and ask of a security, from 
+    the market data cache if there is one, or else from the database
+    """
+    symbol = request.args['symbol']
+    market_data = get_market_data()
+    if market_data is not None and symbol in market_data:
+        # Already in memory, so it is not worth caching
+        last_price = market_data.last_price(symbol)
+        top = market_data.best_bid_ask(symbol) or EMPTY_QUOTE
+        return cached_json(f"quote|{symbol}", None, lambda: dict(
+            symbol=symbol, last_price=last_price, **top._asdict()))
+
+    db = get_db()
+    company = db.query(Company).get(symbol)
+    if company is None:
+        return jsonify({"error": f"{symbol} is not listed"}), 404
+    # The top of the book only changes when the security's active orders do, 
+    # as the matching engine activates, fills or cancels them, and the last 
+    # price with each trade; the active orders are counted and summed by 
+    # order_id from the book index alone
+    transaction_id, _ = latest_transaction(db, symbol)
+    n_active, active_id_sum = db.query(
+        func.count(Order.order_id), func.sum(Order.order_id)).filter(
+        Order.security_symbol == symbol, Order.active == True).one()
+    return cached_json(f"quote|{symbol}", 
+        f"{transaction_id}|{n_active}|{active_id_sum}",
+        lambda: dict(symbol=symbol, last_price=company.market_price, 
+                     **top_of_book(db, symbol)._asdict()))
+
+
 @bp.route("/stock_chart_data", methods=("GET",))
 @login_required 
 def stock_chart_data():
@@ -46,19 +246,20 @@ def stock_chart_data():
     zoom = request.args['zoom'] if "zoom" in request.args else "year"
     debug = int(request.args['debug']) if "debug" in request.args else 0
     db = get_db()
+    if debug:
+        return jsonify(stock_chart(db, symbol, zoom, debug))
+    # The chart only changes when the security is traded
+    transaction_id, transact_dttm = latest_transaction(db, symbol)
+    return cached_json(f"chart|{symbol}|{zoom}", str(transaction_id), 
+        lambda: stock_chart(db, symbol, zoom), last_modified=transact_dttm)
 
-    # Query all transactions with transaction dttm sorted from earlier to later
-    tfilter = (Transaction.security_symbol == symbol)
-    # Add the dttm filter, which depends on the zoom level
+
+def stock_chart(db, symbol: str, zoom: str, debug: int = 0) -> ty.Dict:
+    """Return the chart data of a security at a zoom level; see 
+    stock_chart_data
+    """
     cutoff = dt.datetime.utcnow() - ZOOM_CONFIGS[zoom].cutoff_offset
     scale_unit = ZOOM_CONFIGS[zoom].scale_unit
-    tfilter = tfilter & (Transaction.transact_dttm >= cutoff)
-
-    sort_key = Transaction.transact_dttm.asc()
-    query = db.query(Transaction).filter(tfilter).order_by(sort_key)
-
-    # Convert the set of transactions into a 2 column dataframe: price vs dttm
-    df = pd.read_sql(query.statement, db.bind)[['transact_dttm', 'price']]
     if debug:
         # If debug is set to True, then return dummy data without reading
         # from database
@@ -73,7 +274,22 @@ def stock_chart_data():
                 )  for i in range(500)],
             "price": [random.uniform(10, 100) for i in range(500)]
         }).sort_values('transact_dttm')
-    agg_data_points = aggregate_stock_chart(df, zoom)
+        agg_data_points = aggregate_stock_chart(df, zoom)
+        max_price = 0 if pd.isna(df['price'].max()) else df['price'].max()
+        min_price = 0 if pd.isna(df['price'].min()) else df['price'].min()
+        price_std = 0 if pd.isna(df['price'].std()) else df['price'].std()
+    else:
+        # The candles are kept up to date by the matching engine, so there 
+        # is no need to read the transactions; the first candle may include 
+        # transactions from before the cutoff
+        candles = read_candles(db, symbol, zoom)
+        if len(candles) == 0:
+            # The transactions may predate the candles (see backfill_candles), 
+            # in which case they are aggregated within the database
+            span = int(ZOOM_CONFIGS[zoom].agg_tspan.total_seconds())
+            candles = sql_candles(db, span, symbol, since=cutoff)
+        agg_data_points = chart_data_points(candles)
+        max_price, min_price, price_std = price_stats(candles)
     agg_data_points_dict = [{
         "t": dp.t * 1000,
         "o": dp.o,
@@ -82,9 +298,6 @@ def stock_chart_data():
         "c": dp.c,
         "y": dp.c
     } for dp in agg_data_points]
-    max_price = 0 if pd.isna(df['price'].max()) else df['price'].max()
-    min_price = 0 if pd.isna(df['price'].min()) else df['price'].min()
-    price_std = 0 if pd.isna(df['price'].std()) else df['price'].std()
     
     data = {
         "labels": [],
@@ -106,16 +319,20 @@ def stock_chart_data():
             }
         }
     }
-    return jsonify({"data": data, "options": options})
+    return {"data": data, "options": options}
 
 
 def aggregate_stock_chart(df: pd.DataFrame, 
-    zoom: str = "day") -> ty.List[ty.Dict]:
+    zoom: str = "day") -> ty.List[CandleStickDataPoint]:
     """Given a DataFrame that contains two non-null columns "transact_dttm" and 
     "price", return a list of CandleStickDataPoint instances that represent the 
     aggregated trade data of the time interval that starts with dp.T and ends 
     with the next dp.T
 
+    The transactions are sorted by time once, after which each bucket is a 
+    contiguous run of rows, so that all buckets are aggregated at once with 
+    np.maximum.reduceat and np.minimum.reduceat over the run boundaries
+
     :param df: [description]
     :type df: pd.DataFrame
     :param zoom: [description], defaults to "day"
@@ -127,30 +344,25 @@ def aggregate_stock_chart(df: pd.DataFrame,
     
     assert zoom in ["day", "month", "year", "max"]
     agg_tspan = ZOOM_CONFIGS[zoom].agg_tspan
-    
-    global_min_transact_ts = df['transact_dttm'].min()
-    global_agg_start = (global_min_transact_ts - UNIX_START) // agg_tspan \
-        * agg_tspan + UNIX_START
-    df['bucket_idx'] = (df['transact_dttm'] - global_agg_start) / agg_tspan
-    df['bucket_idx'] = df['bucket_idx'].apply(floor)
-
-    output = []
-    # an interval's close should be next interval's open
-    prior_close = None
-    for idx in df['bucket_idx'].unique():
-        part = df.loc[df['bucket_idx'] == idx]
-        # If there is a prior close, then open is set to prior close
-        open = prior_close if prior_close else round(
-            part.sort_values('transact_dttm').head(1)['price'].values[0], 2)
-        # Update prior close
-        prior_close = close = round(
-            part.sort_values('transact_dttm').tail(1)['price'].values[0], 2)
-        high = round(part['price'].max(), 2)
-        low = round(part['price'].min(), 2)
-        ts = (global_agg_start + idx * agg_tspan).timestamp()
-        output.append(CandleStickDataPoint(
-            t=ts, o=open, h=high, l=low, c=close
-        ))
-    
-    return output
-    
\ No newline at end of file
+    span_ns = agg_tspan // dt.timedelta(microseconds=1) * 1000
+
+    df = df.sort_values('transact_dttm', kind='mergesort')
+    # Buckets are aligned to the Unix epoch
+    epoch_ns = (df['transact_dttm'] - UNIX_START).to_numpy(
+        dtype='timedelta64[ns]').astype(np.int64)
+    buckets = epoch_ns // span_ns
+    prices = df['price'].to_numpy(dtype=float)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(prices)] - 1
+
+    high = np.round(np.maximum.reduceat(prices, starts), 2)
+    low = np.round(np.minimum.reduceat(prices, starts), 2)
+    close = np.round(prices[ends], 2)
+    # an interval's close should be next interval's open, unless there is no 
+    # prior close (or it is 0), in which case it is the first price
+    prior_close = np.r_[0, close[:-1]]
+    open = np.where(prior_close != 0, prior_close, np.round(prices[starts], 2))
+    ts = buckets[starts] * span_ns / 1e9
+
+    return [CandleStickDataPoint(*dp) for dp in zip(
+        ts.tolist(), open.tolist(), high.tolist(), low.tolist(), close.tolist())]
@@ -2,7 +2,7 @@ import functools
 import logging
 
 from flask import (
-    Blueprint, flash, g as flask_g, redirect, render_template, request, 
+    Blueprint, current_app, flash, g as flask_g, redirect, render_template, request, 
     session as flask_session, url_for
 )
 from flask_login import login_user, logout_user, current_user
@@ -10,6 +10,7 @@ from werkzeug.security import check_password_hash, generate_password_hash
 
 from chives.webserver import login_manager
 from chives.db import get_db
+from chives.fixedpoint import add_cash, fixed_point_minor_units
 from chives.forms import RegistrationForm, LoginForm
 from chives.models import User, Asset
 
@@ -59,8 +60,10 @@ def register():
             initial_cash = Asset(
                 owner_id=new_user.user_id,
                 asset_symbol="_CASH",
-                asset_amount=initial_cash_amount
+                asset_amount=0
             )
+            add_cash(initial_cash, initial_cash_amount, 
+                     fixed_point_minor_units(current_app.config))
             db_session.add(initial_cash)
             db_session.commit()
             logger.info(f"{new_user} received ${initial_cash_amount:.2f}")
@@ -1,10 +1,19 @@
-from flask import Blueprint
+from flask import Blueprint, current_app, jsonify
 
 from flask_login import login_required, current_user
 
+from chives.db import pool_stats
+
 bp = Blueprint("debug", __name__, url_prefix="/debug")
 
 @bp.route("/is_authenticated", methods=("GET",))
 @login_required
 def is_authenticated():
     return f"You are authenticated as {current_user.username}"
+
+@bp.route("/pool_stats", methods=("GET",))
+@login_required
+def sql_pool_stats():
+    """Return the state of this process's database connection pool
+    """
+    return jsonify(pool_stats(current_app.extensions['chives_sql_engine']))
@@ -1,17 +1,21 @@
+import datetime as dt
 import logging
+from types import SimpleNamespace
 
 from babel.numbers import format_number
 from flask import (
-    Blueprint, flash, g as flask_g, redirect, render_template, request, 
-    session as flask_session, url_for
+    Blueprint, abort, current_app, flash, g as flask_g, redirect, 
+    render_template, 
+    request, session as flask_session, url_for
 )
 from flask_login import login_required, current_user
-import pika
-from pika.exceptions import AMQPConnectionError
 
-from chives.db import get_db, get_mq
+from chives.db import get_db, get_market_data, get_publisher
+from chives.fixedpoint import add_cash, fixed_point_minor_units
 from chives.forms import OrderSubmitForm, StartCompanyForm
-from chives.models import Order, Asset, Company, Transaction, User
+from chives.history import page_cursor, user_transactions
+from chives.models import Order, Asset, Company, User
+from chives.portfolio import value_portfolio
 
 logger = logging.getLogger("chives.webserver")
 chandle = logging.StreamHandler()
@@ -24,44 +28,33 @@ bp = Blueprint("exchange", __name__, url_prefix="/exchange")
 @bp.route("/dashboard", methods=("GET",))
 @login_required
 def dashboard():
-    db = get_db()
-    # Any amount of cash will be displayed
-    cash = [a for a in current_user.assets if (a.asset_symbol == "_CASH")][0]
-    cash.asset_amount_display = format_number(cash.asset_amount, locale="en_US")
-    # Empty assets for stocks will not be displayed
-    stocks = [a for a in current_user.assets 
-        if (a.asset_symbol != "_CASH") and (a.asset_amount > 0)]
-
-    # Compute stocks' market value by company's market price * asset_amount
-    # Then compute net worth by summing up cash and stocks market value
-    net_worth = cash.asset_amount 
-    for stock in stocks:
-        market_price = db.query(Company).get(stock.asset_symbol).market_price
-        stock.market_value = market_price * stock.asset_amount
-        stock.market_value_display = format_number(stock.market_value, locale="en_US")
-        stock.asset_amount_display = format_number(
-            int(stock.asset_amount), locale="en_US")
-        net_worth += stock.market_value
-    net_worth_display = format_number(net_worth, locale="en_US")
+    # Cash, stocks and their market values in one query; empty assets for 
+    # stocks are not displayed
+    portfolio = value_portfolio(
+        get_db(), current_user.user_id, market_data=get_market_data())
+    cash = SimpleNamespace(
+        asset_amount_display=format_number(portfolio.cash, locale="en_US"))
+    stocks = [SimpleNamespace(
+        asset_symbol=p.symbol, 
+        market_value_display=format_number(p.market_value, locale="en_US"),
+        asset_amount_display=format_number(int(p.amount), locale="en_US")
+    ) for p in portfolio.positions]
+    net_worth_display = format_number(portfolio.net_worth, locale="en_US")
     return render_template("exchange/dashboard.html", 
         cash=cash, stocks=stocks, net_worth=net_worth_display, title="Dashboard")
 
 @bp.route("/submit_order", methods=("GET", "POST"))
 @login_required
 def submit_order():
-    # Even before rendering the page, try to connect to RabbitMQ. If RabbitMQ 
-    # is not running, then redirect to an error page
-    mq = ch = None
-    try:
-        mq: pika.BlockingConnection = get_mq()
-        ch = mq.channel()
-        ch.queue_declare(queue='incoming_order')
-    except AMQPConnectionError as e:
-        error_msg = "Webserver failed to connect to order queue"
-        return redirect(url_for("exchange.error", error_msg=error_msg))
-
     form = OrderSubmitForm(request.form)
     if request.method == "POST" and form.validate_on_submit():
+        # The publisher connects to RabbitMQ in the background; if its last 
+        # attempt failed, then RabbitMQ is not running, so redirect to an 
+        # error page before anything is committed
+        publisher = get_publisher()
+        if not publisher.healthy:
+            error_msg = "Webserver failed to connect to order queue"
+            return redirect(url_for("exchange.error", error_msg=error_msg))
         new_order: Order = Order(
             security_symbol=form.security_symbol.data, 
             side=form.side.data, 
@@ -87,8 +80,7 @@ def submit_order():
         db.commit()
         logger.info(f"{new_order} committed to database")
 
-        ch.basic_publish(
-                exchange='', routing_key='incoming_order', body=new_order.json)
+        publisher.publish([new_order])
         logger.info(f"{new_order} submitted to order queue")
 
         return redirect(url_for("exchange.dashboard"))
@@ -118,23 +110,33 @@ def recent_orders():
 @bp.route("/recent_transactions", methods=("GET",))
 @login_required
 def recent_transactions():
-    """Render the most recent (up to) 50 transactions
+    """Render the most recent (up to) 50 transactions, or the 50 before the 
+    transaction given by the before_dttm and before_id arguments
     """
-    db = get_db()
-    order_ids = [o.order_id for o in current_user.orders]
-    involves_current_user = Transaction.ask_id.in_(order_ids) \
-        | Transaction.bid_id.in_(order_ids)
-    dttm_desc = Transaction.transact_dttm.desc()
-    transactions = db.query(Transaction).filter(
-        involves_current_user).order_by(dttm_desc).limit(50).all()
+    before = None
+    if "before_dttm" in request.args or "before_id" in request.args:
+        try:
+            before = (dt.datetime.fromisoformat(request.args["before_dttm"]), 
+                      int(request.args["before_id"]))
+        except (KeyError, ValueError):
+            abort(400, "before_dttm and before_id must be given together, as "
+                       "an ISO datetime and a transaction ID")
+    transactions = user_transactions(
+        get_db(), current_user.user_id, limit=50, before=before)
 
     for t in transactions:
-        t.side_display = "Bought" if (t.bid_id in order_ids) else "Sold"
+        t.side_display = "Bought" if (t.buyer_id == current_user.user_id) \
+            else "Sold"
         t.dttm_display = t.transact_dttm.strftime("%Y-%m-%d %H:%M:%S")
+    older_url = None
+    if len(transactions) == 50:
+        before_dttm, before_id = page_cursor(transactions)
+        older_url = url_for("exchange.recent_transactions", 
+            before_dttm=before_dttm.isoformat(), before_id=before_id)
     
     return render_template(
-        "exchange/recent_transactions.html", 
-        transactions=transactions, title="Recent transactions")
+        "exchange/recent_transactions.html", transactions=transactions, 
+        older_url=older_url, title="Recent transactions")
 
 
 @bp.route("/view_company/<company_symbol>", methods=("GET",))
@@ -165,12 +167,14 @@ def start_company():
             initial_value=form.input_cash.data,
             initial_size=form.size.data,
             founder_id=current_user.user_id,
-            market_price=form.input_cash.data / form.size.data
+            market_price=form.input_cash.data / form.size.data,
+            tick_size=int(current_app.config["DEFAULT_TICK_SIZE"]) or None
         )
         db.add(new_company)
 
         founder_cash = db.query(Asset).get((current_user.user_id, "_CASH"))
-        founder_cash.asset_amount -= float(form.input_cash.data)
+        add_cash(founder_cash, -float(form.input_cash.data), 
+                 fixed_point_minor_units(current_app.config))
 
         # Since this is a new company, the founder will definitely not have 
         # prior assets
@@ -0,0 +1,315 @@
+"""Candlestick (OHLC) charts of the securities' transactions. The matching
+engine keeps the candles table up to date as it writes transactions, at the
+aggregation span of each zoom level of the chart, so that the chart reads a
+few hundred candles instead of every transaction in its window. Candles of
+transactions written before the table existed are computed with
+backfill_candles, which aggregates them within the database.
+"""
+from collections import namedtuple
+import datetime as dt
+import logging
+import math
+import typing as ty
+
+from sqlalchemy import Integer, case, cast, func, text, true
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import aliased, sessionmaker, Session
+
+from chives.models import Candle, Transaction
+
+
+logger = logging.getLogger("chives.candles")
+
+CandleStickDataPoint = namedtuple(
+    # Respectively: dttm, open, high, low, close
+    "CandleStickDataPoint", ["t", "o", "h", "l", "c"])
+ZoomConfig = namedtuple("ZoomConfig", ['cutoff_offset', 'scale_unit', 'agg_tspan'])
+UNIX_START = dt.datetime(1970, 1, 1, 0, 0, 0)
+ZOOM_CONFIGS = {
+    'day': ZoomConfig(dt.timedelta(hours=24), "hour", dt.timedelta(minutes=10)),
+    'month': ZoomConfig(dt.timedelta(days=30), "day", dt.timedelta(hours=6)),
+    'year': ZoomConfig(dt.timedelta(days=365), "month", dt.timedelta(days=1)),
+    'max': ZoomConfig(dt.timedelta(days=3650), "year", dt.timedelta(days=7))
+}
+# The spans, in seconds, of the candles that are kept
+CANDLE_SPANS = sorted(set(
+    int(zoom.agg_tspan.total_seconds()) for zoom in ZOOM_CONFIGS.values()))
+# The dialects that bucket_index can compute the bucket of a DATETIME on
+SQL_BUCKET_DIALECTS = ("sqlite", "mysql")
+
+
+def bucket_start(dttm: dt.datetime, span: int) -> dt.datetime:
+    """Return the start of the bucket of span seconds that dttm falls in;
+    buckets are aligned to the Unix epoch
+    """
+    tspan = dt.timedelta(seconds=span)
+    return UNIX_START + (dttm - UNIX_START) // tspan * tspan
+
+
+class CandleDelta:
+    """The candle of the transactions written in one commit, which is merged
+    into the stored candle of the same bucket by upsert_candles
+    """
+    __slots__ = ["open", "high", "low", "close", "volume", "n_trades",
+                 "price_sum", "price_sq_sum"]
+
+    def __init__(self, price: float):
+        self.open = self.high = self.low = self.close = price
+        self.volume = self.n_trades = 0
+        self.price_sum = self.price_sq_sum = 0.0
+
+    def add(self, price: float, size: int):
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.close = price
+        self.volume += size
+        self.n_trades += 1
+        self.price_sum += price
+        self.price_sq_sum += price * price
+
+
+CandleKey = ty.Tuple[str, int, dt.datetime]
+
+
+def aggregate_candles(transactions: ty.Iterable[Transaction],
+                      spans: ty.List[int] = CANDLE_SPANS,
+                      candles: ty.Optional[ty.Dict[CandleKey, CandleDelta]] = None
+                      ) -> ty.Dict[CandleKey, CandleDelta]:
+    """Aggregate transactions, in the order they were made, into candles
+
+    :param transactions: transactions with their transact_dttm
+    :type transactions: ty.Iterable[Transaction]
+    :param spans: the spans of the candles in seconds, defaults to CANDLE_SPANS
+    :type spans: ty.List[int], optional
+    :param candles: if specified, the candles to aggregate into, defaults to
+    None
+    :return: the candles by (security_symbol, span, start_dttm)
+    :rtype: ty.Dict[CandleKey, CandleDelta]
+    """
+    candles = dict() if candles is None else candles
+    for t in transactions:
+        for span in spans:
+            key = (t.security_symbol, span, bucket_start(t.transact_dttm, span))
+            if key not in candles:
+                candles[key] = CandleDelta(t.price)
+            candles[key].add(t.price, t.size)
+    return candles
+
+
+def upsert_candles(session: Session, deltas: ty.Dict[CandleKey, CandleDelta]):
+    """Merge candles into the stored candles of the same buckets, keeping the
+    stored open. Like MatchingEngine.apply_asset_deltas, this is a single
+    "INSERT ... ON DUPLICATE KEY UPDATE" on MySQL, and an update followed by
+    an insert if no row was updated on other databases
+
+    :param session: a session bound to the main database
+    :type session: Session
+    :param deltas: see aggregate_candles
+    :type deltas: ty.Dict[CandleKey, CandleDelta]
+    """
+    candles = Candle.__table__
+    is_mysql = session.bind.dialect.name == "mysql"
+    for (symbol, span, start_dttm), d in deltas.items():
+        new_values = [
+            (candles.c.high, case([(candles.c.high < d.high, d.high)],
+                                  else_=candles.c.high)),
+            (candles.c.low, case([(candles.c.low > d.low, d.low)],
+                                 else_=candles.c.low)),
+            (candles.c.close, d.close),
+            (candles.c.volume, candles.c.volume + d.volume),
+            (candles.c.n_trades, candles.c.n_trades + d.n_trades),
+            (candles.c.price_sum, candles.c.price_sum + d.price_sum),
+            (candles.c.price_sq_sum, candles.c.price_sq_sum + d.price_sq_sum),
+        ]
+        insert_values = dict(
+            security_symbol=symbol, span=span, start_dttm=start_dttm,
+            **{attr: getattr(d, attr) for attr in CandleDelta.__slots__})
+        if is_mysql:
+            upsert = mysql_insert(candles).values(**insert_values)
+            session.execute(upsert.on_duplicate_key_update(new_values))
+            continue
+        result = session.execute(candles.update(
+            preserve_parameter_order=True
+        ).where(
+            (candles.c.security_symbol == symbol) & (candles.c.span == span)
+            & (candles.c.start_dttm == start_dttm)
+        ).values(new_values))
+        if result.rowcount == 0:
+            session.execute(candles.insert().values(**insert_values))
+
+
+def read_candles(session: Session, symbol: str, zoom: str,
+                 now: ty.Optional[dt.datetime] = None) -> ty.List[Candle]:
+    """Read the candles of a security within the window of a zoom level, from
+    the bucket that the window starts in
+    """
+    zoom_config = ZOOM_CONFIGS[zoom]
+    now = dt.datetime.utcnow() if now is None else now
+    span = int(zoom_config.agg_tspan.total_seconds())
+    start = bucket_start(now - zoom_config.cutoff_offset, span)
+    return session.query(Candle).filter(
+        (Candle.security_symbol == symbol) & (Candle.span == span)
+        & (Candle.start_dttm >= start)
+    ).order_by(Candle.start_dttm.asc()).all()
+
+
+def chart_data_points(candles: ty.List[Candle]) -> ty.List[CandleStickDataPoint]:
+    """Return the data points of the chart of consecutive candles; like
+    chives.blueprints.api.aggregate_stock_chart, a candle's open is the close
+    of the candle before it
+    """
+    output = []
+    prior_close = None
+    for candle in candles:
+        open = prior_close if prior_close else round(candle.open, 2)
+        prior_close = close = round(candle.close, 2)
+        output.append(CandleStickDataPoint(
+            t=(candle.start_dttm - UNIX_START).total_seconds(), o=open, 
+            h=round(candle.high, 2), l=round(candle.low, 2), c=close))
+    return output
+
+
+def price_stats(candles: ty.List[Candle]
+                ) -> ty.Tuple[float, float, float]:
+    """Return the maximum, the minimum and the sample standard deviation of
+    the prices of the transactions in the candles, each of which is 0 if it
+    is not defined
+    """
+    n = sum(c.n_trades for c in candles)
+    if n == 0:
+        return 0, 0, 0
+    max_price = max(c.high for c in candles)
+    min_price = min(c.low for c in candles)
+    if n == 1:
+        return max_price, min_price, 0
+    price_sum = sum(c.price_sum for c in candles)
+    price_sq_sum = sum(c.price_sq_sum for c in candles)
+    variance = (price_sq_sum - price_sum * price_sum / n) / (n - 1)
+    return max_price, min_price, math.sqrt(max(variance, 0))
+
+
+def bucket_index(dialect_name: str, dttm_column, span: int):
+    """Return the SQL expression of the index of the bucket of span seconds 
+    that a DATETIME column falls in, counted from the Unix epoch. Both 
+    operands of the division are integers, so it rounds down
+
+    :param dialect_name: one of SQL_BUCKET_DIALECTS
+    :type dialect_name: str
+    :param dttm_column: a column of naive UTC datetimes
+    :param span: the span of the buckets in seconds
+    :type span: int
+    """
+    if dialect_name == "sqlite":
+        return cast(func.strftime("%s", dttm_column), Integer) / span
+    if dialect_name == "mysql":
+        # Unlike UNIX_TIMESTAMP, TIMESTAMPDIFF ignores the session time zone
+        return func.timestampdiff(
+            text("SECOND"), UNIX_START, dttm_column).op("DIV")(span)
+    raise NotImplementedError(
+        f"Candles cannot be aggregated in SQL on {dialect_name}")
+
+
+def sql_candles(session: Session, span: int, symbol: ty.Optional[str] = None,
+                since: ty.Optional[dt.datetime] = None) -> ty.List[Candle]:
+    """Aggregate transactions into candles within the database with a GROUP 
+    BY on the bucket index, so that only one row per candle is read. The open 
+    and the close are the prices of the first and the last transaction of 
+    each bucket by transaction_id, which is the order in which the matching 
+    engine of the security made them. On a database without a bucket 
+    expression (see SQL_BUCKET_DIALECTS), the transactions are read instead, 
+    and aggregated with aggregate_candles
+
+    :param session: a session bound to the main database
+    :type session: Session
+    :param span: the span of the candles in seconds
+    :type span: int
+    :param symbol: if specified, only the candles of this security are 
+    aggregated, defaults to None
+    :type symbol: str, optional
+    :param since: if specified, only the candles from the bucket that this 
+    falls in are aggregated, defaults to None
+    :type since: dt.datetime, optional
+    :return: transient Candle objects, ordered by symbol then start_dttm
+    :rtype: ty.List[Candle]
+    """
+    cond = true()
+    if symbol is not None:
+        cond = cond & (Transaction.security_symbol == symbol)
+    if since is not None:
+        cond = cond & (Transaction.transact_dttm >= bucket_start(since, span))
+    dialect_name = session.bind.dialect.name
+    if dialect_name not in SQL_BUCKET_DIALECTS:
+        deltas = aggregate_candles(session.query(Transaction).filter(cond)
+            .order_by(Transaction.transaction_id).yield_per(1000), [span])
+        return [Candle(
+            security_symbol=key[0], span=span, start_dttm=key[2], 
+            open=d.open, high=d.high, low=d.low, close=d.close, 
+            volume=d.volume, n_trades=d.n_trades, price_sum=d.price_sum, 
+            price_sq_sum=d.price_sq_sum) for key, d in sorted(deltas.items())]
+    bucket = bucket_index(dialect_name, Transaction.transact_dttm, span)
+    groups = session.query(
+        Transaction.security_symbol.label("security_symbol"),
+        bucket.label("bucket"),
+        func.max(Transaction.price).label("high"),
+        func.min(Transaction.price).label("low"),
+        func.sum(Transaction.size).label("volume"),
+        func.count(Transaction.transaction_id).label("n_trades"),
+        func.sum(Transaction.price).label("price_sum"),
+        func.sum(Transaction.price * Transaction.price).label("price_sq_sum"),
+        func.min(Transaction.transaction_id).label("first_id"),
+        func.max(Transaction.transaction_id).label("last_id"),
+    ).filter(cond).group_by(Transaction.security_symbol, bucket).subquery()
+    first, last = aliased(Transaction), aliased(Transaction)
+    rows = session.query(
+        groups, first.price.label("open"), last.price.label("close")
+    ).join(
+        first, first.transaction_id == groups.c.first_id
+    ).join(
+        last, last.transaction_id == groups.c.last_id
+    ).order_by(groups.c.security_symbol, groups.c.bucket).all()
+
+    tspan = dt.timedelta(seconds=span)
+    return [Candle(
+        security_symbol=row.security_symbol, span=span, 
+        start_dttm=UNIX_START + int(row.bucket) * tspan,
+        open=row.open, high=row.high, low=row.low, close=row.close, 
+        volume=int(row.volume), n_trades=row.n_trades, 
+        price_sum=row.price_sum, price_sq_sum=row.price_sq_sum)
+        for row in rows]
+
+
+def backfill_candles(sql_engine: SQLEngine, symbol: ty.Optional[str] = None,
+                     chunk_size: int = 10000) -> int:
+    """Recompute the candles from the transactions in the main database,
+    replacing the existing candles. The transactions are aggregated within 
+    the database (see sql_candles), so only the candles are read. Stop the 
+    matching engines of the securities being backfilled while it runs
+
+    :param sql_engine: the main database
+    :type sql_engine: SQLEngine
+    :param symbol: if specified, only the candles of this security are
+    recomputed, defaults to None
+    :type symbol: str, optional
+    :param chunk_size: number of candles inserted at a time, defaults to 10000
+    :type chunk_size: int, optional
+    :return: number of candles written
+    :rtype: int
+    """
+    session = sessionmaker(bind=sql_engine)()
+    candles = session.query(Candle)
+    if symbol is not None:
+        candles = candles.filter(Candle.security_symbol == symbol)
+    candles.delete(synchronize_session=False)
+    n_candles = 0
+    for span in CANDLE_SPANS:
+        rows = [{column.name: getattr(candle, column.name) 
+                 for column in Candle.__table__.columns}
+                for candle in sql_candles(session, span, symbol)]
+        for i in range(0, len(rows), chunk_size):
+            session.execute(Candle.__table__.insert(), rows[i:i + chunk_size])
+        n_candles += len(rows)
+    session.commit()
+    session.close()
+    logger.info(f"Backfilled {n_candles} candles")
+    return n_candles
@@ -1,6 +1,16 @@
 import argparse 
 from chives.db import SQLALCHEMY_URI, DEFAULT_SQLALCHEMY_URI
 
+
+def positive_int(value: str) -> int:
+    """Parse an integer argument that must be at least 1
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
 parser = argparse.ArgumentParser(prog="chives")
 subparsers = parser.add_subparsers(help="subcommand help", required=True,
 # TODO: https://stackoverflow.com/questions/18282403/argparse-with-required-subcommands/18283730
@@ -26,6 +36,58 @@ parser_start_engine.add_argument("--dry-run",
     dest="dry_run",
     action="store_true",
     default=False)
+parser_start_engine.add_argument("--n-shards",
+    help="Number of shards that incoming orders are routed to; defaults to 1",
+    dest="n_shards",
+    type=int,
+    default=1)
+parser_start_engine.add_argument("--shards",
+    help="Comma-separated list of shards to consume, such as 0,2; defaults to all shards",
+    dest="shards",
+    default="")
+parser_start_engine.add_argument("--order-book",
+    help="Keep an in-memory order book instead of querying the database for candidates",
+    dest="order_book",
+    action="store_true",
+    default=False)
+parser_start_engine.add_argument("--batch-size",
+    help="Maximum number of incoming orders matched per commit; defaults to 1",
+    dest="batch_size",
+    type=positive_int,
+    default=1)
+parser_start_engine.add_argument("--batch-timeout-ms",
+    help="Maximum milliseconds to wait for a batch to fill; defaults to 100",
+    dest="batch_timeout_ms",
+    type=positive_int,
+    default=100)
+parser_start_engine.add_argument("--journal",
+    help="Path to a local journal of incoming orders; if used, orders are acknowledged once journaled and replayed from it at restart",
+    dest="journal",
+    default="")
+parser_start_engine.add_argument("--snapshot-dir",
+    help="Directory of order book snapshots, used with --order-book to speed up startup",
+    dest="snapshot_dir",
+    default="")
+parser_start_engine.add_argument("--snapshot-every",
+    help="Number of incoming orders between two order book snapshots; defaults to 10000",
+    dest="snapshot_every",
+    type=int,
+    default=10000)
+parser_start_engine.add_argument("--async",
+    help="Run the matching engine on an asyncio event loop, receiving the next orders while the previous batch is committed",
+    dest="use_async",
+    action="store_true",
+    default=False)
+parser_start_engine.add_argument("--workers",
+    help="Number of matching engine processes that share the shards, restarted if they crash; send SIGTTIN/SIGTTOU to add/remove one; defaults to 1",
+    dest="workers",
+    type=int,
+    default=1)
+parser_start_engine.add_argument("--market-data",
+    help="Publish trades and changes to the top of the book to the market_data fanout exchange after each commit",
+    dest="market_data",
+    action="store_true",
+    default=False)
 
 # Create the parser for initdb command
 parser_initdb = subparsers.add_parser('initdb', 
@@ -35,6 +97,179 @@ parser_initdb.add_argument("-s", "--sql-uri",
     dest="sql_uri",
     default=f"{DEFAULT_SQLALCHEMY_URI}")
 
+# Create the parser for fixed_point command
+parser_fixed_point = subparsers.add_parser('fixed_point', 
+    help="Migrate an existing database to fixed-point prices and cash")
+parser_fixed_point.add_argument("-s", "--sql-uri",
+    help=f"Database URI; defaults to {DEFAULT_SQLALCHEMY_URI}",
+    dest="sql_uri",
+    default=f"{DEFAULT_SQLALCHEMY_URI}")
+parser_fixed_point.add_argument("--tick",
+    help="SYMBOL=TICK_SIZE, the tick size of a security in cash minor units; can be repeated",
+    dest="ticks",
+    action="append",
+    default=[])
+parser_fixed_point.add_argument("--minor-units",
+    help="Number of cash minor units per unit of cash; defaults to 100",
+    dest="minor_units",
+    type=int,
+    default=100)
+parser_fixed_point.add_argument("--fixed-point-cash",
+    help="Convert users' cash to integer minor units",
+    dest="fixed_point_cash",
+    action="store_true",
+    default=False)
+
+# Create the parser for backfill_candles command
+parser_backfill_candles = subparsers.add_parser('backfill_candles', 
+    help="Recompute the candles of the stock charts from past transactions")
+parser_backfill_candles.add_argument("-s", "--sql-uri",
+    help=f"Database URI; defaults to {DEFAULT_SQLALCHEMY_URI}",
+    dest="sql_uri",
+    default=f"{DEFAULT_SQLALCHEMY_URI}")
+parser_backfill_candles.add_argument("--symbol",
+    help="Only recompute the candles of this security; defaults to all securities",
+    dest="symbol",
+    default=None)
+
+# Create the parser for backfill_trade_owners command
+parser_backfill_trade_owners = subparsers.add_parser('backfill_trade_owners', 
+    help="Add and fill in the buyers and sellers of past transactions")
+parser_backfill_trade_owners.add_argument("-s", "--sql-uri",
+    help=f"Database URI; defaults to {DEFAULT_SQLALCHEMY_URI}",
+    dest="sql_uri",
+    default=f"{DEFAULT_SQLALCHEMY_URI}")
+
+# Create the parser for migrate command
+parser_migrate = subparsers.add_parser('migrate', 
+    help="Add the missing tables, columns and indexes to an existing database")
+parser_migrate.add_argument("-s", "--sql-uri",
+    help=f"Database URI; defaults to {DEFAULT_SQLALCHEMY_URI}",
+    dest="sql_uri",
+    default=f"{DEFAULT_SQLALCHEMY_URI}")
+
+# Create the parser for benchmark command
+parser_benchmark = subparsers.add_parser('benchmark', 
+    help="Benchmark the matching engine with pairs of asks and market bids")
+parser_benchmark.add_argument("--inproc",
+    help="Run the matching engine in this process and feed it through an in-process queue instead of RabbitMQ",
+    dest="inproc",
+    action="store_true",
+    default=False)
+parser_benchmark.add_argument("-n", "--rounds",
+    help="Number of pairs of ask and bid; defaults to 1000",
+    dest="n_rounds",
+    type=int,
+    default=1000)
+parser_benchmark.add_argument("-s", "--sql-uri",
+    help="Database URI, which is dropped and re-created; defaults to an in-memory SQLite database with --inproc, or else sqlite:////tmp/benchmark.chives.sqlite",
+    dest="sql_uri",
+    default=None)
+parser_benchmark.add_argument("--batch-size",
+    help="With --inproc, maximum number of orders matched per commit; defaults to 1",
+    dest="batch_size",
+    type=positive_int,
+    default=1)
+parser_benchmark.add_argument("--order-book",
+    help="With --inproc, keep an in-memory order book",
+    dest="order_book",
+    action="store_true",
+    default=False)
+parser_benchmark.add_argument("--rate",
+    help="With --inproc, queue orders at this many orders per second instead of one batch at a time",
+    dest="rate",
+    type=float,
+    default=None)
+parser_benchmark.add_argument("--n-shards",
+    help="Without --inproc, number of shards that orders are routed to; defaults to 1",
+    dest="n_shards",
+    type=int,
+    default=1)
+parser_benchmark.add_argument("--workload",
+    help="With --inproc, replay the users, companies and orders of this order stream file instead of pairs of asks and market bids",
+    dest="workload",
+    default=None)
+parser_benchmark.add_argument("--replay-arrivals",
+    help="With --workload, queue orders at their recorded arrival times",
+    dest="replay_arrivals",
+    action="store_true",
+    default=False)
+parser_benchmark.add_argument("--no-verify",
+    help="Do not check the orders and transactions for inconsistencies",
+    dest="verify",
+    action="store_false",
+    default=True)
+
+# Create the parser for workload command
+parser_workload = subparsers.add_parser('workload', 
+    help="Generate a seeded synthetic order stream file")
+parser_workload.add_argument("-o", "--output",
+    help="Path of the order stream file",
+    dest="output",
+    required=True)
+parser_workload.add_argument("-n", "--orders",
+    help="Number of orders; defaults to 10000",
+    dest="n_orders",
+    type=int,
+    default=10000)
+parser_workload.add_argument("--symbols",
+    help="Number of securities; defaults to 10",
+    dest="n_symbols",
+    type=int,
+    default=10)
+parser_workload.add_argument("--zipf",
+    help="Exponent of the Zipf popularity of the securities; defaults to 1.1",
+    dest="zipf_s",
+    type=float,
+    default=1.1)
+parser_workload.add_argument("--users",
+    help="Number of users; defaults to 100",
+    dest="n_users",
+    type=int,
+    default=100)
+parser_workload.add_argument("--rate",
+    help="Mean number of orders arriving per second; defaults to 100",
+    dest="rate",
+    type=float,
+    default=100.0)
+parser_workload.add_argument("--market",
+    help="Fraction of market orders; defaults to 0.1",
+    dest="market_ratio",
+    type=float,
+    default=0.1)
+parser_workload.add_argument("--aon",
+    help="Fraction of limit orders that are all-or-none; defaults to 0.05",
+    dest="aon_ratio",
+    type=float,
+    default=0.05)
+parser_workload.add_argument("--ioc",
+    help="Fraction of limit orders that are immediate-or-cancel; defaults to 0.1",
+    dest="ioc_ratio",
+    type=float,
+    default=0.1)
+parser_workload.add_argument("--volatility",
+    help="Standard deviation of the change of a security's log price per order; defaults to 0.002",
+    dest="volatility",
+    type=float,
+    default=0.002)
+parser_workload.add_argument("--seed",
+    help="Random seed; defaults to 0",
+    dest="seed",
+    type=int,
+    default=0)
+parser_workload.add_argument("-s", "--sql-uri",
+    help="If used, generate orders for the companies of this database, starting from their market prices",
+    dest="sql_uri",
+    default=None)
+
+# Create the parser for verify command
+parser_verify = subparsers.add_parser('verify', 
+    help="Check the orders and transactions of a database for inconsistencies")
+parser_verify.add_argument("-s", "--sql-uri",
+    help=f"Database URI; defaults to {DEFAULT_SQLALCHEMY_URI}",
+    dest="sql_uri",
+    default=f"{DEFAULT_SQLALCHEMY_URI}")
+
 # Create the parser for webserver command
 parser_webserver = subparsers.add_parser('webserver', 
     help="Initialize the database")
@@ -50,3 +285,13 @@ parser_webserver.add_argument("-s", "--sql-uri",
     help=f"Database URI; defaults to {DEFAULT_SQLALCHEMY_URI}",
     dest="sql_uri", 
     default=DEFAULT_SQLALCHEMY_URI)
+parser_webserver.add_argument("--n-shards",
+    help="Number of shards that incoming orders are routed to; defaults to 1",
+    dest="n_shards",
+    type=int,
+    default=1)
+parser_webserver.add_argument("--market-data",
+    help="Keep the last prices and quotes in memory from the market_data fanout exchange",
+    dest="market_data",
+    action="store_true",
+    default=False)
@@ -1,11 +1,32 @@
 DEFAULT_CONFIG = {
     "SQLALCHEMY_CONN": "sqlite:////tmp/chives.sqlite",
     "SQLALCHEMY_ECHO": False,
+    "SQLALCHEMY_POOL_SIZE": 5,
+    "SQLALCHEMY_MAX_OVERFLOW": 10,
+    "SQLALCHEMY_POOL_RECYCLE": 3600,
+    "SQLALCHEMY_POOL_PRE_PING": True,
     "RABBITMQ_HOST": "localhost",
     "RABBITMQ_PORT": 5672,
     "RABBITMQ_VHOST": "/",
     "RABBITMQ_LOGIN": "guest",
     "RABBITMQ_PASSWORD": "guest",
+    "ORDER_QUEUE_SHARDS": 1,
+    "ORDER_PUBLISHER_CONFIRMS": False,
+    "ORDER_BATCH_MAX_SIZE": 1000,
     "MATCHING_ENGINE_DRY_RUN": False,
+    "MATCHING_ENGINE_SHARDS": "",
+    "MATCHING_ENGINE_ORDER_BOOK": False,
+    "MATCHING_ENGINE_BATCH_SIZE": 1,
+    "MATCHING_ENGINE_BATCH_TIMEOUT_MS": 100,
+    "MATCHING_ENGINE_JOURNAL": "",
+    "MATCHING_ENGINE_SNAPSHOT_DIR": "",
+    "MATCHING_ENGINE_SNAPSHOT_EVERY": 10000,
+    "CASH_MINOR_UNITS": 100,
+    "FIXED_POINT_CASH": False,
+    "DEFAULT_TICK_SIZE": 0,
+    "MARKET_DATA": False,
+    "RESPONSE_CACHE_PATH": "",
+    "RESPONSE_CACHE_TTL": 60,
+    "RESPONSE_CACHE_MAX_ENTRIES": 1000,
     "SECRET_KEY": "dev"
 }
\ No newline at end of file
@@ -4,10 +4,11 @@ import logging
 import click 
 from flask import current_app, g, _app_ctx_stack
 from flask.cli import with_appcontext
-import pika
 from sqlalchemy import create_engine 
+from sqlalchemy.engine import Engine as SQLEngine
 from sqlalchemy.ext.declarative import declarative_base 
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 DEFAULT_SQLALCHEMY_URI = "sqlite:////tmp/chives.sqlite"
 SQLALCHEMY_URI = os.getenv("SQLALCHEMY_URI", "sqlite:////tmp/chives.sqlite")
@@ -23,14 +24,41 @@ logger.addHandler(chandle)
 Base = declarative_base()
 
 
+def create_sql_engine(config) -> SQLEngine:
+    """Create the engine, and with it the connection pool, that all requests 
+    of a webserver process share
+
+    :param config: the runtime configuration
+    :return: the engine
+    :rtype: SQLEngine
+    """
+    options = dict(
+        echo=config['SQLALCHEMY_ECHO'],
+        pool_pre_ping=bool(config['SQLALCHEMY_POOL_PRE_PING']),
+        pool_recycle=int(config['SQLALCHEMY_POOL_RECYCLE']))
+    # SQLite keeps its own pool class, which is not sized
+    if not config['SQLALCHEMY_CONN'].startswith("sqlite"):
+        options.update(
+            pool_size=int(config['SQLALCHEMY_POOL_SIZE']),
+            max_overflow=int(config['SQLALCHEMY_MAX_OVERFLOW']))
+    return create_engine(config['SQLALCHEMY_CONN'], **options)
+
+def pool_stats(engine: SQLEngine) -> dict:
+    """Return the state of an engine's connection pool, for monitoring
+    """
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), 
+            checked_out=pool.checkedout(), overflow=pool.overflow())
+    return stats
+
 def get_db():
+    """Return the session of the current application context, which is 
+    bound to the application's engine and removed at teardown
+    """
     if 'db_session' not in g:
-        engine = create_engine(
-            current_app.config['SQLALCHEMY_CONN'], 
-            echo=current_app.config['SQLALCHEMY_ECHO'])
-        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        g.db_session = scoped_session(
-            Session, scopefunc=_app_ctx_stack.__ident_func__)
+        g.db_session = current_app.extensions['chives_db_session']
         logger.debug(f"Spawned scoped session for webserver")
     return g.db_session
 
@@ -40,38 +68,40 @@ def close_db(e=None):
         db_session.remove()
     logger.debug(f"ORM Session closed")
 
-def get_mq() -> pika.BlockingConnection:
-    """If the webserver application has no active connection to the RabbitMQ 
-    server, then create one and append it to the flask G. Otherwise, return 
-    the connection on the flask G
-
-    :return: an active connection
-    :rtype: pika.BlockingConnection
+def get_market_data():
+    """Return the application's MarketDataCache, starting its consumer in 
+    this process on first use, or None if the market data fan-out is disabled
     """
-    if 'mq_conn' not in g:
-        app_config = current_app.config
-        mq_creds = pika.PlainCredentials(
-            app_config['RABBITMQ_LOGIN'], app_config['RABBITMQ_PASSWORD'])
-        mq_conn_params = pika.ConnectionParameters(
-            app_config['RABBITMQ_HOST'], app_config['RABBITMQ_PORT'], 
-            app_config['RABBITMQ_VHOST'], mq_creds
-        )
-        g.mq_conn = pika.BlockingConnection(mq_conn_params)
-        logger.debug(f"Spawned RabbitMQ connection")
-    return g.mq_conn
+    market_data = current_app.extensions.get('chives_market_data')
+    if market_data is not None:
+        market_data.start()
+    return market_data
 
-def close_mq(e=None):
-    """Close the MQ connection; this method will be added to teardown_appcontext
+def get_response_cache():
+    """Return the application's ResponseCache, or None if it is disabled
+    """
+    return current_app.extensions.get('chives_response_cache')
 
-    :param e: [description], defaults to None
-    :type e: [type], optional
+def get_publisher():
+    """Return the OrderPublisher of the application, creating it on first use 
+    so that pages that do not submit orders never connect to RabbitMQ
     """
-    mq_conn: pika.BlockingConnection = g.pop('mq_conn', None)
-    if mq_conn is not None:
-        mq_conn.close()
-    logger.debug(f"Closed RabbitMQ connection")
+    publisher = current_app.extensions.get('chives_order_publisher')
+    if publisher is None:
+        from chives.routing import OrderPublisher, connection_parameters
+        rc = current_app.config
+        publisher = OrderPublisher(connection_parameters(rc),
+            int(rc['ORDER_QUEUE_SHARDS']), 
+            confirm=bool(rc['ORDER_PUBLISHER_CONFIRMS']))
+        publisher = current_app.extensions.setdefault(
+            'chives_order_publisher', publisher)
+        logger.debug(f"Created order publisher")
+    return publisher
 
 
-def init_app(app):
+def init_app(app, sql_engine: SQLEngine):
+    app.extensions['chives_sql_engine'] = sql_engine
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=sql_engine)
+    app.extensions['chives_db_session'] = scoped_session(
+        Session, scopefunc=_app_ctx_stack.__ident_func__)
     app.teardown_appcontext(close_db)
-    app.teardown_appcontext(close_mq)
@@ -0,0 +1,184 @@
+"""Fixed-point prices and cash. A security whose company has a tick_size
+trades at integer multiples of that tick: each order and transaction carries,
+next to its floating-point price, its price_ticks, so that the matching engine
+compares and indexes prices as integers. The tick size is itself an integer
+number of cash minor units (e.g. cents, with CASH_MINOR_UNITS = 100), so with
+fixed-point cash enabled (FIXED_POINT_CASH), the cash volume of a trade is the
+exact integer price_ticks * tick_size * size in minor units. The
+floating-point columns are kept as derived copies for display.
+"""
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN
+import logging
+import typing as ty
+
+from sqlalchemy import func
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.migrations import add_missing_columns
+from chives.models import Asset, Company, Order, Transaction
+
+
+logger = logging.getLogger("chives.fixedpoint")
+
+
+def _decimal(value: float) -> Decimal:
+    # repr() is the shortest string that round-trips the float, so that
+    # 10.07 is read as 10.07 instead of 10.0699999999999996
+    return Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+
+
+def price_to_ticks(price: float, tick_size: int, minor_units: int,
+                   side: ty.Optional[str] = None) -> int:
+    """Convert a price into an integer number of ticks. Prices that are not
+    a multiple of the tick are rounded in favor of the order's owner: bids
+    are rounded down and asks are rounded up; without a side, prices are
+    rounded to the nearest tick
+
+    :param price: the price in units of cash
+    :type price: float
+    :param tick_size: number of cash minor units per tick
+    :type tick_size: int
+    :param minor_units: number of cash minor units per unit of cash
+    :type minor_units: int
+    :param side: "ask" or "bid", defaults to None
+    :type side: str, optional
+    :return: the price in ticks
+    :rtype: int
+    """
+    rounding = {"bid": ROUND_FLOOR, "ask": ROUND_CEILING}.get(
+        side, ROUND_HALF_EVEN)
+    ticks = _decimal(price) * minor_units / tick_size
+    return int(ticks.to_integral_value(rounding=rounding))
+
+
+def ticks_to_price(ticks: int, tick_size: int, minor_units: int) -> float:
+    """Convert an integer number of ticks back into a price
+    """
+    return float(Decimal(ticks * tick_size) / minor_units)
+
+
+def cash_to_minor(amount: float, minor_units: int) -> int:
+    """Convert an amount of cash into an integer number of minor units,
+    rounding to the nearest minor unit
+    """
+    return int((_decimal(amount) * minor_units).to_integral_value(
+        rounding=ROUND_HALF_EVEN))
+
+
+def minor_to_cash(minor: int, minor_units: int) -> float:
+    """Convert an integer number of minor units back into an amount of cash
+    """
+    return float(Decimal(minor) / minor_units)
+
+
+def quantize_order(order: Order, tick_size: ty.Optional[int],
+                   minor_units: int):
+    """Set the price_ticks of a priced order whose security trades in ticks,
+    and replace its price with the exact price of that many ticks. Orders
+    without a price, of securities without a tick size, or that already have
+    their price_ticks, are left unchanged
+
+    :param order: the order
+    :type order: Order
+    :param tick_size: the tick size of the order's security
+    :type tick_size: ty.Optional[int]
+    :param minor_units: number of cash minor units per unit of cash
+    :type minor_units: int
+    """
+    if order.price is None or tick_size is None \
+        or order.price_ticks is not None:
+        return
+    order.price_ticks = price_to_ticks(
+        order.price, tick_size, minor_units, order.side)
+    order.price = ticks_to_price(order.price_ticks, tick_size, minor_units)
+
+
+def add_cash(cash: Asset, amount: float, minor_units: int):
+    """Add an amount (which can be negative) to a user's cash. With
+    fixed-point cash, the minor units are updated and the amount is derived
+    from them; entries that have no minor units yet are converted first
+
+    :param cash: the user's "_CASH" asset
+    :type cash: Asset
+    :param amount: the amount of cash to add
+    :type amount: float
+    :param minor_units: number of cash minor units per unit of cash; 0 if
+    cash is not fixed-point, in which case only the amount is updated
+    :type minor_units: int
+    """
+    if not minor_units:
+        cash.asset_amount = (cash.asset_amount or 0) + amount
+        return
+    minor = cash.asset_amount_minor
+    if minor is None:
+        minor = cash_to_minor(cash.asset_amount or 0, minor_units)
+    cash.asset_amount_minor = minor + cash_to_minor(amount, minor_units)
+    cash.asset_amount = minor_to_cash(cash.asset_amount_minor, minor_units)
+
+
+def fixed_point_minor_units(config: ty.Dict) -> int:
+    """Return the minor units to pass to add_cash under a runtime
+    configuration: CASH_MINOR_UNITS if FIXED_POINT_CASH is set, or else 0
+    """
+    return int(config["CASH_MINOR_UNITS"]) if config["FIXED_POINT_CASH"] else 0
+
+
+def migrate_fixed_point(sql_engine: SQLEngine, tick_sizes: ty.Dict[str, int],
+                        minor_units: int = 100, fixed_point_cash: bool = False):
+    """Bring an existing database up to date for fixed-point prices and cash:
+    1.  add the fixed-point columns if the tables were created without them, 
+        with chives.migrations.add_missing_columns
+    2.  for each symbol in tick_sizes, set its company's tick size, then the 
+        price_ticks of its orders and transactions from their prices, rounded 
+        to the nearest tick; prices and market prices are rounded to the tick
+    3.  if fixed_point_cash, convert users' cash without minor units yet
+    The matching engines should be stopped while migrating, and their order 
+    book snapshots deleted afterwards, since they read tick sizes at startup
+
+    :param sql_engine: the engine of the main database
+    :type sql_engine: SQLEngine
+    :param tick_sizes: a mapping from security symbols to their tick sizes in 
+    cash minor units
+    :type tick_sizes: ty.Dict[str, int]
+    :param minor_units: number of cash minor units per unit of cash, defaults 
+    to 100
+    :type minor_units: int, optional
+    :param fixed_point_cash: if True, convert users' cash to minor units, 
+    defaults to False
+    :type fixed_point_cash: bool, optional
+    """
+    for model in [Asset, Company, Order, Transaction]:
+        add_missing_columns(sql_engine, model.__table__)
+    scale = float(minor_units)
+    with sql_engine.begin() as conn:
+        for symbol, tick_size in tick_sizes.items():
+            companies = Company.__table__
+            conn.execute(companies.update().where(
+                companies.c.symbol == symbol).values(
+                    tick_size=tick_size, 
+                    market_price=func.round(
+                        companies.c.market_price * scale / tick_size
+                    ) * tick_size / scale))
+            for model in [Order, Transaction]:
+                table = model.__table__
+                priced = (table.c.security_symbol == symbol) \
+                    & (table.c.price != None)
+                # Two statements, since SQLite and MySQL disagree on whether 
+                # later assignments see earlier ones
+                conn.execute(table.update().where(priced).values(
+                    price_ticks=func.round(table.c.price * scale / tick_size)))
+                result = conn.execute(table.update().where(priced).values(
+                    price=table.c.price_ticks * tick_size / scale))
+                logger.info(f"Set price_ticks of {result.rowcount} "
+                            f"{table.name} of {symbol}")
+
+        if fixed_point_cash:
+            assets = Asset.__table__
+            unconverted = (assets.c.asset_symbol == "_CASH") \
+                & (assets.c.asset_amount_minor == None)
+            conn.execute(assets.update().where(unconverted).values(
+                asset_amount_minor=func.round(assets.c.asset_amount * scale)))
+            conn.execute(assets.update().where(
+                assets.c.asset_symbol == "_CASH").values(
+                    asset_amount=assets.c.asset_amount_minor / scale))
+            logger.info(f"Converted cash to {minor_units} minor units")
@@ -0,0 +1,107 @@
+"""Users' trade histories. Each transaction carries the owners of its bid and
+ask in buyer_id and seller_id, which are indexed along with transact_dttm, so
+a page of a user's transactions is read from the two indexes, newest first,
+and the next page starts after the last transaction of the previous one
+(keyset pagination) instead of at an offset.
+"""
+import datetime as dt
+import logging
+import typing as ty
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import Session
+
+from chives.migrations import add_missing_columns, create_missing_indexes
+from chives.models import Order, Transaction
+
+
+logger = logging.getLogger("chives.history")
+
+# Identifies the last transaction of a page: its transact_dttm and
+# transaction_id
+Cursor = ty.Tuple[dt.datetime, int]
+
+
+def user_transactions(session: Session, user_id: int, limit: int = 50,
+                      before: ty.Optional[Cursor] = None
+                      ) -> ty.List[Transaction]:
+    """Return the latest transactions in which a user bought or sold,
+    ordered by transact_dttm and then transaction_id, newest first
+
+    :param session: an ORM session
+    :type session: Session
+    :param user_id: the buyer or seller
+    :type user_id: int
+    :param limit: the maximum number of transactions, defaults to 50
+    :type limit: int, optional
+    :param before: only return transactions older than this cursor, which is
+    page_cursor of the previous page; defaults to None
+    :type before: Cursor, optional
+    :rtype: ty.List[Transaction]
+    """
+    newest_first = [Transaction.transact_dttm.desc(),
+                    Transaction.transaction_id.desc()]
+    older = True
+    if before is not None:
+        before_dttm, before_id = before
+        older = or_(Transaction.transact_dttm < before_dttm, and_(
+            Transaction.transact_dttm == before_dttm,
+            Transaction.transaction_id < before_id))
+    # One query per index, since a disjunction of the two owners would not
+    # use either of them
+    transactions = dict()
+    for owner in [Transaction.buyer_id, Transaction.seller_id]:
+        for t in session.query(Transaction).filter(
+                owner == user_id, older).order_by(*newest_first).limit(limit):
+            transactions[t.transaction_id] = t
+    return sorted(transactions.values(),
+                  key=lambda t: (t.transact_dttm, t.transaction_id),
+                  reverse=True)[:limit]
+
+
+def page_cursor(transactions: ty.List[Transaction]) -> ty.Optional[Cursor]:
+    """Return the cursor of the page after a page of transactions
+    """
+    if not transactions:
+        return None
+    return transactions[-1].transact_dttm, transactions[-1].transaction_id
+
+
+def backfill_trade_owners(sql_engine: SQLEngine, chunk_size: int = 10000):
+    """Bring an existing database up to date for the trade histories: add
+    buyer_id and seller_id, and the indexes of the transactions, if the table 
+    was created without them, then fill them in from the owners of the orders.
+    Transactions are updated in chunks of chunk_size transaction_id's, each
+    committed on its own, so the backfill can be stopped and run again
+
+    :param sql_engine: the engine of the main database
+    :type sql_engine: SQLEngine
+    :param chunk_size: number of transaction_id's updated per commit,
+    defaults to 10000
+    :type chunk_size: int, optional
+    """
+    table = Transaction.__table__
+    orders = Order.__table__
+    add_missing_columns(sql_engine, table)
+    create_missing_indexes(sql_engine, table)
+
+    def owner_of(order_id_col):
+        return select([orders.c.owner_id]).where(
+            orders.c.order_id == order_id_col).as_scalar()
+
+    with sql_engine.connect() as conn:
+        max_id = conn.execute(select([table.c.transaction_id]).order_by(
+            table.c.transaction_id.desc()).limit(1)).scalar() or 0
+    n_updated = 0
+    for start in range(0, max_id, chunk_size):
+        in_chunk = (table.c.transaction_id > start) \
+            & (table.c.transaction_id <= start + chunk_size)
+        with sql_engine.begin() as conn:
+            result = conn.execute(table.update().where(
+                in_chunk & ((table.c.buyer_id == None)
+                            | (table.c.seller_id == None))
+            ).values(buyer_id=owner_of(table.c.bid_id),
+                     seller_id=owner_of(table.c.ask_id)))
+            n_updated += result.rowcount
+    logger.info(f"Filled in the owners of {n_updated} transactions")
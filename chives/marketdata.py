@@ -0,0 +1,267 @@
+"""Market data fan-out. After each commit, the matching engine publishes the
+trades it made ("trade" events) and the changes to the best bid and ask of the
+securities it matched ("quote" events) to a fanout exchange, so that every
+subscriber receives every event. Consumers keep a MarketDataCache of the last
+price and the top of the book of each security, so that they can answer
+quotes without querying the main database.
+
+LocalMarketDataBus is an in-process stand-in for the fanout exchange.
+"""
+from collections import namedtuple
+import json
+import logging
+import os
+import threading
+import typing as ty
+
+import pika
+from sqlalchemy import func
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
+
+from chives.models import Company, Order
+
+
+MARKET_DATA_EXCHANGE = "market_data"
+
+logger = logging.getLogger("chives.marketdata")
+
+# The best bid and ask of a security and the total size at each of them;
+# prices are None if that side of the book is empty
+Quote = namedtuple("Quote", ["bid", "bid_size", "ask", "ask_size"])
+EMPTY_QUOTE = Quote(None, 0, None, 0)
+
+
+def top_of_book(session: Session, symbol: str) -> Quote:
+    """Read the best bid and ask of a security from the active orders in the
+    main database
+
+    :param session: a session bound to the main database
+    :type session: Session
+    :param symbol: the security symbol
+    :type symbol: str
+    :return: the top of the book
+    :rtype: Quote
+    """
+    best = []
+    for side, best_price in [("bid", Order.price.desc()),
+                             ("ask", Order.price.asc())]:
+        level = session.query(Order.price, func.sum(Order.size)).filter(
+            (Order.security_symbol == symbol) & (Order.side == side)
+            & (Order.active == True) & (Order.price != None)
+        ).group_by(Order.price).order_by(best_price).first()
+        best.extend(level if level is not None else (None, 0))
+    return Quote(*best)
+
+
+def trade_event(transaction, aggressor_side: str) -> ty.Dict:
+    """Return the trade event of a flushed transaction
+    """
+    return {
+        "type": "trade",
+        "symbol": transaction.security_symbol,
+        "transaction_id": transaction.transaction_id,
+        "price": transaction.price,
+        "size": transaction.size,
+        "aggressor_side": aggressor_side,
+        "transact_dttm": transaction.transact_dttm.isoformat(),
+    }
+
+
+def quote_event(symbol: str, quote: Quote) -> ty.Dict:
+    return dict(type="quote", symbol=symbol, **quote._asdict())
+
+
+class LocalMarketDataBus:
+    """An in-process stand-in for the fanout exchange: every published event
+    is handed to every subscriber, synchronously
+    """
+    def __init__(self):
+        self.subscribers: ty.List[ty.Callable[[ty.Dict], None]] = []
+
+    def subscribe(self, callback: ty.Callable[[ty.Dict], None]):
+        self.subscribers.append(callback)
+
+    def publish(self, events: ty.List[ty.Dict]):
+        for event in events:
+            for callback in self.subscribers:
+                callback(event)
+
+
+class AmqpMarketDataPublisher:
+    """Publish market data events to the fanout exchange on RabbitMQ. The
+    connection is opened on the first publish, so that it belongs to the
+    thread that publishes, and is reopened on the next publish after it fails
+    """
+    def __init__(self, conn_params: pika.ConnectionParameters):
+        self.conn_params = conn_params
+        self.conn: ty.Optional[pika.BlockingConnection] = None
+        self.ch = None
+
+    def publish(self, events: ty.List[ty.Dict]):
+        try:
+            if self.conn is None or self.conn.is_closed:
+                self.conn = pika.BlockingConnection(self.conn_params)
+                self.ch = self.conn.channel()
+                self.ch.exchange_declare(
+                    exchange=MARKET_DATA_EXCHANGE, exchange_type="fanout")
+            for event in events:
+                self.ch.basic_publish(exchange=MARKET_DATA_EXCHANGE,
+                                      routing_key="", body=json.dumps(event))
+        except pika.exceptions.AMQPError as e:
+            logger.error(f"Failed to publish {len(events)} market data "
+                         f"events: {e!r}")
+            self.conn = None
+
+
+class MarketDataCache:
+    """An in-memory, thread-safe cache of the last price and the top of the
+    book of each security, kept up to date by market data events
+    """
+    def __init__(self,
+                 conn_params: ty.Optional[pika.ConnectionParameters] = None,
+                 sql_engine: ty.Optional[SQLEngine] = None):
+        """
+        :param conn_params: if specified, the parameters for connecting to 
+        RabbitMQ, with which self.start consumes the market data, defaults to 
+        None
+        :type conn_params: pika.ConnectionParameters, optional
+        :param sql_engine: the main database that self.start primes the cache 
+        from, defaults to None
+        :type sql_engine: SQLEngine, optional
+        """
+        self.lock = threading.Lock()
+        self.last_prices: ty.Dict[str, float] = dict()
+        self.quotes: ty.Dict[str, Quote] = dict()
+        self.conn_params = conn_params
+        self.sql_engine = sql_engine
+        self.start_lock = threading.Lock()
+        self.pid: ty.Optional[int] = None
+        self.consumer: ty.Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the consumer thread if it is not running in this process, 
+        then prime the cache from the main database. Threads do not survive a 
+        fork, so a cache inherited from the parent of a fork, such as the 
+        uwsgi master, is emptied and started again in the child
+        """
+        if self.conn_params is None or self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            with self.lock:
+                self.last_prices, self.quotes = dict(), dict()
+            self.consumer = start_market_data_consumer(self, self.conn_params)
+            session = sessionmaker(bind=self.sql_engine)()
+            try:
+                self.load(session)
+            finally:
+                session.close()
+            self.pid = os.getpid()
+
+    def load(self, session: Session, overwrite: bool = False):
+        """Prime the cache with the market price and the top of the book of
+        every company from the main database
+
+        :param session: a session of the main database
+        :type session: Session
+        :param overwrite: if True, replace the cached entries; otherwise keep 
+        those already set by events, defaults to False
+        :type overwrite: bool, optional
+        """
+        for symbol, market_price in session.query(
+                Company.symbol, Company.market_price).all():
+            quote = top_of_book(session, symbol)
+            with self.lock:
+                if overwrite:
+                    self.last_prices[symbol] = market_price
+                    self.quotes[symbol] = quote
+                else:
+                    self.last_prices.setdefault(symbol, market_price)
+                    self.quotes.setdefault(symbol, quote)
+
+    def reload(self):
+        """Replace the cached entries with those of the main database, e.g. 
+        after missing the events published while disconnected
+        """
+        if self.sql_engine is None:
+            return
+        session = sessionmaker(bind=self.sql_engine)()
+        try:
+            self.load(session, overwrite=True)
+        finally:
+            session.close()
+
+    def apply(self, event: ty.Dict):
+        """Update the cache with a market data event
+        """
+        with self.lock:
+            if event["type"] == "trade":
+                self.last_prices[event["symbol"]] = event["price"]
+            elif event["type"] == "quote":
+                self.quotes[event["symbol"]] = Quote(
+                    event["bid"], event["bid_size"],
+                    event["ask"], event["ask_size"])
+
+    def last_price(self, symbol: str) -> ty.Optional[float]:
+        with self.lock:
+            return self.last_prices.get(symbol)
+
+    def best_bid_ask(self, symbol: str) -> ty.Optional[Quote]:
+        with self.lock:
+            return self.quotes.get(symbol)
+
+    def __contains__(self, symbol: str):
+        with self.lock:
+            return symbol in self.last_prices or symbol in self.quotes
+
+
+def start_market_data_consumer(cache: MarketDataCache,
+                               conn_params: pika.ConnectionParameters
+                               ) -> threading.Thread:
+    """Start a daemon thread that binds an exclusive queue to the fanout
+    exchange, and applies each event it receives to the cache. If the
+    connection is lost, the thread reconnects after a second. On each 
+    connection, the cache is reloaded from the main database once the queue 
+    is bound, since the events published while disconnected are lost; the 
+    events published since then are applied after it
+
+    :param cache: the cache to keep up to date
+    :type cache: MarketDataCache
+    :param conn_params: the parameters for connecting to RabbitMQ
+    :type conn_params: pika.ConnectionParameters
+    :return: the consumer thread
+    :rtype: threading.Thread
+    """
+    def on_message(ch, method, properties, body):
+        cache.apply(json.loads(body))
+
+    def consume():
+        while True:
+            try:
+                conn = pika.BlockingConnection(conn_params)
+                ch = conn.channel()
+                ch.exchange_declare(
+                    exchange=MARKET_DATA_EXCHANGE, exchange_type="fanout")
+                queue = ch.queue_declare(queue="", exclusive=True).method.queue
+                ch.queue_bind(queue=queue, exchange=MARKET_DATA_EXCHANGE)
+                cache.reload()
+                ch.basic_consume(queue=queue, on_message_callback=on_message,
+                                 auto_ack=True)
+                ch.start_consuming()
+            except pika.exceptions.AMQPError as e:
+                logger.error(f"Market data consumer disconnected: {e!r}")
+                threading.Event().wait(1)
+            except SQLAlchemyError as e:
+                # Reconnect, and reload again, rather than serve stale prices
+                logger.error(f"Market data consumer failed to reload: {e!r}")
+                if conn.is_open:
+                    conn.close()
+                threading.Event().wait(1)
+
+    thread = threading.Thread(
+        target=consume, name="market-data-consumer", daemon=True)
+    thread.start()
+    return thread
@@ -1,2 +1,5 @@
 from chives.matchingengine.matchingengine import (
     MatchResult, MatchingEngine, start_engine)
+from chives.matchingengine.aioengine import (
+    AsyncMatchingService, LocalOrderQueue, start_engine_async)
+from chives.matchingengine.pool import EnginePool, start_engine_pool
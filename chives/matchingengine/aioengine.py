@@ -0,0 +1,320 @@
+"""An asyncio-based matching engine service. Receiving messages, matching and
+committing are pipelined: the event loop keeps receiving messages and
+collecting the next batch while the previous batch is matched and committed
+on a dedicated database thread. Batches are committed one at a time, in the
+order their messages were received, so that the orders of each security are
+still matched in the order they were submitted.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import typing as ty
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from chives.configs import DEFAULT_CONFIG, environment_overwrite
+from chives.matchingengine.matchingengine import (
+    MatchingEngine, connection_parameters, create_matching_engine)
+from chives.models import Order
+from chives.routing import declare_order_routing, parse_shards, shard_queue
+
+
+logger = logging.getLogger("chives.matchingengine")
+
+# Called with the delivery tag and the body of each received message
+DeliverCallback = ty.Callable[[int, bytes], None]
+
+
+class LocalOrderQueue:
+    """An in-process stand-in for the RabbitMQ order queues, used for testing
+    and for running the service without a broker. Messages are delivered in
+    the order they are published, with increasing delivery tags; like
+    everything else on the event loop, publish must be called from the event
+    loop's thread, or before the service starts
+    """
+    def __init__(self):
+        self.pending: ty.Deque[bytes] = deque()
+        self.deliver: ty.Optional[DeliverCallback] = None
+        self.next_tag = 1
+        # The largest delivery tag acknowledged so far
+        self.acked_tag = 0
+        # Done once the source is closed; fails if it is lost, see 
+        # AmqpOrderSource
+        self.closed: ty.Optional[asyncio.Future] = None
+
+    def publish(self, body: ty.Union[str, bytes]):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.pending.append(body)
+        self._flush()
+
+    def _flush(self):
+        while self.deliver is not None and len(self.pending) > 0:
+            tag, self.next_tag = self.next_tag, self.next_tag + 1
+            self.deliver(tag, self.pending.popleft())
+
+    async def start(self, deliver: DeliverCallback, prefetch_count: int):
+        self.closed = asyncio.get_running_loop().create_future()
+        self.deliver = deliver
+        self._flush()
+
+    def ack(self, delivery_tag: int):
+        """Acknowledge all messages up to and including the delivery tag
+        """
+        self.acked_tag = max(self.acked_tag, delivery_tag)
+
+    def close(self):
+        self.deliver = None
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(None)
+
+
+class AmqpOrderSource:
+    """Consume the shard queues on RabbitMQ with pika's asyncio adapter, so
+    that messages are received on the event loop. If the broker closes the 
+    connection or the channel, self.closed fails with a ConnectionError, 
+    which stops the service so that its supervisor can restart it
+    """
+    def __init__(self, conn_params: pika.ConnectionParameters,
+                 queues: ty.List[str], n_shards: int):
+        self.conn_params = conn_params
+        self.queues = queues
+        self.n_shards = n_shards
+        self.conn: ty.Optional[AsyncioConnection] = None
+        self.ch = None
+        self.closed: ty.Optional[asyncio.Future] = None
+
+    async def start(self, deliver: DeliverCallback, prefetch_count: int):
+        """Open a connection and a channel, declare the order routing, then
+        start consuming the queues with up to prefetch_count unacknowledged
+        messages across all of them
+
+        :param deliver: the callback for each received message
+        :type deliver: DeliverCallback
+        :param prefetch_count: maximum number of unacknowledged messages
+        :type prefetch_count: int
+        """
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+        self.closed = loop.create_future()
+        self.conn = AsyncioConnection(
+            self.conn_params,
+            on_open_callback=opened.set_result,
+            on_open_error_callback=lambda conn, e: opened.set_exception(
+                e if isinstance(e, BaseException) else ConnectionError(e)),
+            on_close_callback=self.on_close,
+            custom_ioloop=loop)
+        await opened
+        channel_opened = loop.create_future()
+        self.conn.channel(on_open_callback=channel_opened.set_result)
+        self.ch = await channel_opened
+        self.ch.add_on_close_callback(self.on_channel_close)
+
+        # Pika queues up RPCs on a channel, so they are sent one at a time
+        # without waiting for each of them here
+        declare_order_routing(self.ch, self.n_shards)
+        self.ch.basic_qos(prefetch_count=prefetch_count, global_qos=True)
+        for queue_name in self.queues:
+            self.ch.basic_consume(
+                queue=queue_name,
+                on_message_callback=lambda ch, method, properties, body:
+                    deliver(method.delivery_tag, body))
+        logger.info(f"Consuming {self.queues} on the event loop")
+
+    def ack(self, delivery_tag: int):
+        """Acknowledge all messages up to and including the delivery tag
+        """
+        self.ch.basic_ack(delivery_tag=delivery_tag, multiple=True)
+
+    def on_channel_close(self, ch, reason):
+        if self.conn is not None and self.conn.is_open:
+            self.conn.close()
+        self.on_close(self.conn, reason)
+
+    def on_close(self, conn: AsyncioConnection, reason):
+        if self.closed is None or self.closed.done():
+            return
+        logger.error(f"Order source disconnected: {reason!r}")
+        self.closed.set_exception(ConnectionError(
+            f"RabbitMQ closed the order source: {reason!r}"))
+
+    def close(self):
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(None)
+        if self.conn is not None and not self.conn.is_closed:
+            self.conn.close()
+
+
+class AsyncMatchingService:
+    """Run a matching engine behind an order source in three overlapping
+    stages:
+    1.  the event loop receives messages from the order source
+    2.  a collector groups them into batches of up to batch_size messages,
+        waiting at most batch_timeout seconds for a batch to fill; if the
+        matching engine has a journal, the batch is journaled on its own
+        thread, then acknowledged
+    3.  a writer matches and commits each batch with heartbeat_batch on a
+        single database thread, then acknowledges it if there is no journal
+    At most max_pending_batches batches wait between the last two stages, so
+    that the service stops acknowledging messages when the main database
+    falls behind.
+    """
+    def __init__(self, me: MatchingEngine, source, batch_size: int = 1,
+                 batch_timeout: float = 0.1, max_pending_batches: int = 2,
+                 dry_run: bool = False):
+        """
+        :param me: the matching engine
+        :type me: MatchingEngine
+        :param source: a LocalOrderQueue or an AmqpOrderSource
+        :param batch_size: maximum number of orders matched per commit,
+        defaults to 1
+        :type batch_size: int, optional
+        :param batch_timeout: maximum number of seconds to wait for a batch to
+        fill, defaults to 0.1
+        :type batch_timeout: float, optional
+        :param max_pending_batches: maximum number of batches waiting to be
+        committed, defaults to 2
+        :type max_pending_batches: int, optional
+        :param dry_run: if True, batches are acknowledged without being
+        matched, defaults to False
+        :type dry_run: bool, optional
+        """
+        self.me = me
+        self.source = source
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.max_pending_batches = max_pending_batches
+        self.dry_run = dry_run
+        self.n_committed = 0
+
+    def deliver(self, delivery_tag: int, body: bytes):
+        logger.debug("Received %r" % body)
+        self.received.put_nowait((delivery_tag, body))
+
+    async def collect(self):
+        """Group received messages into batches, journal them if there is a
+        journal, then hand them to the writer
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.received.get()]
+            deadline = loop.time() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                if not self.received.empty():
+                    batch.append(self.received.get_nowait())
+                    continue
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self.received.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            last_tag = batch[-1][0]
+            orders, bodies = self.parse([body for _, body in batch])
+            records = None
+            if self.me.journal is not None and not self.dry_run:
+                records = []
+                if bodies:
+                    records = await loop.run_in_executor(
+                        self.journal_executor, self.me.journal_inputs, bodies)
+                    orders = [Order(**record.body) for record in records]
+                self.source.ack(last_tag)
+            await self.pending.put((last_tag, orders, records))
+
+    def parse(self, bodies: ty.List[bytes]
+              ) -> ty.Tuple[ty.List[Order], ty.List[bytes]]:
+        """Parse the incoming orders of a batch of message bodies, leaving 
+        out the malformed messages, which would fail every attempt to match 
+        them; those are logged and acknowledged along with the rest of the 
+        batch
+
+        :return: the incoming orders, and the message bodies they come from
+        :rtype: ty.Tuple[ty.List[Order], ty.List[bytes]]
+        """
+        orders, parsed = [], []
+        for body in bodies:
+            try:
+                orders.append(Order.from_json(body))
+                parsed.append(body)
+            except Exception as e:
+                logger.error(f"Discarding malformed message {body!r}: {e!r}")
+        return orders, parsed
+
+    async def write(self, max_orders: ty.Optional[int] = None):
+        """Match and commit the batches in the order they were collected
+
+        :param max_orders: if specified, return after this many orders are
+        committed, defaults to None
+        :type max_orders: int, optional
+        """
+        loop = asyncio.get_running_loop()
+        while max_orders is None or self.n_committed < max_orders:
+            last_tag, orders, records = await self.pending.get()
+            if orders and not self.dry_run:
+                await loop.run_in_executor(
+                    self.db_executor, self.me.heartbeat_batch, orders, records)
+            if records is None:
+                self.source.ack(last_tag)
+            self.n_committed += len(orders)
+
+    async def run(self, max_orders: ty.Optional[int] = None):
+        """Start consuming the order source and run the pipeline, either
+        forever or until max_orders orders are committed
+
+        :param max_orders: see self.write, defaults to None
+        :type max_orders: int, optional
+        """
+        self.received: asyncio.Queue = asyncio.Queue()
+        self.pending: asyncio.Queue = asyncio.Queue(
+            maxsize=self.max_pending_batches)
+        self.db_executor = ThreadPoolExecutor(1, thread_name_prefix="me-db")
+        self.journal_executor = ThreadPoolExecutor(
+            1, thread_name_prefix="me-journal")
+        # Enough unacknowledged messages for the batches being collected,
+        # waiting, and committed
+        await self.source.start(self.deliver,
+            prefetch_count=(self.max_pending_batches + 2) * self.batch_size)
+        collector = asyncio.ensure_future(self.collect())
+        writer = asyncio.ensure_future(self.write(max_orders))
+        closed = self.source.closed
+        try:
+            # The collector and the source only finish if they fail; the 
+            # writer also finishes once max_orders are committed
+            done, _ = await asyncio.wait([collector, writer, closed], 
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for future in (closed, collector, writer):
+                if future in done and not future.cancelled():
+                    future.result()
+        finally:
+            collector.cancel()
+            writer.cancel()
+            self.source.close()
+            self.db_executor.shutdown()
+            self.journal_executor.shutdown()
+
+
+def start_engine_async(config_overwrite: ty.Optional[ty.Dict] = None):
+    """Like chives.matchingengine.start_engine, but run the matching engine
+    as an AsyncMatchingService on an asyncio event loop
+
+    :param config_overwrite: overwriting runtime configuration
+    :type config_overwrite: dict
+    """
+    rc = environment_overwrite(DEFAULT_CONFIG)
+    if config_overwrite:
+        rc.update(config_overwrite)
+
+    logger.info("Starting asyncio matching engine")
+    n_shards = int(rc['ORDER_QUEUE_SHARDS'])
+    shards = parse_shards(rc['MATCHING_ENGINE_SHARDS'], n_shards)
+    source = AmqpOrderSource(connection_parameters(rc),
+        [shard_queue(shard) for shard in shards], n_shards)
+    me = create_matching_engine(rc)
+    service = AsyncMatchingService(
+        me, source,
+        batch_size=int(rc['MATCHING_ENGINE_BATCH_SIZE']),
+        batch_timeout=int(rc['MATCHING_ENGINE_BATCH_TIMEOUT_MS']) / 1000,
+        dry_run=rc['MATCHING_ENGINE_DRY_RUN'])
+    logger.info(f"Owning shards {shards} of {n_shards}")
+    asyncio.run(service.run())
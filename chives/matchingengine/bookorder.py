@@ -0,0 +1,132 @@
+import datetime as dt
+import typing as ty
+
+from chives.models import Order, Transaction
+
+
+class BookOrder:
+    """A lightweight, session-less resting order for the matching hot path.
+    Unlike Order, it carries no SQLAlchemy instrumentation; it is converted to
+    an Order only when it needs to be written into the main database
+    """
+    __slots__ = ["order_id", "security_symbol", "side", "size", "price",
+                 "price_ticks", "all_or_none", "immediate_or_cancel", "owner_id",
+                 "parent_order_id", "create_dttm", "remaining_size"]
+    # The columns to query so that each row can be passed to BookOrder(*row)
+    columns = [Order.order_id, Order.security_symbol, Order.side, Order.size,
+               Order.price, Order.price_ticks, Order.all_or_none, Order.immediate_or_cancel,
+               Order.owner_id, Order.parent_order_id, Order.create_dttm]
+
+    def __init__(self, order_id: ty.Optional[int], security_symbol: str,
+                 side: str, size: int, price: ty.Optional[float],
+                 price_ticks: ty.Optional[int] = None,
+                 all_or_none: bool = False, immediate_or_cancel: bool = False,
+                 owner_id: ty.Optional[int] = None,
+                 parent_order_id: ty.Optional[int] = None,
+                 create_dttm: ty.Optional[dt.datetime] = None):
+        self.order_id = order_id
+        self.security_symbol = security_symbol
+        self.side = side
+        self.size = size
+        self.price = price
+        self.price_ticks = price_ticks
+        self.all_or_none = all_or_none
+        self.immediate_or_cancel = immediate_or_cancel
+        self.owner_id = owner_id
+        self.parent_order_id = parent_order_id
+        self.create_dttm = create_dttm
+        self.remaining_size = size
+
+    @classmethod
+    def from_order(cls, order: Order) -> "BookOrder":
+        return cls(order.order_id, order.security_symbol, order.side,
+                   order.size, order.price, order.price_ticks,
+                   order.all_or_none, order.immediate_or_cancel,
+                   order.owner_id, order.parent_order_id, order.create_dttm)
+
+    def create_suborder(self) -> "BookOrder":
+        """Return the remains of this order, which keeps its create_dttm and
+        thus its time priority
+        """
+        return BookOrder(None, self.security_symbol, self.side,
+                         self.remaining_size, self.price, self.price_ticks,
+                         self.all_or_none, self.immediate_or_cancel,
+                         self.owner_id, self.order_id, self.create_dttm)
+
+    def to_order(self, active: bool = True) -> Order:
+        """Return an active Order with the same attributes
+        """
+        return Order(
+            order_id=self.order_id,
+            security_symbol=self.security_symbol,
+            side=self.side,
+            size=self.size,
+            price=self.price,
+            price_ticks=self.price_ticks,
+            all_or_none=self.all_or_none,
+            immediate_or_cancel=self.immediate_or_cancel,
+            active=active,
+            parent_order_id=self.parent_order_id,
+            owner_id=self.owner_id,
+            create_dttm=self.create_dttm
+        )
+
+    def __repr__(self):
+        attr_list = ", ".join([
+            f"id={self.order_id}",
+            f"symbol={self.security_symbol}",
+            f"side={self.side}",
+            f"size={self.size}",
+            f"price={self.price}",
+            f"owner_id={self.owner_id}",
+        ])
+        return f"<BookOrder({attr_list})>"
+
+
+class Fill:
+    """A lightweight trade proposed by the matching engine, with the same
+    attributes as the Transaction it is converted to when the match result is
+    written into the main database
+    """
+    __slots__ = ["security_symbol", "size", "price", "ask_id", "bid_id",
+                 "aggressor_order_id", "resting_order_id", "price_ticks",
+                 "buyer_id", "seller_id"]
+
+    def __init__(self, security_symbol: str, size: int, price: float,
+                 ask_id: int, bid_id: int, aggressor_order_id: int,
+                 resting_order_id: int, price_ticks: ty.Optional[int] = None,
+                 buyer_id: ty.Optional[int] = None,
+                 seller_id: ty.Optional[int] = None):
+        self.security_symbol = security_symbol
+        self.size = size
+        self.price = price
+        self.ask_id = ask_id
+        self.bid_id = bid_id
+        self.aggressor_order_id = aggressor_order_id
+        self.resting_order_id = resting_order_id
+        self.price_ticks = price_ticks
+        self.buyer_id = buyer_id
+        self.seller_id = seller_id
+
+    def to_transaction(self) -> Transaction:
+        return Transaction(
+            security_symbol=self.security_symbol,
+            size=self.size,
+            price=self.price,
+            ask_id=self.ask_id,
+            bid_id=self.bid_id,
+            aggressor_order_id=self.aggressor_order_id,
+            resting_order_id=self.resting_order_id,
+            price_ticks=self.price_ticks,
+            buyer_id=self.buyer_id,
+            seller_id=self.seller_id
+        )
+
+    def __repr__(self):
+        attr_list = ", ".join([
+            f"price={self.price}",
+            f"size={self.size}",
+            f"ask_id={self.ask_id}",
+            f"bid_id={self.bid_id}",
+        ])
+        return f"<Fill({attr_list})>"
@@ -0,0 +1,154 @@
+from collections import namedtuple
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import typing as ty
+import uuid
+import zlib
+
+
+logger = logging.getLogger("chives.matchingengine")
+
+JournalRecord = namedtuple("JournalRecord", ["seq", "kind", "body", "offset"])
+
+
+class JournalCorruptedError(ValueError):
+    """The exception to raise when a journal file does not start with a valid
+    journal header
+    """
+    pass
+
+
+class Journal:
+    """A local, append-only journal of the incoming orders received by a
+    matching engine, and of the match results produced from them.
+
+    The file starts with a header of a magic string, a format version, and a
+    random journal ID, followed by records that are each prefixed with the
+    length and the CRC32 checksum of their payload. Each payload is a JSON
+    object with a "seq" (the sequence number of the incoming order), a "kind"
+    ("input" or "output"), and a "body". Appended records are only durable
+    after self.sync() is called, so that fsync's can be batched. A record that
+    was only partially written when the process crashed is detected by its
+    length or checksum, and truncated when the journal is re-opened.
+    """
+    magic = b"CHVJ"
+    version = 1
+    header = struct.Struct(">4sH16s")
+    record_header = struct.Struct(">II")
+
+    def __init__(self, path: str,
+                 checkpoint: ty.Optional[ty.Tuple[str, int, int]] = None):
+        """Open the journal at the specified path, creating it if it does not
+        exist yet, then find the last sequence number and truncate any
+        partially written record at the tail. If a checkpoint of this journal
+        is given, only the records after it are read
+
+        :param path: path to the journal file
+        :type path: str
+        :param checkpoint: the journal ID, and a sequence number and the
+        journal offset right after its input record, such as the journal
+        position saved in an order book snapshot; defaults to None
+        :type checkpoint: ty.Tuple[str, int, int], optional
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(self.header.pack(
+                    self.magic, self.version, uuid.uuid4().hex[:16].encode()))
+                f.flush()
+                os.fsync(f.fileno())
+
+        with open(path, "rb") as f:
+            magic, version, journal_id = self.header.unpack(
+                f.read(self.header.size))
+        if magic != self.magic or version != self.version:
+            raise JournalCorruptedError(f"{path} is not a chives journal")
+        self.journal_id: str = journal_id.decode()
+
+        # Every record with a greater sequence number than start_seq is at or
+        # after start_offset
+        self.start_seq, self.start_offset = 0, self.header.size
+        if checkpoint is not None and checkpoint[0] == self.journal_id \
+            and self.header.size <= checkpoint[2] <= os.path.getsize(path):
+            self.start_seq, self.start_offset = checkpoint[1], checkpoint[2]
+        self.last_seq = self.start_seq
+        self.offset = self.start_offset
+        for record in self.records(start_offset=self.start_offset):
+            self.last_seq = max(self.last_seq, record.seq)
+            self.offset = record.offset
+        if self.offset < os.path.getsize(path):
+            logger.warning(f"Truncating partially written record at {self.offset}")
+            os.truncate(path, self.offset)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+
+    def append(self, kind: str, body: ty.Any, seq: int = None) -> int:
+        """Append a record to the journal without syncing it to disk. Input
+        records are given the next sequence number; output records must
+        specify the sequence number of their input
+
+        :param kind: "input" or "output"
+        :type kind: str
+        :param body: a JSON-serializable payload
+        :type body: ty.Any
+        :param seq: sequence number of the record, defaults to None
+        :type seq: int, optional
+        :return: the sequence number of the record
+        :rtype: int
+        """
+        with self.lock:
+            if seq is None:
+                seq = self.last_seq = self.last_seq + 1
+            payload = json.dumps(
+                {"seq": seq, "kind": kind, "body": body}).encode("utf-8")
+            os.write(self.fd, self.record_header.pack(
+                len(payload), zlib.crc32(payload)) + payload)
+            self.offset += self.record_header.size + len(payload)
+        return seq
+
+    def sync(self):
+        """Make all appended records durable
+        """
+        os.fsync(self.fd)
+
+    def records(self, after_seq: int = 0, kind: str = None,
+                start_offset: int = None) -> ty.Iterator[JournalRecord]:
+        """Iterate through the valid records of the journal by memory-mapping
+        the journal file. Each record's offset is the offset right after it
+
+        :param after_seq: only yield records with greater sequence numbers,
+        defaults to 0
+        :type after_seq: int, optional
+        :param kind: only yield records of this kind, defaults to None
+        :type kind: str, optional
+        :param start_offset: the offset of a record from which to start
+        reading, such as the offset of a record yielded earlier; defaults to
+        the first record
+        :type start_offset: int, optional
+        """
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= self.header.size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = start_offset or self.header.size
+                while offset + self.record_header.size <= size:
+                    length, crc = self.record_header.unpack_from(mm, offset)
+                    start = offset + self.record_header.size
+                    payload = mm[start:start + length]
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    offset = start + length
+                    record = json.loads(payload)
+                    if record["seq"] > after_seq \
+                        and (kind is None or record["kind"] == kind):
+                        yield JournalRecord(
+                            record["seq"], record["kind"], record["body"],
+                            offset)
+
+    def close(self):
+        os.close(self.fd)
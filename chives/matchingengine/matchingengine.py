@@ -1,19 +1,35 @@
+from collections import defaultdict
 import datetime as dt
+import json
 import logging
 import os
+import queue
+import signal
 import socket
 import sys
+import threading
 import time
 import typing as ty
 
 import pika
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.engine import Engine as SQLEngine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker
 
+from chives.candles import aggregate_candles, upsert_candles
 from chives.configs import DEFAULT_CONFIG, environment_overwrite
+from chives.fixedpoint import cash_to_minor, quantize_order
+from chives.marketdata import (
+    AmqpMarketDataPublisher, Quote, quote_event, top_of_book, trade_event)
+from chives.matchingengine import snapshot
+from chives.matchingengine.bookorder import BookOrder, Fill
+from chives.matchingengine.journal import Journal, JournalRecord
+from chives.matchingengine.orderbook import OrderBook
 from chives.models import (
-    Base, Order, Transaction, Asset, User, Company, MatchingEngineLog)
+    Base, Order, Transaction, Asset, Company, MatchingEngineLog)
+from chives.routing import (
+    connection_parameters, declare_order_routing, parse_shards, shard_queue)
 
 
 # I am not adding file handler because at deployment, I will use an orchestrator 
@@ -44,15 +60,37 @@ class MatchResult:
         - deactivated is a list of order_id's that 
             - for corresponding entries in main db, change .active to False
             - remove from ob db
-        - reactivated is a single sessionless Order object or None
-        - transactions is a list of sessionless Transaction objects
+        - reactivated is a single BookOrder or None; process_match_result 
+          replaces it with the Order object that is added to the session
+        - transactions is a list of Fill objects; process_match_result 
+          replaces them with the Transaction objects added to the session
         """
         def __init__(self):
             self.incoming: Order = None
             self.incoming_remain: Order = None 
             self.deactivated: ty.List[Order] = []
-            self.reactivated: Order = None
-            self.transactions: ty.List[Transaction] = []
+            self.reactivated: ty.Union[BookOrder, Order] = None
+            self.transactions: ty.List[ty.Union[Fill, Transaction]] = []
+
+        def to_dict(self) -> ty.Dict:
+            """Return a JSON-serializable summary of the match result by the 
+            ID's of its orders and by its transactions; the session must have 
+            been flushed so that new orders and transactions have their ID's
+
+            :return: the summary
+            :rtype: ty.Dict
+            """
+            remain, reactivated = self.incoming_remain, self.reactivated
+            return {
+                "incoming": self.incoming.order_id,
+                "incoming_remain": None if remain is None else remain.order_id,
+                "deactivated": list(self.deactivated),
+                "reactivated": None if reactivated is None \
+                    else reactivated.order_id,
+                "transactions": [
+                    [t.transaction_id, t.ask_id, t.bid_id, t.size, t.price]
+                    for t in self.transactions]
+            }
 
 
 class MatchingEngine:
@@ -61,10 +99,21 @@ class MatchingEngine:
     with active orders
     """
     heartbeat_finish_msg = "Heartbeat finished"
+    candidates_page_size = 16
+    # Number of times heartbeat_batch tries to commit a batch before giving up
+    max_commit_attempts = 3
 
     def __init__(self, me_sql_engine: SQLEngine,
                        ignore_user_logic: bool = False,
-                       hostname: str = None):
+                       hostname: str = None,
+                       use_order_book: bool = False,
+                       journal: ty.Optional[Journal] = None,
+                       snapshot_dir: ty.Optional[str] = None,
+                       snapshot_every: int = 0,
+                       cash_minor_units: int = 100,
+                       fixed_point_cash: bool = False,
+                       market_data=None,
+                       latest_snapshot: ty.Optional[snapshot.Snapshot] = None):
         """Initialize the matching engine by instantiating the order book and 
         creating a engine-bound session
 
@@ -76,12 +125,77 @@ class MatchingEngine:
         :param hostname: if a hostname is specified, use the specified hostname 
         otherwise, use socket.gethostname(), defaults to None
         :type hostname: str, optional
+        :param use_order_book: if True, the matching engine keeps an in-memory 
+        order book that is warm-loaded from the active orders in the main 
+        database, and reads candidates from it instead of querying the main 
+        database, defaults to False
+        :type use_order_book: bool, optional
+        :param journal: if specified, the journal that incoming orders are 
+        appended to before they are acknowledged; the match results are 
+        appended to it after they are committed, defaults to None
+        :type journal: Journal, optional
+        :param snapshot_dir: if specified along with use_order_book, the 
+        directory that order book snapshots are saved to; the order book is 
+        then loaded from the newest snapshot and caught up with the changes 
+        since, instead of being loaded from all active orders, defaults to None
+        :type snapshot_dir: str, optional
+        :param snapshot_every: save a snapshot after every this many incoming 
+        orders; 0 means never, defaults to 0
+        :type snapshot_every: int, optional
+        :param cash_minor_units: number of cash minor units per unit of cash, 
+        in which tick sizes are expressed, defaults to 100
+        :type cash_minor_units: int, optional
+        :param fixed_point_cash: if True, all changes to users' cash are 
+        computed and applied in integer minor units, defaults to False
+        :type fixed_point_cash: bool, optional
+        :param market_data: if specified, a LocalMarketDataBus or an 
+        AmqpMarketDataPublisher that the trades and the changes to the top of 
+        the book are published to after each commit, defaults to None
+        :param latest_snapshot: if specified along with use_order_book, the 
+        snapshot to load the order book from instead of the newest one in 
+        snapshot_dir, defaults to None
+        :type latest_snapshot: snapshot.Snapshot, optional
         """
         Session = sessionmaker(bind=me_sql_engine, autoflush=False)
         self.session = Session()
         self.ignore_user_logic = ignore_user_logic
         self.hostname = hostname if hostname else socket.gethostname()
         self.pid = os.getpid()
+        self.cash_minor_units = cash_minor_units
+        self.fixed_point_cash = fixed_point_cash
+        # Tick size of each security symbol that has been looked up
+        self.tick_sizes: ty.Dict[str, ty.Optional[int]] = dict()
+        self.market_data = market_data
+        # The trade events of the heartbeat in progress, and the last quote 
+        # published for each security symbol
+        self.trade_events: ty.List[ty.Dict] = []
+        self.last_quotes: ty.Dict[str, Quote] = dict()
+        self.journal = journal
+        self.journal_ref = None
+        if journal is not None:
+            self.journal_ref = f"journal:{journal.journal_id}"
+        # The last journaled incoming order committed to the main database, 
+        # as its sequence number and a journal offset right after it
+        self.journal_position: ty.Tuple[int, int] = (0, 0)
+        if journal is not None:
+            self.journal_position = (journal.start_seq, journal.start_offset)
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_every = snapshot_every
+        self.n_since_snapshot = 0
+        self.order_book: ty.Optional[OrderBook] = None
+        # The largest order_id that this matching engine has processed
+        self.last_order_id = 0
+        if use_order_book:
+            if latest_snapshot is None and snapshot_dir is not None:
+                latest_snapshot = snapshot.load_latest(snapshot_dir)
+            if latest_snapshot is not None:
+                self.catch_up(latest_snapshot)
+            else:
+                self.order_book = OrderBook()
+                self.order_book.load(self.session)
+                self.last_order_id = self.session.query(
+                    func.max(Order.order_id)).scalar() or 0
+            self.session.close()
     
     def get_order(self, order_id: int) -> Order:
         """Read an order by its order_id
@@ -97,41 +211,87 @@ class MatchingEngine:
         else:
             return order
 
-    def get_candidates(self, incoming: Order) -> ty.List[Order]:
-        """Given an incoming order, return all active orders of the same 
-        security symbol, that are on the opposite sides, that do not come from 
-        the same owner, and that offer better price than the incoming order, 
-        if the incoming order has a target price
+    def get_tick_size(self, symbol: str) -> ty.Optional[int]:
+        """Return the tick size of a security, or None if it is traded at 
+        floating-point prices. Tick sizes are read once per symbol, so 
+        changing them requires restarting the matching engine
+
+        :param symbol: the security symbol
+        :type symbol: str
+        :return: the number of cash minor units per tick
+        :rtype: ty.Optional[int]
+        """
+        if symbol not in self.tick_sizes:
+            self.tick_sizes[symbol] = self.session.query(
+                Company.tick_size).filter(Company.symbol == symbol).scalar()
+        return self.tick_sizes[symbol]
+
+    def get_candidates(self, incoming: Order) -> ty.Iterator[BookOrder]:
+        """Given an incoming order, iterate through all active orders of the 
+        same security symbol, that are on the opposite sides, that do not come 
+        from the same owner, and that offer better price than the incoming 
+        order, if the incoming order has a target price. 
+
+        Candidates are yielded in price-time priority and read lazily, one 
+        page of self.candidates_page_size orders at a time using keyset 
+        pagination, so that only as many candidates are read as the incoming 
+        order can be matched with
 
         :param incoming: the incoming order
         :type incoming: Order
-        :return: A list of candidate orders
-        :rtype: ty.List[Order]
+        :return: An iterator of candidate orders
+        :rtype: ty.Iterator[BookOrder]
         """
-        candidates: ty.List[Order] = []
+        if self.order_book is not None:
+            yield from self.order_book.get_candidates(incoming)
+            return
+
         cond = (Order.security_symbol == incoming.security_symbol) \
             & (Order.active == True)
         if incoming.owner_id:
             cond = cond & (Order.owner_id != incoming.owner_id)
+        # Securities that are traded in ticks are compared by integer ticks
+        if self.get_tick_size(incoming.security_symbol) is not None:
+            price_col, price_attr = Order.price_ticks, "price_ticks"
+        else:
+            price_col, price_attr = Order.price, "price"
+        limit = getattr(incoming, price_attr)
         best_price = None
         if incoming.side == "bid":
             cond = cond & (Order.side == "ask")
             if incoming.price:
-                cond = cond & (Order.price <= incoming.price)
-            best_price = Order.price.asc()
+                cond = cond & (price_col <= limit)
+            best_price = price_col.asc()
+            worse_price = lambda price: price_col > price
         else:
             cond = cond & (Order.side == "bid")
             if incoming.price:
-                cond = cond & (Order.price >= incoming.price)
-            best_price = Order.price.desc()
+                cond = cond & (price_col >= limit)
+            best_price = price_col.desc()
+            worse_price = lambda price: price_col < price
         
-        return self.session.query(Order).filter(cond).order_by(
-            best_price, Order.create_dttm.desc()).all()
+        page_cond = cond
+        while True:
+            page = [BookOrder(*row) for row in self.session.query(
+                *BookOrder.columns).filter(page_cond).order_by(
+                    best_price, Order.create_dttm.asc(), Order.order_id.asc()
+                ).limit(self.candidates_page_size)]
+            yield from page
+            if len(page) < self.candidates_page_size:
+                return
+            # The next page starts right after the last candidate of this page
+            last = page[-1]
+            last_price = getattr(last, price_attr)
+            page_cond = cond & (worse_price(last_price) 
+                | ((price_col == last_price) 
+                    & ((Order.create_dttm > last.create_dttm) 
+                        | ((Order.create_dttm == last.create_dttm) 
+                            & (Order.order_id > last.order_id)))))
 
     @classmethod 
     def propose_trade(cls, incoming: Order, 
-                           candidate: Order) -> ty.Optional[Transaction]:
-        """Given the incoming order and a candidate order, return a Transaction 
+                           candidate: BookOrder) -> ty.Optional[Fill]:
+        """Given the incoming order and a candidate order, return a Fill 
         object that describes the trade that can happen between the two orders.
         If no trade can be proposed between the two orders, then None will be
         returned.
@@ -139,10 +299,10 @@ class MatchingEngine:
         :param incoming: the incoming order
         :type incoming: Order
         :param candidate: the candidate order
-        :type candidate: Order
+        :type candidate: BookOrder
         :return: the proposed trade between the two order, or None if no trade 
         can be proposed
-        :rtype: Transaction
+        :rtype: Fill
         """
         # You can safely assume that incoming and candidate are on opposite 
         # sides and have matching target price, and that the candidate has a 
@@ -150,8 +310,8 @@ class MatchingEngine:
         if incoming.remaining_size <= 0 or candidate.remaining_size <= 0:
             return None 
         else:
-            ask: Order = incoming if incoming.side == 'ask' else candidate 
-            bid: Order = incoming if incoming.side == 'bid' else candidate
+            ask = incoming if incoming.side == 'ask' else candidate 
+            bid = incoming if incoming.side == 'bid' else candidate
             # with the if statement above, transaction_size is guaranteed to 
             # be non-zero
             transaction_size = min(ask.remaining_size, bid.remaining_size)
@@ -169,99 +329,152 @@ class MatchingEngine:
                 # price since by prior filtering, the candidate will 
                 # always have the better pricing
 
-                transaction: Transaction = Transaction(
+                return Fill(
                     security_symbol=ask.security_symbol,
                     size=transaction_size,
                     price=candidate.price,
                     ask_id=ask.order_id,
                     bid_id=bid.order_id,
                     aggressor_order_id=incoming.order_id,
-                    resting_order_id=candidate.order_id
+                    resting_order_id=candidate.order_id,
+                    price_ticks=candidate.price_ticks,
+                    buyer_id=bid.owner_id,
+                    seller_id=ask.owner_id
                 )
-
-                return transaction
     
-    def exchange_user_asset(self, transaction: Transaction):
-        """Given a transaction, find the parties involved in the transaction, 
-        then perform the exchange of cash for stocks as reflected on the assets
-        table
+    def net_asset_deltas(self, match_result: MatchResult) -> ty.Dict[
+            ty.Tuple[int, str], float]:
+        """Given a match result, net the changes to each user's assets across 
+        all of its transactions, and the refund of its cancelled remains:
+        *   for each transaction, the seller gains cash, and the buyer gains 
+            stocks and loses cash. The seller's stock deduction happens at the 
+            order's submission, so it is not a part of the deltas
+        *   if the incoming order is a selling order whose remains are 
+            cancelled, then the remaining shares are returned to the seller
+        With fixed-point cash, the changes to "_CASH" are integers in minor 
+        units: exactly price_ticks * tick_size * size for securities traded in 
+        ticks, and the cash volume rounded to the nearest minor unit otherwise
 
-        :param transaction: [description]
-        :type transaction: Transaction
+        :param match_result: [description]
+        :type match_result: MatchResult
+        :return: a mapping from (owner_id, asset_symbol) to the change in 
+        asset_amount
+        :rtype: ty.Dict[ty.Tuple[int, str], float]
         """
-        # Identify the seller and the buyer.
-        ask = self.session.query(Order).get(transaction.ask_id)
-        bid = self.session.query(Order).get(transaction.bid_id)
-        seller: User = ask.owner
-        buyer: User = bid.owner
-
-        # Seller gains cash and loses stocks, but the stock share 
-        # deduction happens at order's submission, so we only need 
-        # to be concerned with gaining cash.
-        cash_volume = transaction.price * transaction.size 
-        seller_cash: Asset = self.session.query(Asset).get(
-            (seller.user_id, "_CASH")
-        )
-        seller_cash.asset_amount += cash_volume
-        self.session.merge(seller_cash)
-
-        # Buyer gains stock and loses cash, both of which will 
-        # happen here, since there is no telling what price the 
-        # buyer will get when the buyer places an order.
-        #
-        # First check if the buyer has had this kind of asset before
-        buyer_stock = self.session.query(Asset).get(
-            (buyer.user_id, transaction.security_symbol)
-        )
-        # If the buyer has this kind of asset, then add to it; 
-        # otherwise, create a new entry
-        if buyer_stock is None:
-            self.session.add(
-                Asset(owner_id=buyer.user_id,
-                        asset_symbol=transaction.security_symbol,
-                        asset_amount=transaction.size))
-        else:
-            buyer_stock.asset_amount += transaction.size
-            self.session.merge(buyer_stock)
-        # Remove cash from buyer
-        buyer_cash = self.session.query(Asset).get(
-            (buyer.user_id, "_CASH")
-        )
-        buyer_cash.asset_amount -= cash_volume
-        self.session.merge(buyer_cash)
-
-    def update_market_price(self, transaction: Transaction):
-        """Given a transaction object, find the company that this transaction 
-        is trading on, then update the company's market price with the 
-        transaction price
-
-        :param transaction: [description]
-        :type transaction: Transaction
+        deltas: ty.Dict[ty.Tuple[int, str], float] = defaultdict(int)
+        # Identify the owners of all orders involved with a single query
+        order_ids = set()
+        for transaction in match_result.transactions:
+            order_ids.update([transaction.ask_id, transaction.bid_id])
+        owners = dict()
+        if len(order_ids) > 0:
+            owners = dict(self.session.query(Order.order_id, Order.owner_id)\
+                .filter(Order.order_id.in_(order_ids)).all())
+
+        for transaction in match_result.transactions:
+            seller_id = owners.get(transaction.ask_id)
+            buyer_id = owners.get(transaction.bid_id)
+            cash_volume = self.cash_volume(transaction)
+            if seller_id is not None:
+                deltas[(seller_id, "_CASH")] += cash_volume
+            if buyer_id is not None:
+                deltas[(buyer_id, transaction.security_symbol)] += \
+                    transaction.size
+                deltas[(buyer_id, "_CASH")] -= cash_volume
+        
+        remain = match_result.incoming_remain
+        if (match_result.incoming.side == "ask") \
+            and remain is not None \
+            and (remain.cancelled_dttm is not None) \
+            and remain.owner_id is not None:
+            logger.debug(f"Refunding {remain.size} shares")
+            deltas[(remain.owner_id, remain.security_symbol)] += remain.size
+
+        return deltas
+
+    def cash_volume(self, transaction: Fill) -> ty.Union[int, float]:
+        """Return the amount of cash exchanged by a transaction, in minor 
+        units if cash is fixed-point
+        """
+        if not self.fixed_point_cash:
+            return transaction.price * transaction.size
+        if transaction.price_ticks is not None:
+            return transaction.price_ticks * transaction.size \
+                * self.get_tick_size(transaction.security_symbol)
+        return cash_to_minor(
+            transaction.price * transaction.size, self.cash_minor_units)
+
+    def apply_asset_deltas(self, deltas: ty.Dict[ty.Tuple[int, str], float]):
+        """Apply each change in asset_amount with a single atomic 
+        "SET asset_amount = asset_amount + :delta" statement, so that there is 
+        no read-modify-write between matching engines. If the user does not 
+        hold the asset yet, then a new entry is inserted: on MySQL this is a 
+        single "INSERT ... ON DUPLICATE KEY UPDATE"; on other databases, the 
+        insert follows an update that matched no row.
+
+        With fixed-point cash, changes to "_CASH" are added to 
+        asset_amount_minor instead, and asset_amount is derived from it in 
+        the same statement. Entries without minor units yet are converted 
+        from their asset_amount first
+
+        :param deltas: a mapping from (owner_id, asset_symbol) to the change 
+        in asset_amount, as returned by self.net_asset_deltas
+        :type deltas: ty.Dict[ty.Tuple[int, str], float]
         """
-        # Update the company's market price
-        company = self.session.query(Company).get(
-            transaction.security_symbol)
-        company.market_price = transaction.price
-        self.session.merge(company)
+        assets = Asset.__table__
+        is_mysql = self.session.bind.dialect.name == "mysql"
+        scale = float(self.cash_minor_units)
+        for (owner_id, symbol), delta in deltas.items():
+            if delta == 0:
+                continue
+            new_values = [(assets.c.asset_amount, assets.c.asset_amount + delta)]
+            insert_values = dict(
+                owner_id=owner_id, asset_symbol=symbol, asset_amount=delta)
+            if self.fixed_point_cash and symbol == "_CASH":
+                new_minor = func.coalesce(assets.c.asset_amount_minor, 
+                    func.round(assets.c.asset_amount * scale)) + delta
+                if is_mysql:
+                    # MySQL assigns from left to right, each assignment 
+                    # reading the values already assigned, so asset_amount 
+                    # is derived from the new asset_amount_minor
+                    new_values = [
+                        (assets.c.asset_amount_minor, new_minor), 
+                        (assets.c.asset_amount, 
+                         assets.c.asset_amount_minor / scale)]
+                else:
+                    new_values = [(assets.c.asset_amount, new_minor / scale), 
+                                  (assets.c.asset_amount_minor, new_minor)]
+                insert_values.update(
+                    asset_amount=delta / scale, asset_amount_minor=delta)
+            if is_mysql:
+                # The assignments are ordered by column name, not by column
+                upsert = mysql_insert(assets).values(**insert_values)
+                self.session.execute(upsert.on_duplicate_key_update(
+                    [(column.key, value) for column, value in new_values]))
+                continue
+            result = self.session.execute(assets.update(
+                preserve_parameter_order=True
+            ).where(
+                (assets.c.owner_id == owner_id) 
+                & (assets.c.asset_symbol == symbol)
+            ).values(new_values))
+            if result.rowcount == 0:
+                self.session.execute(assets.insert().values(**insert_values))
 
-    def refund_cancelled_remains(self, match_result: MatchResult):
-        """If the incoming order is a selling order that is not entirely 
-        fulfilled, and whose remaining part is cancelled, then return the 
-        remaining part's assets back to the seller
+    def update_market_price(self, match_result: MatchResult):
+        """Given a match result, update the market price of each company whose 
+        stock is traded with the price of its last transaction
 
         :param match_result: [description]
         :type match_result: MatchResult
         """
-        if (match_result.incoming.side == "ask") \
-            and match_result.incoming_remain is not None \
-            and (match_result.incoming_remain.cancelled_dttm is not None):
-            owner_id = match_result.incoming_remain.owner_id
-            symbol = match_result.incoming_remain.security_symbol
-            source_asset = self.session.query(Asset).get((owner_id, symbol))
-            refund_size = match_result.incoming_remain.size
-            logger.debug(f"Refunding {refund_size} shares")
-            source_asset.asset_amount += refund_size
-            self.session.merge(source_asset)
+        last_prices = dict()
+        for transaction in match_result.transactions:
+            last_prices[transaction.security_symbol] = transaction.price
+        companies = Company.__table__
+        for symbol, price in last_prices.items():
+            self.session.execute(companies.update().where(
+                companies.c.symbol == symbol).values(market_price=price))
 
     def process_match_result(self, match_result: MatchResult):
         """Write changes described by the match result into the database:
@@ -273,14 +486,14 @@ class MatchingEngine:
             matched with the aggressor order and produced transaction
         4.  If there is a sub-order of a resting order, then it needs to be 
             added as a new order
-        5.  For each transaction, add it into the database. 
-            If user logic is not to be ignored, then 
-            *   call exchange_user_asset to execute with the exchange of 
-                assets induced by said transaction
-            *   call update_market_price to update a company's stock's market
-                price
-        6.  If user logic is not to be ignored, then refund unfulfilled remains 
-            of the selling order back to the user appropriately
+        5.  For each transaction, add it into the database, and merge it into 
+            the candles of its security
+        6.  If user logic is not to be ignored, then 
+            *   call net_asset_deltas to net the exchange of assets induced 
+                by all transactions, and the refund of unfulfilled remains of 
+                the selling order, then apply them with apply_asset_deltas
+            *   call update_market_price to update the companies' market 
+                prices with their last transaction prices
 
         :param match_result: [description]
         :type match_result: MatchResult
@@ -291,23 +504,168 @@ class MatchingEngine:
             and match_result.incoming_remain is not None:
             self.session.add(match_result.incoming_remain)
         
+        # One UPDATE for all matched resting orders; the session is not 
+        # synchronized since none of them are modified again in this commit
         if len(match_result.deactivated) > 0:
-            for deactivated in match_result.deactivated:
-                main_entry = self.session.query(Order).get(deactivated)
-                main_entry.active = False 
+            self.session.query(Order).filter(
+                Order.order_id.in_(match_result.deactivated)
+            ).update({"active": False}, synchronize_session=False)
 
+        # Candidates and trades are lightweight objects up to this point; 
+        # replace them with their ORM counterparts so that they are assigned 
+        # their IDs on flush
         if match_result.reactivated is not None:
+            match_result.reactivated = match_result.reactivated.to_order()
             self.session.add(match_result.reactivated)
 
+        match_result.transactions = [
+            fill.to_transaction() for fill in match_result.transactions]
+        self.session.add_all(match_result.transactions)
         if len(match_result.transactions) > 0:
+            # The candles need the transactions' time before they are flushed
+            transact_dttm = dt.datetime.utcnow()
             for transaction in match_result.transactions:
-                self.session.add(transaction)
-                if not self.ignore_user_logic:
-                    self.exchange_user_asset(transaction)
-                    self.update_market_price(transaction)
+                transaction.transact_dttm = transact_dttm
+            upsert_candles(
+                self.session, aggregate_candles(match_result.transactions))
         
         if not self.ignore_user_logic:
-            self.refund_cancelled_remains(match_result)
+            self.apply_asset_deltas(self.net_asset_deltas(match_result))
+            self.update_market_price(match_result)
+
+        if self.order_book is not None:
+            self.update_order_book(match_result)
+
+    def update_order_book(self, match_result: MatchResult):
+        """Apply the changes described by the match result to the in-memory 
+        order book. The session is flushed first so that new suborders are 
+        assigned their order_id's; if the commit fails afterwards, the 
+        security's order book is reloaded in self.heartbeat
+
+        :param match_result: [description]
+        :type match_result: MatchResult
+        """
+        self.session.flush()
+        for deactivated in match_result.deactivated:
+            self.order_book.remove(deactivated)
+        # The partially fulfilled candidate keeps the time priority of its 
+        # parent, which was at the front of its price level
+        if match_result.reactivated is not None:
+            self.order_book.add(
+                BookOrder.from_order(match_result.reactivated), front=True)
+        remain = match_result.incoming_remain
+        if remain is match_result.incoming:
+            # Copy the merged entry, which has the create_dttm of the database
+            remain = self.session.query(Order).get(remain.order_id)
+        if remain is not None and remain.active:
+            self.order_book.add(BookOrder.from_order(remain))
+        self.last_order_id = max([self.last_order_id] + [
+            o.order_id for o in [match_result.incoming, 
+                match_result.incoming_remain, match_result.reactivated]
+            if o is not None])
+
+    def save_snapshot(self) -> str:
+        """Save a snapshot of the order book along with the last processed 
+        order_id and journal position into self.snapshot_dir
+
+        :return: path to the snapshot
+        :rtype: str
+        """
+        self.n_since_snapshot = 0
+        journal_seq, journal_offset = self.journal_position
+        return snapshot.save(self.snapshot_dir, self.order_book, 
+            self.last_order_id, journal_seq, journal_offset, 
+            self.journal.journal_id if self.journal is not None else "")
+
+    def catch_up(self, latest_snapshot: snapshot.Snapshot):
+        """Use the order book of a snapshot, then apply the changes to the 
+        active orders since the snapshot was saved: orders in the snapshot 
+        that are no longer active are removed, and active orders that are not 
+        in the snapshot are added. The active orders are compared by their 
+        order_id's alone, so that only the added orders are read in full; 
+        this is bounded by the size of the order book and the number of 
+        orders since the snapshot, instead of the entire order history. 
+        Comparing against the database, rather than a watermark, also picks 
+        up orders that were submitted before the snapshot but matched after 
+        it, whatever their order_id's
+
+        :param latest_snapshot: the snapshot
+        :type latest_snapshot: snapshot.Snapshot
+        """
+        self.order_book = latest_snapshot.order_book
+        self.last_order_id = latest_snapshot.last_order_id
+
+        active_ids = set(order_id for order_id, in self.session.query(
+            Order.order_id).filter((Order.active == True) 
+                                   & (Order.price != None)))
+        deactivated = [order_id for order_id in self.order_book.index
+                       if order_id not in active_ids]
+        activated_ids = sorted(active_ids.difference(self.order_book.index))
+        activated = []
+        for i in range(0, len(activated_ids), 500):
+            activated += self.session.query(Order).filter(
+                Order.order_id.in_(activated_ids[i:i + 500])).all()
+        for order_id in deactivated:
+            self.order_book.remove(order_id)
+        for order in activated:
+            self.order_book.insert(BookOrder.from_order(order))
+            self.last_order_id = max(self.last_order_id, order.order_id)
+        logger.info(f"Caught up snapshot from {latest_snapshot.create_dttm}: "
+            f"{len(deactivated)} orders removed, {len(activated)} orders added")
+
+    def after_commit(self, n_orders: int):
+        """Save a snapshot of the order book if self.snapshot_every incoming 
+        orders have been committed since the last one
+
+        :param n_orders: number of incoming orders just committed
+        :type n_orders: int
+        """
+        if self.order_book is None or self.snapshot_dir is None \
+            or not self.snapshot_every:
+            return
+        self.n_since_snapshot += n_orders
+        if self.n_since_snapshot >= self.snapshot_every:
+            self.save_snapshot()
+
+    def collect_trade_events(self, match_result: MatchResult):
+        """Keep the trade events of a flushed match result until the 
+        heartbeat is committed
+        """
+        if self.market_data is None:
+            return
+        side = match_result.incoming.side
+        self.trade_events.extend(
+            trade_event(t, side) for t in match_result.transactions)
+
+    def top_of_book(self, symbol: str) -> Quote:
+        if self.order_book is None:
+            return top_of_book(self.session, symbol)
+        return Quote(*self.order_book.best(symbol, "bid"),
+                     *self.order_book.best(symbol, "ask"))
+
+    def publish_market_data(self, symbols: ty.Iterable[str]):
+        """Publish the trades of the committed heartbeat, then the top of the 
+        book of each of the security symbols if it has changed since it was 
+        last published. The orders are already committed, so failing to 
+        publish is logged instead of raised
+
+        :param symbols: the security symbols of the incoming orders
+        :type symbols: ty.Iterable[str]
+        """
+        if self.market_data is None:
+            return
+        events, self.trade_events = self.trade_events, []
+        try:
+            for symbol in sorted(set(symbols)):
+                quote = self.top_of_book(symbol)
+                if self.last_quotes.get(symbol) != quote:
+                    self.last_quotes[symbol] = quote
+                    events.append(quote_event(symbol, quote))
+            self.session.close()
+            if events:
+                self.market_data.publish(events)
+        except Exception as e:
+            logger.error(f"Failed to publish market data: {e!r}")
     
     def _heartbeat(self, incoming: Order):
         """Register the incoming order into the main database, run it against 
@@ -319,6 +677,7 @@ class MatchingEngine:
         """
         logger.debug("Starting new heartbeat")
         self.session.close(); time.sleep(0.01)
+        self.trade_events = []
 
         # The self.match method does not commit any actual changes to any 
         # database. Instead, it returns the set of changes that need to be 
@@ -327,10 +686,15 @@ class MatchingEngine:
         self.process_match_result(match_result)
         
         self.log_to_sql(msg=self.heartbeat_finish_msg)
+        if self.market_data is not None:
+            # Transactions are assigned their IDs on flush
+            self.session.flush()
+            self.collect_trade_events(match_result)
         # This is the only commit that will happen for each heartbeat
         self.session.commit()
 
     def heartbeat(self, incoming: Order):
+        symbol = incoming.security_symbol
         try:
             logger.info(f"Trying to heartbeat {incoming}")
             self._heartbeat(incoming)
@@ -338,7 +702,148 @@ class MatchingEngine:
         except Exception as e:
             logger.error(f"Commit failed: {e}")
             self.session.rollback()
+            if self.order_book is not None:
+                self.order_book.load(self.session, symbol)
             self.heartbeat(incoming)
+            return
+        self.after_commit(1)
+        self.publish_market_data([symbol])
+
+    def _heartbeat_batch(self, incomings: ty.List[Order],
+                         journal_seqs: ty.List[int] = None
+                         ) -> ty.List[MatchResult]:
+        """Run each of the incoming orders against self.match in order within 
+        the same session, then commit all changes at once. The session is 
+        flushed after each match result so that the next match sees the 
+        changes made by the previous ones
+
+        :param incomings: the incoming orders, in the order they are received
+        :type incomings: ty.List[Order]
+        :param journal_seqs: the journal sequence numbers of the incoming 
+        orders, which are logged along with them, defaults to None
+        :type journal_seqs: ty.List[int], optional
+        :return: the summary of each match result, see MatchResult.to_dict
+        :rtype: ty.List[ty.Dict]
+        """
+        logger.debug(f"Starting new heartbeat on {len(incomings)} orders")
+        self.session.close()
+        self.trade_events = []
+
+        summaries = []
+        for i, incoming in enumerate(incomings):
+            match_result: MatchResult = self.match(incoming)
+            self.process_match_result(match_result)
+            if journal_seqs is None:
+                self.log_to_sql(msg=self.heartbeat_finish_msg)
+            else:
+                self.log_to_sql(msg=self.heartbeat_finish_msg, 
+                    ext_ref=self.journal_ref, ext_ref_id=journal_seqs[i])
+            self.session.flush()
+            self.collect_trade_events(match_result)
+            summaries.append(match_result.to_dict())
+        # This is the only commit that will happen for the entire batch
+        self.session.commit()
+        return summaries
+
+    def heartbeat_batch(self, incomings: ty.List[Order],
+                        journal_records: ty.List[JournalRecord] = None):
+        """Group-commit version of self.heartbeat: if the commit fails, the 
+        entire batch is rolled back and retried, up to 
+        self.max_commit_attempts times in all, after which the last error is 
+        raised. If the incoming orders come from the journal, then their 
+        match results are appended to the journal after the commit
+
+        :param incomings: the incoming orders, in the order they are received
+        :type incomings: ty.List[Order]
+        :param journal_records: the journal records of the incoming orders, 
+        defaults to None
+        :type journal_records: ty.List[JournalRecord], optional
+        """
+        journal_seqs = None
+        if journal_records is not None:
+            journal_seqs = [r.seq for r in journal_records]
+        symbols = set(o.security_symbol for o in incomings)
+        for attempt in range(1, self.max_commit_attempts + 1):
+            try:
+                logger.info(f"Trying to heartbeat {len(incomings)} orders")
+                summaries = self._heartbeat_batch(incomings, journal_seqs)
+                logger.info(f"Heartbeated {len(incomings)} orders")
+                break
+            except Exception as e:
+                logger.error(f"Commit failed (attempt {attempt} of "
+                             f"{self.max_commit_attempts}): {e}")
+                self.session.rollback()
+                if self.order_book is not None:
+                    for symbol in symbols:
+                        self.order_book.load(self.session, symbol)
+                if attempt == self.max_commit_attempts:
+                    raise
+        if journal_records is not None:
+            for seq, summary in zip(journal_seqs, summaries):
+                self.journal.append("output", summary, seq=seq)
+            self.journal_position = (
+                journal_records[-1].seq, journal_records[-1].offset)
+        self.after_commit(len(incomings))
+        self.publish_market_data(symbols)
+
+    def journal_inputs(self, bodies: ty.List[bytes]
+                       ) -> ty.List[JournalRecord]:
+        """Append the incoming orders of a batch of message bodies to the 
+        journal as input records, then make them durable with a single fsync
+
+        :param bodies: the message bodies, each an order's JSON
+        :type bodies: ty.List[bytes]
+        :return: the journal records, to be passed to heartbeat_batch
+        :rtype: ty.List[JournalRecord]
+        """
+        records = []
+        for body in bodies:
+            order_dict = json.loads(body)
+            seq = self.journal.append("input", order_dict)
+            # The journal's offset is now after this record, and before the 
+            # next incoming order's record
+            records.append(JournalRecord(
+                seq, "input", order_dict, self.journal.offset))
+        self.journal.sync()
+        return records
+
+    def last_journal_seq(self) -> int:
+        """Return the sequence number of the last journaled incoming order 
+        whose match result is committed to the main database
+
+        :return: the sequence number, or 0 if there is none
+        :rtype: int
+        """
+        last_seq = self.session.query(
+            func.max(MatchingEngineLog.ext_ref_id)).filter(
+                MatchingEngineLog.ext_ref == self.journal_ref).scalar()
+        return last_seq or 0
+
+    def replay_journal(self, batch_size: int = 100) -> int:
+        """Heartbeat the journaled incoming orders whose match results are not 
+        committed to the main database yet, in the order they were journaled. 
+        Since each match result is committed together with its sequence 
+        number, replaying the journal more than once has no further effect
+
+        :param batch_size: number of orders matched per commit, defaults to 100
+        :type batch_size: int, optional
+        :return: the number of replayed incoming orders
+        :rtype: int
+        """
+        last_seq = self.last_journal_seq()
+        batch, n_replayed = [], 0
+        for record in self.journal.records(after_seq=last_seq, kind="input",
+                start_offset=self.journal.start_offset):
+            batch.append(record)
+            if len(batch) == batch_size:
+                self.heartbeat_batch([Order(**r.body) for r in batch], batch)
+                n_replayed += len(batch); batch = []
+        if len(batch) > 0:
+            self.heartbeat_batch([Order(**r.body) for r in batch], batch)
+            n_replayed += len(batch)
+        self.journal.sync()
+        logger.info(f"Replayed {n_replayed} journaled orders after {last_seq}")
+        return n_replayed
 
     def match(self, incoming: Order) -> MatchResult:
         """The specific logic is recorded in the module README.
@@ -349,30 +854,33 @@ class MatchingEngine:
         :rtype: MatchResult
         """
         mr = MatchResult()
+        quantize_order(incoming, self.get_tick_size(incoming.security_symbol),
+                       self.cash_minor_units)
         incoming.remaining_size = incoming.size 
-        candidates: ty.List[Order] = self.get_candidates(incoming)
-        logger.debug(f"Found {len(candidates)} resting orders as candidates")
-
-        for candidate in candidates:
+        n_candidates = 0
+        for candidate in self.get_candidates(incoming):
+            n_candidates += 1
             candidate.remaining_size = candidate.size
 
+            # candidate's AON policy is respected within propose_trade;
+            # if candidate is AON and incoming.remaining_size < candidate.size
+            # then transaction is None
+            transaction = self.propose_trade(incoming, candidate)
+            if transaction is not None:
+                logger.debug(f"{incoming} matches {candidate}: {transaction}")
+                incoming.remaining_size -= transaction.size 
+                candidate.remaining_size -= transaction.size 
+                mr.transactions.append(transaction)
+                mr.deactivated.append(candidate.order_id)
+                # If the candidate is partially fulfilled, then create its 
+                # remains as a suborder
+                if candidate.remaining_size > 0:
+                    mr.reactivated = candidate.create_suborder()
+            
+            # Stop before the next candidate is read
             if incoming.remaining_size <= 0:
                 break
-            else:
-                # candidate's AON policy is respected within propose_trade;
-                # if candidate is AON and incoming.remaining_size < candidate.size
-                # then transaction is None
-                transaction = self.propose_trade(incoming, candidate)
-                if transaction is not None:
-                    logger.debug(f"{incoming} matches {candidate}: {transaction}")
-                    incoming.remaining_size -= transaction.size 
-                    candidate.remaining_size -= transaction.size 
-                    mr.transactions.append(transaction)
-                    mr.deactivated.append(candidate.order_id)
-                    # If the candidate is partially fulfilled, then create its 
-                    # remains as a suborder
-                    if candidate.remaining_size > 0:
-                        mr.reactivated = candidate.create_suborder()
+        logger.debug(f"Read {n_candidates} resting orders as candidates")
         
         # After all matchings are complete
         mr.incoming = incoming
@@ -427,9 +935,53 @@ class MatchingEngine:
         ))
 
 
+def create_matching_engine(rc: ty.Dict) -> MatchingEngine:
+    """Connect to the main database, initialize its schema if it does not 
+    exist already, then create the matching engine described by a runtime 
+    configuration, and bring the main database up to date with its journal 
+    if there is one
+
+    :param rc: the runtime configuration
+    :type rc: ty.Dict
+    :return: the matching engine
+    :rtype: MatchingEngine
+    """
+    sql_engine = create_engine(
+        rc['SQLALCHEMY_CONN'], echo=rc['SQLALCHEMY_ECHO'])
+    Base.metadata.create_all(sql_engine, checkfirst=True)
+
+    latest_snapshot = None
+    if rc['MATCHING_ENGINE_SNAPSHOT_DIR']:
+        latest_snapshot = snapshot.load_latest(
+            rc['MATCHING_ENGINE_SNAPSHOT_DIR'])
+    journal = None
+    if rc['MATCHING_ENGINE_JOURNAL']:
+        # Only read the journal after the position saved in the snapshot
+        checkpoint = None
+        if latest_snapshot is not None:
+            checkpoint = (latest_snapshot.journal_id, 
+                latest_snapshot.journal_seq, latest_snapshot.journal_offset)
+        journal = Journal(rc['MATCHING_ENGINE_JOURNAL'], checkpoint)
+    me = MatchingEngine(
+        sql_engine, use_order_book=rc['MATCHING_ENGINE_ORDER_BOOK'], 
+        journal=journal, 
+        snapshot_dir=rc['MATCHING_ENGINE_SNAPSHOT_DIR'] or None,
+        snapshot_every=int(rc['MATCHING_ENGINE_SNAPSHOT_EVERY']),
+        cash_minor_units=int(rc['CASH_MINOR_UNITS']),
+        fixed_point_cash=rc['FIXED_POINT_CASH'],
+        market_data=AmqpMarketDataPublisher(connection_parameters(rc)) 
+            if rc['MARKET_DATA'] else None,
+        latest_snapshot=latest_snapshot)
+    logger.info(f"Matching engine started at {me.hostname} with pid {me.pid}")
+    if journal is not None:
+        me.replay_journal()
+    return me
+
+
 def start_engine(config_overwrite: ty.Optional[ty.Dict] = None):
     """Obtain the final runtime configuration, then use it to spawn the 
-    necessary components and start listening for incoming messages
+    necessary components and start listening for incoming messages on the 
+    queues of the shards that this matching engine owns
 
     :param config_overwrite: overwriting runtime configuration
     :type config_overwrite: dict
@@ -442,24 +994,28 @@ def start_engine(config_overwrite: ty.Optional[ty.Dict] = None):
     logger.info("Starting matching engine")
 
     # Connect to RabbitMQ
-    mq_creds = pika.PlainCredentials(
-        rc['RABBITMQ_LOGIN'], rc['RABBITMQ_PASSWORD'])
-    mq_conn_params = pika.ConnectionParameters(
-        rc['RABBITMQ_HOST'], rc['RABBITMQ_PORT'], rc['RABBITMQ_VHOST'], mq_creds
-    )
-    mq_conn = pika.BlockingConnection(mq_conn_params)
+    mq_conn = pika.BlockingConnection(connection_parameters(rc))
     mq_ch = mq_conn.channel()
-    mq_ch.queue_declare(queue="incoming_order")
-    logger.info("Connected to RabbitMQ")
+    n_shards = int(rc['ORDER_QUEUE_SHARDS'])
+    declare_order_routing(mq_ch, n_shards)
+    shards = parse_shards(rc['MATCHING_ENGINE_SHARDS'], n_shards)
+    queues = [shard_queue(shard) for shard in shards]
+    logger.info(f"Connected to RabbitMQ; owning shards {shards} of {n_shards}")
     
-    # Connect to SQL and try to initialize schema if it does not exists already
-    sql_engine = create_engine(
-        rc['SQLALCHEMY_CONN'], echo=rc['SQLALCHEMY_ECHO'])
-    Base.metadata.create_all(sql_engine, checkfirst=True)
+    me = create_matching_engine(rc)
 
-    # Create the engine object
-    me = MatchingEngine(sql_engine)
-    logger.info(f"Matching engine started at {me.hostname} with pid {me.pid}")
+    batch_size = int(rc['MATCHING_ENGINE_BATCH_SIZE'])
+    batch_timeout = int(rc['MATCHING_ENGINE_BATCH_TIMEOUT_MS']) / 1000
+    if rc['MATCHING_ENGINE_DRY_RUN']:
+        on_batch = lambda bodies: None
+    elif me.journal is not None:
+        on_batch = start_journal_writer(me, batch_size)
+    else:
+        on_batch = lambda bodies: me.heartbeat_batch(
+            [Order.from_json(body) for body in bodies])
+    if batch_size > 1 or me.journal is not None:
+        consume_batches(mq_ch, queues, batch_size, batch_timeout, on_batch)
+        return
 
     def msg_callback(ch, method, properties, body):
         logger.info("Received %r" % body)
@@ -467,11 +1023,111 @@ def start_engine(config_overwrite: ty.Optional[ty.Dict] = None):
             me.heartbeat(Order.from_json(body))
         ch.basic_ack(delivery_tag=method.delivery_tag)
     
-    # Tells RabbitMQ not to give more than one message at a time;
-    # do not dispatch a new message to a worker until it has processed and 
-    # acknowledged the previous one
-    mq_ch.basic_qos(prefetch_count=1) 
-    mq_ch.basic_consume(queue="incoming_order", 
-                     on_message_callback=msg_callback)
+    # Tells RabbitMQ not to give more than one message at a time (across all 
+    # of the shard queues consumed on this channel); do not dispatch a new 
+    # message to a worker until it has processed and acknowledged the 
+    # previous one
+    mq_ch.basic_qos(prefetch_count=1, global_qos=True) 
+    for queue_name in queues:
+        mq_ch.basic_consume(queue=queue_name, on_message_callback=msg_callback)
     logger.info("Listening for incoming order")
-    mq_ch.start_consuming()            
+    mq_ch.start_consuming()
+
+
+def consume_batches(mq_ch: pika.adapters.blocking_connection.BlockingChannel,
+                    queues: ty.List[str], batch_size: int, 
+                    batch_timeout: float, 
+                    on_batch: ty.Callable[[ty.List[bytes]], None]):
+    """Consume the incoming orders in batches of up to batch_size messages: a 
+    batch is handed to on_batch when it is full, or when batch_timeout seconds 
+    have passed since its first message arrived. After on_batch returns, all 
+    messages of the batch are acknowledged at once
+
+    :param mq_ch: a channel on which the order routing is declared
+    :type mq_ch: BlockingChannel
+    :param queues: names of the queues to consume
+    :type queues: ty.List[str]
+    :param batch_size: maximum number of messages in a batch
+    :type batch_size: int
+    :param batch_timeout: maximum number of seconds to wait for a batch to fill
+    :type batch_timeout: float
+    :param on_batch: the callable that processes the message bodies of a batch
+    :type on_batch: ty.Callable[[ty.List[bytes]], None]
+    """
+    # Delivery tags increase monotonically on a channel, so the pending 
+    # messages are always sorted by their delivery tags
+    pending: ty.List[ty.Tuple[int, bytes]] = []
+
+    def msg_callback(ch, method, properties, body):
+        logger.info("Received %r" % body)
+        pending.append((method.delivery_tag, body))
+
+    # Let RabbitMQ dispatch up to a full batch of unacknowledged messages 
+    # across all of the shard queues consumed on this channel
+    mq_ch.basic_qos(prefetch_count=batch_size, global_qos=True)
+    for queue_name in queues:
+        mq_ch.basic_consume(queue=queue_name, on_message_callback=msg_callback)
+    logger.info(f"Listening for incoming order in batches of {batch_size}")
+
+    while True:
+        batch_start = None
+        while len(pending) < batch_size:
+            if batch_start is None and len(pending) > 0:
+                batch_start = time.monotonic()
+            if batch_start is None:
+                # Block until the first message of the batch arrives
+                mq_ch.connection.process_data_events(time_limit=None)
+                continue
+            time_limit = batch_timeout - (time.monotonic() - batch_start)
+            if time_limit <= 0:
+                break
+            mq_ch.connection.process_data_events(time_limit=time_limit)
+        batch, pending[:] = pending[:batch_size], pending[batch_size:]
+        if not batch:
+            continue
+        on_batch([body for _, body in batch])
+        mq_ch.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+
+
+def start_journal_writer(me: MatchingEngine, batch_size: int
+                         ) -> ty.Callable[[ty.List[bytes]], None]:
+    """Start a thread that heartbeats the journaled incoming orders in the 
+    order they are journaled, and return the callable that journals a batch 
+    of message bodies and hands them to that thread. Since the callable 
+    returns as soon as the batch is durable in the journal, the messages are 
+    acknowledged before their match results are committed to the main 
+    database; if the matching engine crashes in between, they are replayed 
+    from the journal when it restarts
+
+    :param me: a matching engine with a journal
+    :type me: MatchingEngine
+    :param batch_size: maximum number of orders matched per commit
+    :type batch_size: int
+    :return: the callable to pass to consume_batches
+    :rtype: ty.Callable[[ty.List[bytes]], None]
+    """
+    # The queue is bounded so that if the main database falls behind, the 
+    # consumer stops acknowledging messages instead of piling them up
+    journaled: queue.Queue = queue.Queue(maxsize=64 * batch_size)
+
+    def persist():
+        while True:
+            batch = [journaled.get()]
+            while len(batch) < batch_size and not journaled.empty():
+                batch.append(journaled.get())
+            try:
+                me.heartbeat_batch([Order(**r.body) for r in batch], batch)
+            except Exception:
+                # The batch is in the journal, so stop the consumer instead 
+                # of acknowledging more messages; the journal is replayed 
+                # when the matching engine restarts
+                logger.critical("Journal writer stopped", exc_info=True)
+                os.kill(os.getpid(), signal.SIGINT)
+                return
+
+    def on_batch(bodies: ty.List[bytes]):
+        for record in me.journal_inputs(bodies):
+            journaled.put(record)
+
+    threading.Thread(target=persist, name="journal-writer", daemon=True).start()
+    return on_batch
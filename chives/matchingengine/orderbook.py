@@ -0,0 +1,239 @@
+import bisect
+from collections import deque
+import datetime as dt
+import logging
+import typing as ty
+
+from sqlalchemy.orm import Session
+
+from chives.matchingengine.bookorder import BookOrder
+from chives.models import Order
+
+
+logger = logging.getLogger("chives.matchingengine")
+
+
+def price_key(order: BookOrder) -> ty.Union[int, float]:
+    """Return the price by which an order is indexed in the order book: its
+    price in ticks if its security is traded in ticks, or else its price. All
+    resting orders of a security are expected to use the same kind of price
+    """
+    return order.price if order.price_ticks is None else order.price_ticks
+
+
+def priority(order: BookOrder) -> ty.Tuple[dt.datetime, int]:
+    """Return the time priority of an order within its price level; orders 
+    whose create_dttm is not known yet are the newest
+    """
+    return (order.create_dttm or dt.datetime.max, order.order_id)
+
+
+class PriceLevels:
+    """One side of the order book of a single security: a sorted list of
+    distinct prices (see price_key), each of which maps to a FIFO queue of 
+    resting orders
+    """
+    def __init__(self):
+        self.prices: ty.List[ty.Union[int, float]] = []
+        self.queues: ty.Dict[ty.Union[int, float], ty.Deque[BookOrder]] = dict()
+
+    def add(self, order: BookOrder, front: bool = False):
+        """Append the order to the end of the queue at its price level,
+        creating the price level if it does not exist yet
+
+        :param order: the resting order
+        :type order: BookOrder
+        :param front: if True, the order is put at the front of the queue
+        instead, which is used for suborders that inherit the time priority of
+        their parent; defaults to False
+        :type front: bool, optional
+        """
+        price = price_key(order)
+        if price not in self.queues:
+            bisect.insort(self.prices, price)
+            self.queues[price] = deque()
+        if front:
+            self.queues[price].appendleft(order)
+        else:
+            self.queues[price].append(order)
+
+    def insert(self, order: BookOrder):
+        """Insert the order into the queue at its price level by its time 
+        priority, which is its create_dttm then its order_id
+
+        :param order: the resting order
+        :type order: BookOrder
+        """
+        self.add(order)
+        queue = self.queues[price_key(order)]
+        if len(queue) > 1 and priority(queue[-2]) > priority(order):
+            self.queues[price_key(order)] = deque(sorted(queue, key=priority))
+
+    def remove(self, order: BookOrder):
+        """Remove the order from its price level, then drop the price level
+        if it becomes empty
+
+        :param order: the resting order
+        :type order: BookOrder
+        """
+        price = price_key(order)
+        queue = self.queues[price]
+        queue.remove(order)
+        if len(queue) == 0:
+            del self.queues[price]
+            del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def iter_orders(self, descending: bool = False) -> ty.Iterator[BookOrder]:
+        """Iterate through all resting orders from the best price level to the
+        worst, and within each price level from the oldest to the newest
+
+        :param descending: if True, higher prices come first; defaults to False
+        :type descending: bool, optional
+        """
+        prices = reversed(self.prices) if descending else iter(self.prices)
+        for price in prices:
+            yield from self.queues[price]
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+
+class OrderBook:
+    """An in-memory copy of all active, priced orders, organized by security
+    symbol and side into sorted price levels, with an index from order_id to
+    the resting order.
+
+    The orders held by the order book are BookOrder copies of the
+    corresponding entries in the main database, which remains the source of
+    truth; the order book is only valid if there is exactly one matching
+    engine matching orders of the securities it holds.
+    """
+    def __init__(self):
+        self.books: ty.Dict[str, ty.Dict[str, PriceLevels]] = dict()
+        self.index: ty.Dict[int, BookOrder] = dict()
+
+    def _levels(self, symbol: str, side: str) -> PriceLevels:
+        if symbol not in self.books:
+            self.books[symbol] = {"ask": PriceLevels(), "bid": PriceLevels()}
+        return self.books[symbol][side]
+
+    def load(self, session: Session, symbol: ty.Optional[str] = None):
+        """(Re)build the order book from the active orders in the main
+        database. If a symbol is specified, then only that security's book is
+        rebuilt
+
+        :param session: a session bound to the main database
+        :type session: Session
+        :param symbol: the security symbol to reload, defaults to None
+        :type symbol: str, optional
+        """
+        cond = (Order.active == True) & (Order.price != None)
+        if symbol is not None:
+            cond = cond & (Order.security_symbol == symbol)
+            for order_id in [o.order_id for o in self.iter_orders(symbol)]:
+                self.index.pop(order_id)
+            self.books.pop(symbol, None)
+        else:
+            self.books, self.index = dict(), dict()
+        active_orders = session.query(*BookOrder.columns).filter(cond).order_by(
+            Order.create_dttm.asc(), Order.order_id.asc()).all()
+        for row in active_orders:
+            self.add(BookOrder(*row))
+        logger.info(f"Loaded {len(active_orders)} active orders into order book")
+
+    def add(self, order: BookOrder, front: bool = False):
+        """Add a resting order into the order book. Orders without a target
+        price are ignored since they can never be matched as a candidate
+
+        :param order: a resting order with an order_id
+        :type order: BookOrder
+        :param front: see PriceLevels.add; defaults to False
+        :type front: bool, optional
+        """
+        if order.price is None:
+            return
+        self._levels(order.security_symbol, order.side).add(order, front)
+        self.index[order.order_id] = order
+
+    def insert(self, order: BookOrder):
+        """Add a resting order into the order book by its time priority 
+        instead of at the end of its price level; see PriceLevels.insert
+
+        :param order: a resting order with an order_id
+        :type order: BookOrder
+        """
+        if order.price is None:
+            return
+        self._levels(order.security_symbol, order.side).insert(order)
+        self.index[order.order_id] = order
+
+    def remove(self, order_id: int) -> ty.Optional[BookOrder]:
+        """Remove the order with the specified order_id from the order book
+        and return it, or return None if there is no such order
+
+        :param order_id: ID of the order to remove
+        :type order_id: int
+        :return: the removed order
+        :rtype: ty.Optional[BookOrder]
+        """
+        order = self.index.pop(order_id, None)
+        if order is not None:
+            self._levels(order.security_symbol, order.side).remove(order)
+        return order
+
+    def iter_orders(self, symbol: str) -> ty.Iterator[BookOrder]:
+        """Iterate through all resting orders of a security symbol
+        """
+        for levels in self.books.get(symbol, dict()).values():
+            yield from levels.iter_orders()
+
+    def best(self, symbol: str, side: str
+             ) -> ty.Tuple[ty.Optional[float], int]:
+        """Return the best price on one side of a security's book and the
+        total size of the orders at that price, or (None, 0) if that side is
+        empty
+
+        :param symbol: the security symbol
+        :type symbol: str
+        :param side: "bid" or "ask"
+        :type side: str
+        """
+        levels = self._levels(symbol, side)
+        if len(levels.prices) == 0:
+            return None, 0
+        queue = levels.queues[
+            levels.prices[-1] if side == "bid" else levels.prices[0]]
+        return queue[0].price, sum(order.size for order in queue)
+
+    def get_candidates(self, incoming: Order) -> ty.Iterator[BookOrder]:
+        """Iterate through the resting orders that can be matched with the
+        incoming order in price-time priority, with the same conditions as
+        MatchingEngine.get_candidates
+
+        :param incoming: the incoming order
+        :type incoming: Order
+        """
+        limit = None if incoming.price is None else price_key(incoming)
+        if incoming.side == "bid":
+            levels = self._levels(incoming.security_symbol, "ask")
+            crosses = lambda price: price <= limit
+            candidates = levels.iter_orders()
+        else:
+            levels = self._levels(incoming.security_symbol, "bid")
+            crosses = lambda price: price >= limit
+            candidates = levels.iter_orders(descending=True)
+
+        for candidate in candidates:
+            if limit and not crosses(price_key(candidate)):
+                break
+            # Mimic SQL's "owner_id != :owner_id", which excludes NULL owners
+            if incoming.owner_id and (candidate.owner_id is None
+                or candidate.owner_id == incoming.owner_id):
+                continue
+            yield candidate
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, order_id: int):
+        return order_id in self.index
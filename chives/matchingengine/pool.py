@@ -0,0 +1,259 @@
+"""A supervisor that runs a pool of matching engine processes on one host.
+Security symbols are assigned to shards by a stable hash (see chives.routing),
+and shards are assigned to workers round-robin, so that each symbol is only
+ever matched by one worker. Workers that exit are restarted with a backoff,
+and the shards are reassigned when the number of workers changes: the workers
+whose shards change are stopped before any worker is started with their
+shards, so that no two workers ever own the same shard.
+
+The number of workers can be changed while the pool is running by sending
+SIGTTIN (one more worker) or SIGTTOU (one fewer worker) to the supervisor.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import typing as ty
+
+from chives.configs import DEFAULT_CONFIG, environment_overwrite
+from chives.matchingengine.aioengine import start_engine_async
+from chives.matchingengine.matchingengine import (
+    create_matching_engine, start_engine)
+from chives.routing import parse_shards
+
+
+logger = logging.getLogger("chives.matchingengine")
+
+
+def assign_shards(shards: ty.List[int], n_workers: int) -> ty.List[ty.List[int]]:
+    """Assign shards to workers round-robin; if there are more workers than
+    shards, the extra workers are assigned no shard
+
+    :param shards: the shards to assign
+    :type shards: ty.List[int]
+    :param n_workers: the number of workers
+    :type n_workers: int
+    :return: the shards of each worker
+    :rtype: ty.List[ty.List[int]]
+    """
+    return [shards[i::n_workers] for i in range(n_workers)]
+
+
+def worker_config(rc: ty.Dict, shards: ty.List[int]) -> ty.Dict:
+    """Return the runtime configuration of a worker that owns the shards.
+    Since a journal or a snapshot only describes the shards of the matching
+    engine that wrote it, each set of shards has its own journal and snapshot
+    directory
+    """
+    config = dict(rc)
+    suffix = "-".join(str(shard) for shard in shards)
+    config['MATCHING_ENGINE_SHARDS'] = ",".join(str(shard) for shard in shards)
+    if rc['MATCHING_ENGINE_JOURNAL']:
+        config['MATCHING_ENGINE_JOURNAL'] = \
+            f"{rc['MATCHING_ENGINE_JOURNAL']}.{suffix}"
+    if rc['MATCHING_ENGINE_SNAPSHOT_DIR']:
+        config['MATCHING_ENGINE_SNAPSHOT_DIR'] = os.path.join(
+            rc['MATCHING_ENGINE_SNAPSHOT_DIR'], f"shards-{suffix}")
+    return config
+
+
+def run_worker(config: ty.Dict, use_async: bool = False):
+    """The entry point of a worker process
+    """
+    # Forked workers inherit the supervisor's signal handlers; only the 
+    # supervisor handles SIGINT, and a worker is stopped with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for signum in [signal.SIGTERM, signal.SIGTTIN, signal.SIGTTOU]:
+        signal.signal(signum, signal.SIG_DFL)
+    if use_async:
+        start_engine_async(config)
+    else:
+        start_engine(config)
+
+
+class EnginePool:
+    """Supervise a pool of matching engine processes; see the module
+    docstring
+    """
+    min_backoff = 1.0
+    max_backoff = 30.0
+    stop_timeout = 10.0
+
+    def __init__(self, rc: ty.Dict, n_workers: int, use_async: bool = False,
+                 target: ty.Callable = run_worker, poll_interval: float = 1.0,
+                 start_method: str = "fork"):
+        """
+        :param rc: the runtime configuration shared by all workers
+        :type rc: ty.Dict
+        :param n_workers: the initial number of workers
+        :type n_workers: int
+        :param use_async: if True, the workers run start_engine_async instead
+        of start_engine, defaults to False
+        :type use_async: bool, optional
+        :param target: the entry point of the workers, which is called with
+        a worker's configuration and use_async, defaults to run_worker
+        :type target: ty.Callable, optional
+        :param poll_interval: number of seconds between two checks of the
+        workers, defaults to 1.0
+        :type poll_interval: float, optional
+        :param start_method: the multiprocessing start method, defaults to
+        "fork"
+        :type start_method: str, optional
+        """
+        self.rc = rc
+        self.use_async = use_async
+        self.target = target
+        self.poll_interval = poll_interval
+        self.ctx = multiprocessing.get_context(start_method)
+        n_shards = int(rc['ORDER_QUEUE_SHARDS'])
+        self.shards = parse_shards(rc['MATCHING_ENGINE_SHARDS'], n_shards)
+        if n_workers > len(self.shards):
+            logger.warning(f"{n_workers} workers for {len(self.shards)} "
+                           f"shards; some workers will be idle")
+        self.n_workers = n_workers
+        self.assignment: ty.List[ty.List[int]] = []
+        self.workers: ty.Dict[int, multiprocessing.Process] = dict()
+        self.started_at: ty.Dict[int, float] = dict()
+        # The number of consecutive crashes of each worker, and the earliest
+        # time at which it can be restarted
+        self.crashes: ty.Dict[int, int] = dict()
+        self.restart_at: ty.Dict[int, float] = dict()
+        self.stopping = False
+        self.resize_to: ty.Optional[int] = None
+
+    def start_worker(self, index: int):
+        shards = self.assignment[index]
+        if len(shards) == 0:
+            return
+        worker = self.ctx.Process(
+            target=self.target, name=f"matching-engine-{index}",
+            args=(worker_config(self.rc, shards), self.use_async), daemon=True)
+        worker.start()
+        self.workers[index] = worker
+        self.started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {worker.pid}) "
+                    f"owning shards {shards}")
+
+    def stop_worker(self, index: int):
+        """Stop a worker with SIGTERM, or SIGKILL if it does not exit in
+        time, then bring the main database up to date with its journal
+        """
+        worker = self.workers.pop(index, None)
+        self.crashes.pop(index, None)
+        self.restart_at.pop(index, None)
+        if worker is None:
+            return
+        if worker.is_alive():
+            worker.terminate()
+            worker.join(self.stop_timeout)
+            if worker.is_alive():
+                worker.kill()
+                worker.join()
+        logger.info(f"Stopped worker {index} (pid {worker.pid})")
+        if self.rc['MATCHING_ENGINE_JOURNAL']:
+            # Orders that were acknowledged but not committed are only in the
+            # worker's journal; its shards may be owned by a worker with a
+            # different journal from now on
+            config = worker_config(self.rc, self.assignment[index])
+            config['MATCHING_ENGINE_ORDER_BOOK'] = False
+            me = create_matching_engine(config)
+            me.journal.close()
+
+    def start(self):
+        self.assignment = assign_shards(self.shards, self.n_workers)
+        for index in range(self.n_workers):
+            self.start_worker(index)
+
+    def check(self):
+        """Restart the workers that have exited, waiting longer before each
+        restart of a worker that keeps crashing
+        """
+        now = time.monotonic()
+        for index, worker in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+            if index not in self.restart_at:
+                self.crashes[index] = self.crashes.get(index, 0) + 1
+                backoff = min(self.max_backoff,
+                    self.min_backoff * 2 ** (self.crashes[index] - 1))
+                self.restart_at[index] = now + backoff
+                logger.error(f"Worker {index} (pid {worker.pid}) exited with "
+                             f"{worker.exitcode}; restarting in {backoff}s")
+            elif now >= self.restart_at.pop(index):
+                self.start_worker(index)
+        # A worker that has stayed up for a while is no longer crashing
+        for index, worker in self.workers.items():
+            if worker.is_alive() \
+                and now - self.started_at[index] > self.max_backoff:
+                self.crashes.pop(index, None)
+
+    def resize(self, n_workers: int):
+        """Change the number of workers and reassign the shards. Only the
+        workers whose shards change are restarted; all of them are stopped
+        before any of them is started
+
+        :param n_workers: the new number of workers
+        :type n_workers: int
+        """
+        n_workers = max(1, n_workers)
+        assignment = assign_shards(self.shards, n_workers)
+        changed = [index for index in range(max(n_workers, self.n_workers))
+            if index >= n_workers or index >= self.n_workers
+                or assignment[index] != self.assignment[index]]
+        logger.info(f"Resizing from {self.n_workers} to {n_workers} workers")
+        for index in changed:
+            if index < self.n_workers:
+                self.stop_worker(index)
+        self.n_workers, self.assignment = n_workers, assignment
+        for index in changed:
+            if index < n_workers:
+                self.start_worker(index)
+
+    def stop(self):
+        for index in list(self.workers):
+            self.stop_worker(index)
+
+    def run(self):
+        """Start the workers, then supervise them until SIGTERM or SIGINT
+        """
+        def on_resize(signum, frame):
+            n = self.n_workers if self.resize_to is None else self.resize_to
+            self.resize_to = n + (1 if signum == signal.SIGTTIN else -1)
+
+        def on_stop(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGTTIN, on_resize)
+        signal.signal(signal.SIGTTOU, on_resize)
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        logger.info(f"Supervisor started with pid {os.getpid()}")
+        self.start()
+        try:
+            while not self.stopping:
+                if self.resize_to is not None:
+                    n_workers, self.resize_to = self.resize_to, None
+                    self.resize(n_workers)
+                self.check()
+                time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+
+
+def start_engine_pool(config_overwrite: ty.Optional[ty.Dict] = None,
+                      n_workers: int = 1, use_async: bool = False):
+    """Run n_workers matching engines under an EnginePool, sharing the shards
+    of MATCHING_ENGINE_SHARDS
+
+    :param config_overwrite: overwriting runtime configuration
+    :type config_overwrite: dict
+    :param n_workers: the initial number of workers, defaults to 1
+    :type n_workers: int, optional
+    :param use_async: see EnginePool, defaults to False
+    :type use_async: bool, optional
+    """
+    rc = environment_overwrite(DEFAULT_CONFIG)
+    if config_overwrite:
+        rc.update(config_overwrite)
+    EnginePool(rc, n_workers, use_async=use_async).run()
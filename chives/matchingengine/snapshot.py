@@ -0,0 +1,209 @@
+from collections import namedtuple
+import datetime as dt
+import glob
+import logging
+import math
+import os
+import struct
+import typing as ty
+import zlib
+
+from chives.matchingengine.bookorder import BookOrder
+from chives.matchingengine.orderbook import OrderBook
+
+
+logger = logging.getLogger("chives.matchingengine")
+
+Snapshot = namedtuple("Snapshot", [
+    "order_book", "last_order_id", "journal_seq", "journal_offset",
+    "create_dttm", "journal_id"])
+
+
+class SnapshotCorruptedError(ValueError):
+    """The exception to raise when a snapshot file has an unknown format or a
+    mismatching checksum
+    """
+    pass
+
+
+MAGIC = b"CHVS"
+VERSION = 3
+# magic, version, creation timestamp, last order_id, journal seq, journal
+# offset, journal ID, number of symbols
+HEADER = struct.Struct("<4sHdqqq16sI")
+SIDES = ["ask", "bid"]
+AON, IOC = 1, 2
+# Stands for a NULL price_ticks, since prices are never negative
+NO_TICKS = -1
+
+
+def _pack_column(fmt: str, values: ty.List) -> bytes:
+    return struct.pack(f"<{len(values)}{fmt}", *values)
+
+
+def _unpack_column(fmt: str, n: int, buf: bytes,
+                   offset: int) -> ty.Tuple[ty.Tuple, int]:
+    column = struct.Struct(f"<{n}{fmt}")
+    return column.unpack_from(buf, offset), offset + column.size
+
+
+def dumps(order_book: OrderBook, last_order_id: int, journal_seq: int = 0,
+          journal_offset: int = 0, journal_id: str = "") -> bytes:
+    """Serialize the order book into the snapshot format: a header, then for
+    each security symbol, the number of its orders followed by one
+    array-backed column per order attribute, then a CRC32 checksum. Orders
+    are written in price-time priority, so the order book read back has the
+    same FIFO queues
+
+    :param order_book: the order book
+    :type order_book: OrderBook
+    :param last_order_id: the largest order_id processed by the matching engine
+    :type last_order_id: int
+    :param journal_seq: the last journal sequence number committed to the
+    main database, defaults to 0
+    :type journal_seq: int, optional
+    :param journal_offset: a journal offset from which all records after
+    journal_seq can be found, defaults to 0
+    :type journal_offset: int, optional
+    :param journal_id: the ID of the journal that journal_seq and 
+    journal_offset refer to, defaults to ""
+    :type journal_id: str, optional
+    :return: the snapshot
+    :rtype: bytes
+    """
+    created_ts = dt.datetime.now(dt.timezone.utc).timestamp()
+    chunks = [HEADER.pack(MAGIC, VERSION, created_ts,
+        last_order_id, journal_seq, journal_offset, journal_id.encode(), 
+        len(order_book.books))]
+    for symbol in order_book.books:
+        orders = list(order_book.iter_orders(symbol))
+        encoded_symbol = symbol.encode("utf-8")
+        chunks.append(struct.pack(
+            f"<B{len(encoded_symbol)}sI", len(encoded_symbol), encoded_symbol,
+            len(orders)))
+        chunks.append(_pack_column("q", [o.order_id for o in orders]))
+        chunks.append(_pack_column("B", [SIDES.index(o.side) for o in orders]))
+        chunks.append(_pack_column("q", [o.size for o in orders]))
+        chunks.append(_pack_column("d", [o.price for o in orders]))
+        chunks.append(_pack_column("q", [
+            NO_TICKS if o.price_ticks is None else o.price_ticks
+            for o in orders]))
+        chunks.append(_pack_column("q", [
+            -1 if o.owner_id is None else o.owner_id for o in orders]))
+        chunks.append(_pack_column("q", [
+            -1 if o.parent_order_id is None else o.parent_order_id
+            for o in orders]))
+        chunks.append(_pack_column("B", [
+            (AON if o.all_or_none else 0) | (IOC if o.immediate_or_cancel else 0)
+            for o in orders]))
+        chunks.append(_pack_column("d", [
+            math.nan if o.create_dttm is None
+            else (o.create_dttm - dt.datetime(1970, 1, 1)).total_seconds()
+            for o in orders]))
+    body = b"".join(chunks)
+    return body + struct.pack("<I", zlib.crc32(body))
+
+
+def loads(buf: bytes) -> Snapshot:
+    """Deserialize a snapshot produced by dumps
+
+    :param buf: the snapshot
+    :type buf: bytes
+    :return: the snapshot with its order book
+    :rtype: Snapshot
+    """
+    if len(buf) < HEADER.size + 4 or struct.unpack_from(
+        "<I", buf, len(buf) - 4)[0] != zlib.crc32(buf[:-4]):
+        raise SnapshotCorruptedError("Snapshot checksum mismatch")
+    magic, version, created_ts, last_order_id, journal_seq, journal_offset, \
+        journal_id, n_symbols = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotCorruptedError(f"Unknown snapshot version {version}")
+
+    order_book = OrderBook()
+    offset = HEADER.size
+    for _ in range(n_symbols):
+        symbol_len, = struct.unpack_from("<B", buf, offset)
+        symbol, n = struct.unpack_from(f"<{symbol_len}sI", buf, offset + 1)
+        symbol = symbol.decode("utf-8")
+        offset += 1 + symbol_len + 4
+        order_ids, offset = _unpack_column("q", n, buf, offset)
+        sides, offset = _unpack_column("B", n, buf, offset)
+        sizes, offset = _unpack_column("q", n, buf, offset)
+        prices, offset = _unpack_column("d", n, buf, offset)
+        price_ticks, offset = _unpack_column("q", n, buf, offset)
+        owner_ids, offset = _unpack_column("q", n, buf, offset)
+        parent_ids, offset = _unpack_column("q", n, buf, offset)
+        flags, offset = _unpack_column("B", n, buf, offset)
+        create_ts, offset = _unpack_column("d", n, buf, offset)
+        for i in range(n):
+            order_book.add(BookOrder(
+                order_id=order_ids[i],
+                security_symbol=symbol,
+                side=SIDES[sides[i]],
+                size=sizes[i],
+                price=prices[i],
+                price_ticks=None if price_ticks[i] == NO_TICKS 
+                    else price_ticks[i],
+                all_or_none=bool(flags[i] & AON),
+                immediate_or_cancel=bool(flags[i] & IOC),
+                parent_order_id=None if parent_ids[i] < 0 else parent_ids[i],
+                owner_id=None if owner_ids[i] < 0 else owner_ids[i],
+                create_dttm=None if math.isnan(create_ts[i])
+                    else dt.datetime(1970, 1, 1)
+                        + dt.timedelta(seconds=create_ts[i])))
+    return Snapshot(order_book, last_order_id, journal_seq, journal_offset,
+                    dt.datetime.utcfromtimestamp(created_ts), 
+                    journal_id.rstrip(b"\0").decode())
+
+
+def save(directory: str, order_book: OrderBook, last_order_id: int,
+         journal_seq: int = 0, journal_offset: int = 0, journal_id: str = "",
+         keep: int = 2) -> str:
+    """Write a snapshot into the directory, then delete all but the newest
+    snapshots. The snapshot is first written to a temporary file that is
+    renamed once it is complete, so that a crash never leaves a partially
+    written snapshot behind
+
+    :param directory: the directory that holds the snapshots
+    :type directory: str
+    :param keep: number of snapshots to keep, defaults to 2
+    :type keep: int, optional
+    :return: path to the new snapshot
+    :rtype: str
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"snapshot-{last_order_id:020d}.chvs")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(order_book, last_order_id, journal_seq, journal_offset,
+                      journal_id))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    for old_path in sorted(glob.glob(os.path.join(
+            directory, "snapshot-*.chvs")))[:-keep]:
+        os.unlink(old_path)
+    logger.info(f"Saved order book snapshot {path}")
+    return path
+
+
+def load_latest(directory: str) -> ty.Optional[Snapshot]:
+    """Read the newest valid snapshot in the directory, or return None if
+    there is none
+
+    :param directory: the directory that holds the snapshots
+    :type directory: str
+    :return: the newest snapshot
+    :rtype: ty.Optional[Snapshot]
+    """
+    for path in reversed(sorted(glob.glob(
+            os.path.join(directory, "snapshot-*.chvs")))):
+        try:
+            with open(path, "rb") as f:
+                snapshot = loads(f.read())
+            logger.info(f"Read order book snapshot {path}")
+            return snapshot
+        except SnapshotCorruptedError as e:
+            logger.warning(f"Skipping snapshot {path}: {e}")
+    return None
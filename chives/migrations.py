@@ -0,0 +1,83 @@
+"""Bring an existing database up to date with the models without rebuilding
+it: create the missing tables, add the missing columns, and create the missing
+indexes. Columns are added as nullable, without their constraints, and are
+filled in by the backfills of the features that need them (see
+chives.fixedpoint and chives.history). On MySQL, indexes are built in place
+without locking the table, so the exchange can keep running while migrating.
+"""
+import logging
+import typing as ty
+
+from sqlalchemy import Table, inspect
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.schema import CreateIndex
+
+from chives.models import Base
+
+
+logger = logging.getLogger("chives.migrations")
+
+
+def add_missing_columns(sql_engine: SQLEngine, table: Table) -> ty.List[str]:
+    """Add the columns of a table that the database does not have yet
+
+    :return: the names of the added columns
+    :rtype: ty.List[str]
+    """
+    existing = [c["name"] for c in inspect(sql_engine).get_columns(table.name)]
+    added = []
+    with sql_engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=sql_engine.dialect)
+                conn.execute(f"ALTER TABLE {table.name} "
+                             f"ADD COLUMN {column.name} {column_type}")
+                logger.info(f"Added column {table.name}.{column.name}")
+                added.append(column.name)
+    return added
+
+
+def create_missing_indexes(sql_engine: SQLEngine, table: Table
+                           ) -> ty.List[str]:
+    """Create the indexes of a table that the database does not have yet
+
+    :return: the names of the created indexes
+    :rtype: ty.List[str]
+    """
+    existing = [i["name"] for i in inspect(sql_engine).get_indexes(table.name)]
+    created = []
+    for index in sorted(table.indexes, key=lambda i: i.name):
+        if index.name in existing:
+            continue
+        statement = str(CreateIndex(index).compile(dialect=sql_engine.dialect))
+        if sql_engine.dialect.name == "mysql":
+            statement += " ALGORITHM=INPLACE LOCK=NONE"
+        with sql_engine.begin() as conn:
+            conn.execute(statement)
+        logger.info(f"Created index {index.name}")
+        created.append(index.name)
+    return created
+
+
+def migrate(sql_engine: SQLEngine) -> ty.Dict[str, ty.List[str]]:
+    """Create the missing tables, columns and indexes of all models
+
+    :param sql_engine: the engine of the main database
+    :type sql_engine: SQLEngine
+    :return: a mapping from each table that was changed to the names of the
+    columns and indexes that were added
+    :rtype: ty.Dict[str, ty.List[str]]
+    """
+    existing_tables = inspect(sql_engine).get_table_names()
+    changes = dict()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(sql_engine)
+            logger.info(f"Created table {table.name}")
+            changes[table.name] = [table.name]
+            continue
+        added = add_missing_columns(sql_engine, table) \
+            + create_missing_indexes(sql_engine, table)
+        if added:
+            changes[table.name] = added
+    return changes
@@ -1,2 +1,3 @@
 from chives.models.models import (
-    Base, Order, Transaction, Asset, Company, User, MatchingEngineLog)
+    Base, Order, Transaction, Asset, Company, User, MatchingEngineLog, 
+    Candle)
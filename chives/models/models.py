@@ -3,7 +3,8 @@ import json
 
 from flask_login import UserMixin
 from sqlalchemy import (
-    Column, Integer, String, Boolean, Float, DateTime, ForeignKey)
+    Column, BigInteger, Integer, String, Boolean, Float, DateTime, ForeignKey,
+    Index)
 from sqlalchemy.orm import relationship
 
 from chives.db import Base
@@ -49,6 +50,9 @@ class Asset(Base):
                         primary_key=True)
     asset_symbol = Column(String(10), primary_key=True)
     asset_amount = Column(Float, nullable=False)
+    # With fixed-point cash, the exact amount of "_CASH" in minor units, from 
+    # which asset_amount is derived; see chives.fixedpoint
+    asset_amount_minor = Column(BigInteger)
 
     owner = relationship("User", back_populates="assets")
 
@@ -78,6 +82,9 @@ class Company(Base):
     initial_size = Column(Integer, nullable=False)
     founder_id = Column(Integer, ForeignKey('users.user_id', ondelete="SET NULL"))
     market_price = Column(Float, nullable=False)
+    # Number of cash minor units per price tick; if NULL, the company's stock 
+    # is traded at floating-point prices. See chives.fixedpoint
+    tick_size = Column(Integer)
     create_dttm = Column(DateTime, default=dt.datetime.utcnow)
 
     founder = relationship("User", back_populates="companies")
@@ -104,6 +111,8 @@ class Order(Base):
     size = Column(Integer, nullable=False)
     # market orders and sub-orders of market orders do not have target price
     price = Column(Float)
+    # The price in ticks, if the security is traded in ticks
+    price_ticks = Column(BigInteger)
     all_or_none = Column(Boolean, nullable=False, default=False)
     immediate_or_cancel = Column(Boolean, nullable=False, default=False)
     active = Column(Boolean, nullable=False, default=False)
@@ -115,6 +124,18 @@ class Order(Base):
 
     owner = relationship("User", back_populates="orders")
 
+    __table_args__ = (
+        # The matching engine reads the active orders on the opposite side 
+        # in price-time priority, by price or by price in ticks; on SQLite, 
+        # only active orders are indexed
+        Index("ix_orders_book", security_symbol, side, active, price, 
+              create_dttm, sqlite_where=(active == True)),
+        Index("ix_orders_book_ticks", security_symbol, side, active, 
+              price_ticks, create_dttm, sqlite_where=(active == True)),
+        # A user's most recent orders
+        Index("ix_orders_owner_dttm", owner_id, create_dttm),
+    )
+
     # A numerical placeholder, not a part of the database schema
     remaining_size: int = 0
 
@@ -124,6 +145,7 @@ class Order(Base):
             side=self.side,
             size=self.remaining_size,
             price=self.price,
+            price_ticks=self.price_ticks,
             all_or_none=self.all_or_none,
             immediate_or_cancel=self.immediate_or_cancel,
             active=self.active,
@@ -146,6 +168,7 @@ class Order(Base):
             side=self.side,
             size=self.size,
             price=self.price,
+            price_ticks=self.price_ticks,
             all_or_none=self.all_or_none,
             immediate_or_cancel=self.immediate_or_cancel,
             active=self.active,
@@ -169,6 +192,7 @@ class Order(Base):
             'side': self.side,
             'size': self.size,
             'price': self.price,
+            'price_ticks': self.price_ticks,
             'all_or_none': self.all_or_none,
             'immediate_or_cancel': self.immediate_or_cancel,
             'active': self.active,
@@ -214,6 +238,7 @@ class Transaction(Base):
     security_symbol = Column(String(10), nullable=False)
     size = Column(Integer, nullable=False)
     price = Column(Float, nullable=False)
+    price_ticks = Column(BigInteger)
     # With asks and bids, I am not going to define any relationships because 
     # the concept is strange: what is order.transactions? Is it all transactions 
     # that this order is involved in? Or is it specific to when this order is 
@@ -227,8 +252,22 @@ class Transaction(Base):
     resting_order_id = Column(Integer,
         ForeignKey('orders.order_id', ondelete="CASCADE"), 
         nullable=False, unique=True)
+    # The owners of the bid and the ask, copied from the orders so that a 
+    # user's transactions can be read without going through their orders
+    buyer_id = Column(Integer, 
+        ForeignKey('users.user_id', ondelete="CASCADE"))
+    seller_id = Column(Integer, 
+        ForeignKey('users.user_id', ondelete="CASCADE"))
     transact_dttm = Column(DateTime, nullable=False, default=dt.datetime.utcnow)
 
+    __table_args__ = (
+        # The stock chart and the candles read a security's transactions 
+        # within a window of time
+        Index("ix_transactions_symbol_dttm", security_symbol, transact_dttm),
+        Index("ix_transactions_buyer_dttm", buyer_id, transact_dttm),
+        Index("ix_transactions_seller_dttm", seller_id, transact_dttm),
+    )
+
     def __repr__(self):
         attr_list = ", ".join([
             f"id={self.transaction_id}",
@@ -244,6 +283,38 @@ class Transaction(Base):
         return self.__repr__()
 
 
+class Candle(Base):
+    """Open, high, low, close and volume of a security's transactions within 
+    a time bucket of span seconds that starts at start_dttm; see 
+    chives.candles. The sum of the prices and of their squares are kept so 
+    that the chart can show the spread of the prices without reading the 
+    transactions
+    """
+    __tablename__ = "candles"
+
+    security_symbol = Column(String(10), primary_key=True)
+    span = Column(Integer, primary_key=True)
+    start_dttm = Column(DateTime, primary_key=True)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+    volume = Column(Integer, nullable=False)
+    n_trades = Column(Integer, nullable=False)
+    price_sum = Column(Float, nullable=False)
+    price_sq_sum = Column(Float, nullable=False)
+
+    def __repr__(self):
+        attr_list = ", ".join([
+            f"symbol={self.security_symbol}",
+            f"span={self.span}",
+            f"start={self.start_dttm}",
+            f"ohlc=({self.open}, {self.high}, {self.low}, {self.close})",
+            f"volume={self.volume}",
+        ])
+        return f"<Candle({attr_list})>"
+
+
 class MatchingEngineLog(Base):
     """A database-side logging table for recording matching engine's activities:
 
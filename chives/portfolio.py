@@ -0,0 +1,58 @@
+"""Valuation of a user's portfolio: the cash, the shares of each security
+held and their market value at the security's last price, and the net worth.
+Assets are read along with their companies' market prices in one query, and
+the last prices in the market data cache, if there is one, take precedence.
+"""
+from collections import namedtuple
+import typing as ty
+
+from sqlalchemy.orm import Session
+
+from chives.models import Asset, Company
+
+
+CASH_SYMBOL = "_CASH"
+# market_price is None for a security that is not listed, which is valued at 0
+Position = namedtuple(
+    "Position", ["symbol", "amount", "market_price", "market_value"])
+Portfolio = namedtuple("Portfolio", ["cash", "positions", "net_worth"])
+
+
+def value_portfolio(session: Session, user_id: int,
+                    market_data=None) -> Portfolio:
+    """Return the portfolio of a user, leaving out empty positions
+
+    :param session: an ORM session
+    :type session: Session
+    :param user_id: the owner of the assets
+    :type user_id: int
+    :param market_data: a MarketDataCache whose last prices are used instead
+    of the companies' market prices, defaults to None
+    :type market_data: MarketDataCache, optional
+    :return: the cash, the positions ordered by symbol, and the net worth
+    :rtype: Portfolio
+    """
+    rows = session.query(
+        Asset.asset_symbol, Asset.asset_amount, Company.market_price
+    ).outerjoin(Company, Company.symbol == Asset.asset_symbol).filter(
+        Asset.owner_id == user_id).order_by(Asset.asset_symbol).all()
+    cash, positions = 0, []
+    for symbol, amount, market_price in rows:
+        if symbol == CASH_SYMBOL:
+            cash = amount
+            continue
+        if amount <= 0:
+            continue
+        if market_data is not None:
+            last_price = market_data.last_price(symbol)
+            if last_price is not None:
+                market_price = last_price
+        market_value = 0 if market_price is None else market_price * amount
+        positions.append(Position(symbol, amount, market_price, market_value))
+    net_worth = cash + sum(p.market_value for p in positions)
+    return Portfolio(cash, positions, net_worth)
+
+
+def portfolio_json(portfolio: Portfolio) -> ty.Dict:
+    return dict(cash=portfolio.cash, net_worth=portfolio.net_worth,
+                positions=[p._asdict() for p in portfolio.positions])
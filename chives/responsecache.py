@@ -0,0 +1,132 @@
+"""A response cache shared by the webserver's worker processes, kept in a
+SQLite file next to the application. Entries are keyed by the request they
+answer and by the version of the data they were computed from, such as the
+latest transaction of a security; storing the response of a new version
+evicts the other versions of the same request. Entries expire after a TTL,
+and the least recently used entries are evicted beyond a maximum number of
+entries.
+
+The cache is an optimization: if the file is locked or broken, requests are
+answered as if the cache were empty.
+"""
+from collections import namedtuple
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing as ty
+
+
+logger = logging.getLogger("chives.webserver")
+
+# body is the serialized response, etag is the hash of the body, and
+# last_modified is a Unix timestamp or None
+CachedResponse = namedtuple(
+    "CachedResponse", ["body", "etag", "last_modified"])
+
+
+def etag_of(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+
+class ResponseCache:
+    """See the module docstring
+    """
+    busy_timeout = 1.0
+
+    def __init__(self, path: str, ttl: float = 60, max_entries: int = 1000):
+        """
+        :param path: path of the SQLite file, which is created if it does not
+        exist
+        :type path: str
+        :param ttl: number of seconds an entry is kept, defaults to 60
+        :type ttl: float, optional
+        :param max_entries: maximum number of entries, defaults to 1000
+        :type max_entries: int, optional
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Each thread of each process has its own connection
+        self.local = threading.local()
+        conn = sqlite3.connect(path, timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, grp TEXT NOT NULL, body BLOB NOT NULL,
+            etag TEXT NOT NULL, last_modified REAL, expires REAL NOT NULL,
+            accessed REAL NOT NULL)""")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_responses_grp ON responses (grp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed "
+                     "ON responses (accessed)")
+        conn.commit()
+        conn.close()
+
+    def connect(self) -> sqlite3.Connection:
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None)
+        return self.local.conn
+
+    def get(self, key: str) -> ty.Optional[CachedResponse]:
+        """Return the entry of the key if it has not expired, or None
+        """
+        now = time.time()
+        try:
+            conn = self.connect()
+            row = conn.execute(
+                "SELECT body, etag, last_modified FROM responses "
+                "WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e!r}")
+            return None
+        return CachedResponse(*row)
+
+    def put(self, key: str, group: str, body: bytes,
+            last_modified: ty.Optional[float] = None) -> CachedResponse:
+        """Store the response of a key, replacing the other entries of its
+        group, then evict expired and least recently used entries
+
+        :param key: the key of the response, which includes the version of
+        the data that it was computed from
+        :type key: str
+        :param group: the key without the version
+        :type group: str
+        :param body: the serialized response
+        :type body: bytes
+        :param last_modified: the Unix timestamp at which the data was last
+        modified, defaults to None
+        :type last_modified: float, optional
+        :return: the stored entry
+        :rtype: CachedResponse
+        """
+        entry = CachedResponse(body, etag_of(body), last_modified)
+        now = time.time()
+        try:
+            conn = self.connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM responses WHERE grp = ? OR expires "
+                             "<= ?", (group, now))
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?)",
+                    (key, group, body, entry.etag, last_modified,
+                     now + self.ttl, now))
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM "
+                    "responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,))
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e!r}")
+        return entry
+
+    def __len__(self):
+        return self.connect().execute(
+            "SELECT COUNT(*) FROM responses").fetchone()[0]
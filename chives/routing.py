@@ -0,0 +1,313 @@
+"""Routing of incoming orders from the webserver (or the benchmark) to the
+matching engines. Each security symbol is assigned to one of a fixed number of
+shards by a stable hash; each shard has its own queue, bound to a direct
+exchange with the shard number as its routing key. A matching engine consumes
+the queues of the shards it is configured to own, so that orders of the same
+security are always matched by the same matching engine, in the order they
+are submitted.
+
+The webserver publishes orders with an OrderPublisher, which keeps one
+connection open per process on a background thread.
+"""
+from collections import deque
+import logging
+import os
+import threading
+import time
+import typing as ty
+import zlib
+
+import pika
+from pika.adapters.select_connection import SelectConnection
+
+from chives.models import Order
+
+ORDER_EXCHANGE = "incoming_order_router"
+ORDER_QUEUE_PREFIX = "incoming_order"
+
+logger = logging.getLogger("chives.routing")
+
+
+def connection_parameters(rc: ty.Dict) -> pika.ConnectionParameters:
+    """Return the parameters for connecting to RabbitMQ under a runtime 
+    configuration
+    """
+    mq_creds = pika.PlainCredentials(
+        rc['RABBITMQ_LOGIN'], rc['RABBITMQ_PASSWORD'])
+    return pika.ConnectionParameters(
+        rc['RABBITMQ_HOST'], rc['RABBITMQ_PORT'], rc['RABBITMQ_VHOST'], mq_creds
+    )
+
+
+def shard_of(symbol: str, n_shards: int) -> int:
+    """Return the shard that a security symbol is assigned to. The hash is
+    stable across processes and hosts, unlike the builtin hash()
+
+    :param symbol: the security symbol
+    :type symbol: str
+    :param n_shards: the total number of shards
+    :type n_shards: int
+    :return: a shard number between 0 and n_shards - 1
+    :rtype: int
+    """
+    return zlib.crc32(symbol.encode("utf-8")) % n_shards
+
+
+def shard_queue(shard: int) -> str:
+    """Return the name of the queue that holds the incoming orders of a shard
+    """
+    return f"{ORDER_QUEUE_PREFIX}.{shard}"
+
+
+def parse_shards(spec: ty.Optional[str], n_shards: int) -> ty.List[int]:
+    """Parse a comma-separated list of shard numbers such as "0,2,3"; an empty
+    specification means all shards
+
+    :param spec: the comma-separated list of shard numbers
+    :type spec: str
+    :param n_shards: the total number of shards
+    :type n_shards: int
+    :return: a sorted list of distinct shard numbers
+    :rtype: ty.List[int]
+    """
+    if not spec:
+        return list(range(n_shards))
+    shards = sorted(set(int(s) for s in str(spec).split(",") if s.strip()))
+    for shard in shards:
+        if not 0 <= shard < n_shards:
+            raise ValueError(f"Shard {shard} is not between 0 and {n_shards - 1}")
+    return shards
+
+
+def declare_order_routing(ch: pika.adapters.blocking_connection.BlockingChannel,
+                          n_shards: int, callback: ty.Optional[ty.Callable] = None):
+    """Declare the order exchange, the queues of all shards, and the bindings
+    between them. Declarations are idempotent, so this can be called by every
+    publisher and every matching engine
+
+    :param ch: an open channel
+    :type ch: BlockingChannel
+    :param n_shards: the total number of shards
+    :type n_shards: int
+    :param callback: on an asynchronous channel, called with the Queue.BindOk 
+    frame of the last binding, once all of them exist; defaults to None
+    :type callback: ty.Callable, optional
+    """
+    ch.exchange_declare(exchange=ORDER_EXCHANGE, exchange_type="direct")
+    for shard in range(n_shards):
+        ch.queue_declare(queue=shard_queue(shard))
+        kwargs = dict(callback=callback) \
+            if callback is not None and shard == n_shards - 1 else dict()
+        ch.queue_bind(queue=shard_queue(shard), exchange=ORDER_EXCHANGE,
+                      routing_key=str(shard), **kwargs)
+
+
+def publish_order(ch: pika.adapters.blocking_connection.BlockingChannel,
+                  order: Order, n_shards: int):
+    """Publish an order to the shard that its security symbol is assigned to
+
+    :param ch: a channel on which declare_order_routing has been called
+    :type ch: BlockingChannel
+    :param order: the order, which must already have its order_id
+    :type order: Order
+    :param n_shards: the total number of shards
+    :type n_shards: int
+    """
+    ch.basic_publish(exchange=ORDER_EXCHANGE,
+                     routing_key=str(shard_of(order.security_symbol, n_shards)),
+                     body=order.json)
+
+
+# The routing key and the body of a message
+Message = ty.Tuple[str, str]
+
+
+class OrderPublisher:
+    """A long-lived publisher of orders for one process. publish only queues 
+    the messages and returns; a background thread, started on the first 
+    publish, owns the connection and a single channel, on which it declares 
+    the order routing once and publishes the queued messages. If the 
+    connection is lost, the thread reconnects after reconnect_delay seconds.
+
+    With publisher confirms, each message is kept until the broker confirms 
+    it. The broker confirms messages in batches (with "multiple"), and 
+    messages that are rejected or still unconfirmed when the connection is 
+    lost are published again, so every order is delivered at least once.
+    """
+    reconnect_delay = 1.0
+
+    def __init__(self, conn_params: pika.ConnectionParameters, n_shards: int,
+                 confirm: bool = False):
+        """
+        :param conn_params: the parameters for connecting to RabbitMQ
+        :type conn_params: pika.ConnectionParameters
+        :param n_shards: the total number of shards
+        :type n_shards: int
+        :param confirm: if True, use publisher confirms, defaults to False
+        :type confirm: bool, optional
+        """
+        self.conn_params = conn_params
+        self.n_shards = n_shards
+        self.confirm = confirm
+        self.lock = threading.Lock()
+        # Messages waiting to be published, and published messages waiting 
+        # to be confirmed by their delivery tag
+        self.pending: ty.Deque[Message] = deque()
+        self.unconfirmed: ty.Dict[int, Message] = dict()
+        self.next_tag = 1
+        self.pid: ty.Optional[int] = None
+        self.thread: ty.Optional[threading.Thread] = None
+        self.conn: ty.Optional[SelectConnection] = None
+        self.ch = None
+        self.stopping = False
+        # The last connection error, which is cleared once connected
+        self.error: ty.Optional[Exception] = None
+
+    def publish(self, orders: ty.List[Order]):
+        """Queue orders for publishing to the shards of their security 
+        symbols, starting the background thread if it is not running in this 
+        process
+
+        :param orders: the orders, which must already have their order_id
+        :type orders: ty.List[Order]
+        """
+        messages = [(str(shard_of(order.security_symbol, self.n_shards)),
+                     order.json) for order in orders]
+        with self.lock:
+            self.pending.extend(messages)
+            if self.pid != os.getpid():
+                # Not started yet, or inherited from the parent of a fork
+                self.pid = os.getpid()
+                self.conn, self.ch, self.error = None, None, None
+                self.unconfirmed, self.stopping = dict(), False
+                self.thread = threading.Thread(
+                    target=self.run, name="order-publisher", daemon=True)
+                self.thread.start()
+            conn = self.conn
+        if conn is not None:
+            try:
+                conn.ioloop.add_callback_threadsafe(self.flush)
+            except Exception:
+                # The connection is being replaced, and the new one flushes 
+                # the queued messages once it is open
+                pass
+
+    @property
+    def healthy(self) -> bool:
+        """False if the last attempt to connect failed
+        """
+        return self.error is None
+
+    def run(self):
+        while not self.stopping:
+            conn = SelectConnection(
+                self.conn_params, on_open_callback=self.on_open,
+                on_open_error_callback=self.on_open_error,
+                on_close_callback=self.on_close)
+            with self.lock:
+                self.conn = conn
+            conn.ioloop.start()
+            with self.lock:
+                self.conn, self.ch = None, None
+                # Publish the unconfirmed messages again, in order
+                self.pending.extendleft(reversed(
+                    [self.unconfirmed[tag] for tag in sorted(self.unconfirmed)]))
+                self.unconfirmed = dict()
+            if not self.stopping:
+                time.sleep(self.reconnect_delay)
+
+    def on_open(self, conn: SelectConnection):
+        self.error = None
+        conn.channel(on_open_callback=self.on_channel_open)
+
+    def on_open_error(self, conn: SelectConnection, error):
+        logger.error(f"Order publisher failed to connect: {error!r}")
+        self.error = error if isinstance(error, Exception) \
+            else ConnectionError(error)
+        conn.ioloop.stop()
+
+    def on_close(self, conn: SelectConnection, reason):
+        if not self.stopping:
+            logger.error(f"Order publisher disconnected: {reason!r}")
+        conn.ioloop.stop()
+
+    def on_channel_open(self, ch):
+        conn = self.conn
+        # Reconnect if the broker closes the channel, e.g. on a publish error
+        ch.add_on_close_callback(lambda ch, reason: 
+            conn.close() if conn.is_open else None)
+        # Pika queues up RPCs on a channel, so they are sent one at a time, 
+        # but basic_publish does not wait behind them: publishing starts once 
+        # the last binding exists, or the channel is in confirm mode, so that 
+        # no message is dropped by the exchange or left out of the broker's 
+        # delivery tags
+        if self.confirm:
+            declare_order_routing(ch, self.n_shards)
+            ch.confirm_delivery(self.on_confirm,
+                                callback=lambda frame: self.on_ready(ch))
+        else:
+            declare_order_routing(ch, self.n_shards,
+                                  callback=lambda frame: self.on_ready(ch))
+
+    def on_ready(self, ch):
+        with self.lock:
+            self.next_tag = 1
+            self.ch = ch
+        self.flush()
+
+    def flush(self):
+        """Publish the queued messages; only called on the connection's 
+        thread
+        """
+        if self.ch is None or not self.ch.is_open:
+            return
+        with self.lock:
+            for routing_key, body in self.pending:
+                self.ch.basic_publish(
+                    exchange=ORDER_EXCHANGE, routing_key=routing_key, body=body)
+                if self.confirm:
+                    self.unconfirmed[self.next_tag] = (routing_key, body)
+                    self.next_tag += 1
+            self.pending.clear()
+
+    def on_confirm(self, frame):
+        """Forget the messages that the broker acknowledged, and publish the 
+        ones it rejected again
+        """
+        method = frame.method
+        with self.lock:
+            if method.multiple:
+                tags = [t for t in self.unconfirmed if t <= method.delivery_tag]
+            else:
+                tags = [method.delivery_tag]
+            messages = [self.unconfirmed.pop(tag) for tag in sorted(tags)
+                        if tag in self.unconfirmed]
+            rejected = isinstance(method, pika.spec.Basic.Nack) and messages
+            if rejected:
+                self.pending.extendleft(reversed(messages))
+        if rejected:
+            logger.warning(f"{len(messages)} orders were rejected by the "
+                           "broker; publishing them again")
+            self.flush()
+
+    def wait(self, timeout: float = 10.0) -> bool:
+        """Wait until all queued messages are published (and confirmed, with 
+        publisher confirms); return False if they are not within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                if not self.pending and not self.unconfirmed:
+                    return True
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+
+    def close(self):
+        self.stopping = True
+        conn = self.conn
+        if conn is not None:
+            conn.ioloop.add_callback_threadsafe(
+                lambda: conn.close() if conn.is_open else conn.ioloop.stop())
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join()
@@ -3,8 +3,6 @@ import typing as ty
 
 from flask import Flask, request, jsonify, g
 from flask_login import LoginManager
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 from chives.models import Base, Order, Transaction
 from chives.configs import environment_overwrite, DEFAULT_CONFIG
@@ -25,8 +23,10 @@ def create_app(config_overwrite: ty.Optional[ty.Dict] = None) -> Flask:
     if config_overwrite:
         rc.update(config_overwrite)
 
-    # Create database schema if it doesn't exist
-    sql_engine = create_engine(rc['SQLALCHEMY_CONN'])
+    # Create the process's engine and connection pool, and the database 
+    # schema if it doesn't exist
+    from chives.db import create_sql_engine, init_app 
+    sql_engine = create_sql_engine(rc)
     Base.metadata.create_all(sql_engine, checkfirst=True)
 
     # Create the application and set the runtime configuration
@@ -38,10 +38,27 @@ def create_app(config_overwrite: ty.Optional[ty.Dict] = None) -> Flask:
     except OSError:
         pass
 
-    from chives.db import init_app 
-    init_app(app)
+    init_app(app, sql_engine)
     login_manager.init_app(app)
 
+    if rc['MARKET_DATA']:
+        # Keep the last prices and quotes up to date from the matching 
+        # engines' market data instead of reading them from the database; 
+        # the consumer is started by get_market_data in each process that 
+        # serves requests, after any fork
+        from chives.marketdata import MarketDataCache
+        from chives.routing import connection_parameters
+        app.extensions['chives_market_data'] = MarketDataCache(
+            connection_parameters(rc), sql_engine)
+
+    if int(rc['RESPONSE_CACHE_TTL']) > 0:
+        from chives.responsecache import ResponseCache
+        app.extensions['chives_response_cache'] = ResponseCache(
+            rc['RESPONSE_CACHE_PATH'] or os.path.join(
+                app.instance_path, "response_cache.sqlite"),
+            ttl=int(rc['RESPONSE_CACHE_TTL']),
+            max_entries=int(rc['RESPONSE_CACHE_MAX_ENTRIES']))
+
     from chives.blueprints.auth import bp as auth_bp 
     from chives.blueprints.debug import bp as debug_bp
     from chives.blueprints.exchange import bp as ex_bp
@@ -50,5 +67,9 @@ def create_app(config_overwrite: ty.Optional[ty.Dict] = None) -> Flask:
     app.register_blueprint(debug_bp)
     app.register_blueprint(ex_bp)
     app.register_blueprint(api_bp)
-    
+
+    # Connections opened so far must not be shared with the worker processes 
+    # that a server such as uwsgi may fork from this one; each process fills 
+    # its own copy of the pool from here on
+    sql_engine.dispose()
     return app
@@ -0,0 +1,219 @@
+"""Seeded synthetic workloads for the benchmarks and replay tools. Unlike the
+single seller and buyer of chives.benchmark, a workload spreads its orders
+over many securities, by Zipf popularity, and many users, who can trade with
+themselves (which the matching engine filters out). Orders arrive as a
+Poisson process, and are a mix of limit, market, all-or-none and
+immediate-or-cancel orders, priced around a mid price that follows a random
+walk from each company's market price, so that books build up depth and some
+limit orders cross the spread.
+
+A workload is saved as an order stream file of JSON lines: a header with the
+parameters, the companies and the users, then one order per line, with its
+arrival time in seconds from the start and the attributes of Order.json
+except its order_id, which is assigned by load_workload.
+"""
+from collections import namedtuple
+import json
+import math
+import random
+import typing as ty
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from chives.models import Asset, Company, Order, User
+
+
+WORKLOAD_FORMAT = "chives-workload"
+WORKLOAD_VERSION = 1
+
+# orders are dictionaries of the attributes of Order, plus the arrival time
+# "t"; holdings map each user_id to the shares of each symbol they start with
+Workload = namedtuple(
+    "Workload", ["params", "companies", "users", "holdings", "orders"])
+
+
+def zipf_weights(n: int, s: float) -> ty.List[float]:
+    """Return the popularity of ranks 1 to n under Zipf's law with exponent s
+    """
+    weights = [1 / (k ** s) for k in range(1, n + 1)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def generate_workload(n_orders: int = 10000, n_symbols: int = 10,
+                      zipf_s: float = 1.1, n_users: int = 100,
+                      rate: float = 100.0, market_ratio: float = 0.1,
+                      aon_ratio: float = 0.05, ioc_ratio: float = 0.1,
+                      volatility: float = 0.002, spread: float = 0.005,
+                      max_size: int = 100, initial_shares: int = 100000,
+                      market_prices: ty.Optional[ty.Dict[str, float]] = None,
+                      seed: int = 0) -> Workload:
+    """Generate a workload; the same parameters always generate the same
+    workload
+
+    :param n_orders: number of orders, defaults to 10000
+    :type n_orders: int, optional
+    :param n_symbols: number of securities, unless market_prices is given,
+    defaults to 10
+    :type n_symbols: int, optional
+    :param zipf_s: exponent of the securities' Zipf popularity; 0 makes them
+    equally popular, defaults to 1.1
+    :type zipf_s: float, optional
+    :param n_users: number of users, defaults to 100
+    :type n_users: int, optional
+    :param rate: mean number of orders arriving per second, defaults to 100
+    :type rate: float, optional
+    :param market_ratio: fraction of market orders, defaults to 0.1
+    :type market_ratio: float, optional
+    :param aon_ratio: fraction of limit orders that are all-or-none, defaults
+    to 0.05
+    :type aon_ratio: float, optional
+    :param ioc_ratio: fraction of limit orders that are immediate-or-cancel,
+    defaults to 0.1
+    :type ioc_ratio: float, optional
+    :param volatility: standard deviation of a security's log mid price
+    change per order of the security, defaults to 0.002
+    :type volatility: float, optional
+    :param spread: standard deviation of a limit price's relative distance
+    from the mid price, defaults to 0.005
+    :type spread: float, optional
+    :param max_size: maximum size of an order, defaults to 100
+    :type max_size: int, optional
+    :param initial_shares: shares of each security that each user starts
+    with, defaults to 100000
+    :type initial_shares: int, optional
+    :param market_prices: the securities and their market prices to start
+    from, such as those of the companies in a database; defaults to None,
+    which generates n_symbols securities priced between 10 and 100
+    :type market_prices: ty.Dict[str, float], optional
+    :param seed: the random seed, defaults to 0
+    :type seed: int, optional
+    :rtype: Workload
+    """
+    rng = random.Random(seed)
+    if market_prices is None:
+        market_prices = {f"SYM{i}": round(rng.uniform(10, 100), 2)
+                         for i in range(n_symbols)}
+    params = dict(
+        n_orders=n_orders, zipf_s=zipf_s, n_users=n_users, rate=rate,
+        market_ratio=market_ratio, aon_ratio=aon_ratio, ioc_ratio=ioc_ratio,
+        volatility=volatility, spread=spread, max_size=max_size,
+        initial_shares=initial_shares, seed=seed)
+    symbols = sorted(market_prices)
+    # Popularity follows a random order of the securities
+    ranked = rng.sample(symbols, len(symbols))
+    weights = zipf_weights(len(ranked), zipf_s)
+    mids = dict(market_prices)
+    user_ids = list(range(1, n_users + 1))
+    # Shares left to sell, since asks reserve their shares at submission
+    unreserved = {(u, s): initial_shares for u in user_ids for s in symbols}
+
+    orders = []
+    t = 0.0
+    for i in range(n_orders):
+        t += rng.expovariate(rate)
+        symbol = rng.choices(ranked, weights)[0]
+        owner_id = rng.choice(user_ids)
+        size = rng.randint(1, max_size)
+        side = rng.choice(["ask", "bid"])
+        if side == "ask" and unreserved[(owner_id, symbol)] < size:
+            side = "bid"
+        if side == "ask":
+            unreserved[(owner_id, symbol)] -= size
+        mids[symbol] *= math.exp(rng.gauss(0, volatility))
+
+        price, aon, ioc = None, False, True
+        if rng.random() >= market_ratio:
+            # Mostly on the passive side of the mid price, sometimes across
+            sign = 1 if side == "ask" else -1
+            offset = rng.gauss(spread / 2, spread)
+            price = max(0.01, round(mids[symbol] * (1 + sign * offset), 2))
+            kind = rng.random()
+            aon = kind < aon_ratio
+            ioc = aon_ratio <= kind < aon_ratio + ioc_ratio
+        orders.append(dict(
+            t=round(t, 6), security_symbol=symbol, side=side, size=size,
+            price=price, all_or_none=aon, immediate_or_cancel=ioc,
+            owner_id=owner_id))
+
+    companies = [dict(symbol=s, market_price=market_prices[s])
+                 for s in symbols]
+    users = [dict(user_id=u, username=f"trader{u}") for u in user_ids]
+    holdings = {u: {s: initial_shares for s in symbols} for u in user_ids}
+    return Workload(params, companies, users, holdings, orders)
+
+
+def write_workload(path: str, workload: Workload):
+    """Save a workload as an order stream file
+    """
+    with open(path, "w") as f:
+        header = dict(
+            format=WORKLOAD_FORMAT, version=WORKLOAD_VERSION,
+            params=workload.params, companies=workload.companies,
+            users=workload.users,
+            holdings={str(u): h for u, h in workload.holdings.items()})
+        f.write(json.dumps(header) + "\n")
+        for order in workload.orders:
+            f.write(json.dumps(order) + "\n")
+
+
+def read_workload(path: str) -> Workload:
+    """Read a workload from an order stream file
+
+    :raises ValueError: if the file is not an order stream file of this
+    version
+    """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get("format") != WORKLOAD_FORMAT \
+                or header.get("version") != WORKLOAD_VERSION:
+            raise ValueError(f"{path} is not a {WORKLOAD_FORMAT} file of "
+                             f"version {WORKLOAD_VERSION}")
+        orders = [json.loads(line) for line in f if line.strip()]
+    holdings = {int(u): h for u, h in header["holdings"].items()}
+    return Workload(header["params"], header["companies"], header["users"],
+                    holdings, orders)
+
+
+def load_workload(session: Session, workload: Workload,
+                  cash: float = 1e9) -> ty.List[Order]:
+    """Add the users, their assets and the companies of a workload to an
+    empty database, then submit its orders as the webserver does: commit
+    them, inactive, with the shares of the asks subtracted from their owners
+
+    :param session: a session of an empty database
+    :type session: Session
+    :param workload: the workload
+    :type workload: Workload
+    :param cash: cash of each user, defaults to 1e9
+    :type cash: float, optional
+    :return: the committed orders, in the order they arrive, with their
+    order_id's
+    :rtype: ty.List[Order]
+    """
+    reserved = dict()
+    for order in workload.orders:
+        if order["side"] == "ask":
+            key = (order["owner_id"], order["security_symbol"])
+            reserved[key] = reserved.get(key, 0) + order["size"]
+    session.add_all([User(user_id=u["user_id"], username=u["username"],
+                          password_hash="x") for u in workload.users])
+    session.add_all([Company(symbol=c["symbol"], name=c["symbol"],
+        initial_value=c["market_price"], initial_size=1,
+        market_price=c["market_price"]) for c in workload.companies])
+    for user_id, shares in workload.holdings.items():
+        session.add(Asset(owner_id=user_id, asset_symbol="_CASH",
+                          asset_amount=cash))
+        session.add_all([Asset(owner_id=user_id, asset_symbol=symbol,
+            asset_amount=amount - reserved.get((user_id, symbol), 0))
+            for symbol, amount in shares.items()])
+    session.flush()
+
+    first_id = (session.query(func.max(Order.order_id)).scalar() or 0) + 1
+    orders = [Order(order_id=first_id + i, active=False, **{
+        k: v for k, v in order.items() if k != "t"})
+        for i, order in enumerate(workload.orders)]
+    session.add_all(orders)
+    session.commit()
+    return orders
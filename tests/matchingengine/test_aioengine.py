@@ -0,0 +1,141 @@
+"""
+Test cases for the asyncio matching engine service, driven by the in-process
+order queue instead of RabbitMQ
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.matchingengine.aioengine import (
+    AsyncMatchingService, LocalOrderQueue)
+from chives.matchingengine.journal import Journal
+from chives.matchingengine.matchingengine import MatchingEngine
+from chives.models import Order, Transaction
+
+
+def publish_orders(me: MatchingEngine, source: LocalOrderQueue):
+    """Commit the same orders as test_heartbeat_batch, then publish them
+    """
+    static_orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=100, price=100),
+        Order(order_id=2, security_symbol="X", side="ask", size=100, price=99),
+        Order(order_id=3, security_symbol="X", side="bid", size=120, price=101),
+        Order(order_id=4, security_symbol="X", side="bid", size=90, price=None,
+                immediate_or_cancel=True),
+        Order(order_id=5, security_symbol="Y", side="ask", size=10, price=5),
+    ]
+    me.session.add_all(static_orders); me.session.commit()
+    for order in static_orders:
+        source.publish(order.json)
+    me.session.close()
+    return static_orders
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 4])
+def test_pipelined_service(sql_engine: SQLEngine, batch_size: int):
+    """Check that the service matches the orders in the order they are
+    published regardless of how they are batched, and acknowledges all of
+    them after they are committed
+    """
+    me = MatchingEngine(sql_engine, ignore_user_logic=True)
+    source = LocalOrderQueue()
+    static_orders = publish_orders(me, source)
+    service = AsyncMatchingService(
+        me, source, batch_size=batch_size, batch_timeout=0.01)
+    asyncio.run(asyncio.wait_for(service.run(len(static_orders)), 10))
+
+    transactions = me.session.query(Transaction).order_by(
+        Transaction.transaction_id).all()
+    assert [(t.ask_id, t.bid_id, t.size) for t in transactions] == [
+        (2, 3, 100), (1, 3, 20), (6, 4, 80)]
+    assert me.session.query(Order).get(5).active
+    assert source.acked_tag == len(static_orders)
+
+
+def test_pipelined_service_with_journal(sql_engine: SQLEngine):
+    """Check that with a journal, the orders are journaled before they are
+    committed
+    """
+    directory = tempfile.mkdtemp()
+    journal = Journal(os.path.join(directory, "journal"))
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, journal=journal)
+    source = LocalOrderQueue()
+    static_orders = publish_orders(me, source)
+    service = AsyncMatchingService(me, source, batch_size=2, batch_timeout=0.01)
+    asyncio.run(asyncio.wait_for(service.run(len(static_orders)), 10))
+
+    assert me.session.query(Transaction).count() == 3
+    assert me.last_journal_seq() == len(static_orders)
+    assert len(list(journal.records(kind="input"))) == len(static_orders)
+    assert source.acked_tag == len(static_orders)
+    journal.close()
+    os.unlink(journal.path); os.rmdir(directory)
+
+
+@pytest.mark.parametrize("use_journal", [False, True])
+def test_malformed_message(sql_engine: SQLEngine, use_journal: bool):
+    """Check that a malformed message is acknowledged and left out, instead 
+    of stopping the service
+    """
+    directory = tempfile.mkdtemp()
+    journal = Journal(os.path.join(directory, "journal")) if use_journal \
+        else None
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, journal=journal)
+    source = LocalOrderQueue()
+    source.publish(b"not an order")
+    static_orders = publish_orders(me, source)
+    service = AsyncMatchingService(me, source, batch_size=2, batch_timeout=0.01)
+    asyncio.run(asyncio.wait_for(service.run(len(static_orders)), 10))
+
+    assert me.session.query(Transaction).count() == 3
+    assert source.acked_tag == len(static_orders) + 1
+    if journal is not None:
+        assert len(list(journal.records(kind="input"))) == len(static_orders)
+        journal.close()
+        os.unlink(journal.path)
+    os.rmdir(directory)
+
+
+def test_collector_failure(sql_engine: SQLEngine):
+    """Check that if journaling fails, the service stops with the error 
+    instead of waiting for batches forever
+    """
+    directory = tempfile.mkdtemp()
+    journal = Journal(os.path.join(directory, "journal"))
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, journal=journal)
+    source = LocalOrderQueue()
+    static_orders = publish_orders(me, source)
+
+    def journal_inputs(bodies):
+        raise OSError("disk full")
+    me.journal_inputs = journal_inputs
+    service = AsyncMatchingService(me, source, batch_size=2, batch_timeout=0.01)
+    with pytest.raises(OSError):
+        asyncio.run(asyncio.wait_for(service.run(len(static_orders)), 10))
+    assert source.acked_tag == 0
+    journal.close()
+    os.unlink(journal.path); os.rmdir(directory)
+
+
+def test_source_lost(sql_engine: SQLEngine):
+    """Check that if the order source is lost, the service stops with the 
+    error instead of waiting for messages forever
+    """
+    me = MatchingEngine(sql_engine, ignore_user_logic=True)
+    source = LocalOrderQueue()
+    static_orders = publish_orders(me, source)
+    service = AsyncMatchingService(me, source, batch_size=2, batch_timeout=0.01)
+
+    async def run_and_disconnect():
+        run = asyncio.ensure_future(service.run(len(static_orders) + 1))
+        while service.n_committed < len(static_orders):
+            await asyncio.sleep(0.01)
+        source.closed.set_exception(ConnectionError("connection lost"))
+        await run
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(asyncio.wait_for(run_and_disconnect(), 10))
+    assert source.acked_tag == len(static_orders)
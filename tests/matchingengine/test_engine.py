@@ -10,17 +10,19 @@ from chives.matchingengine.matchingengine import MatchingEngine
 from chives.models import Order, Transaction
 
 
-@pytest.fixture
-def matching_engine(sql_engine: SQLEngine) -> MatchingEngine:
+@pytest.fixture(params=[False, True], ids=["sql", "order_book"])
+def matching_engine(request, sql_engine: SQLEngine) -> MatchingEngine:
     """Return a matching engine using the sql_engine obtained from top-level 
-    fixture, and with user logic ignored
+    fixture, and with user logic ignored; each test runs once with candidates 
+    read from the database and once with the in-memory order book
 
     :param sql_engine: [description]
     :type sql_engine: [type]
     :return: [description]
     :rtype: MatchingEngine
     """
-    me = MatchingEngine(sql_engine, ignore_user_logic=True)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                        use_order_book=request.param)
     return me
 
 
@@ -205,3 +207,93 @@ def test_simple_static_orders(sql_engine: SQLEngine, matching_engine: MatchingEn
     assert order_4.parent_order_id == 1
     assert order_4.price == order_1.price 
     assert order_4.size == (order_1.size + order_2.size - order_3.size)
+
+
+def test_heartbeat_batch(sql_engine: SQLEngine, matching_engine: MatchingEngine):
+    """Check that matching a batch of orders with a single commit produces the 
+    same result as heartbeating them one at a time
+
+    :param sql_engine: the SQLAlchemy engine used for connecting to database
+    :type sql_engine: SQLEngine
+    """
+    me = matching_engine
+
+    static_orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=100, price=100),
+        Order(order_id=2, security_symbol="X", side="ask", size=100, price=99),
+        Order(order_id=3, security_symbol="X", side="bid", size=120, price=101),
+        Order(order_id=4, security_symbol="X", side="bid", size=90, price=None,
+                immediate_or_cancel=True)]
+    me.session.add_all(static_orders); me.session.commit()
+    me.heartbeat_batch([Order.from_json(o.json) for o in static_orders])
+
+    # Order 3 trades with order 2 then partially with order 1, leaving a 
+    # suborder 5 of 80 shares at $100, which is then fully taken by order 4, 
+    # whose remaining 10 shares are cancelled as suborder 6
+    transactions = me.session.query(Transaction).order_by(
+        Transaction.transaction_id).all()
+    assert [(t.ask_id, t.bid_id, t.size) for t in transactions] == [
+        (2, 3, 100), (1, 3, 20), (5, 4, 80)]
+    order_5: Order = me.session.query(Order).get(5)
+    order_6: Order = me.session.query(Order).get(6)
+    assert order_5.parent_order_id == 1 and not order_5.active
+    assert order_6.parent_order_id == 4 and order_6.cancelled_dttm is not None
+    assert me.session.query(Order).filter(Order.active == True).count() == 0
+
+
+def test_heartbeat_batch_retries(sql_engine: SQLEngine, 
+                                 matching_engine: MatchingEngine):
+    """Check that a batch whose commit fails is retried, and that the error 
+    is raised once the attempts run out
+    """
+    me = matching_engine
+    static_orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=1),
+        Order(order_id=2, security_symbol="X", side="bid", size=10, price=1)]
+    me.session.add_all(static_orders); me.session.commit()
+    jsons = [o.json for o in static_orders]
+    heartbeat_batch = me._heartbeat_batch
+    attempts = []
+
+    def flaky_heartbeat_batch(incomings, journal_seqs=None):
+        attempts.append(len(incomings))
+        if len(attempts) == 1:
+            raise RuntimeError("deadlock")
+        return heartbeat_batch(incomings, journal_seqs)
+    me._heartbeat_batch = flaky_heartbeat_batch
+    me.heartbeat_batch([Order.from_json(j) for j in jsons])
+    assert attempts == [2, 2]
+    assert me.session.query(Transaction).count() == 1
+
+    def failing_heartbeat_batch(incomings, journal_seqs=None):
+        attempts.append(len(incomings))
+        raise RuntimeError("database is gone")
+    me._heartbeat_batch = failing_heartbeat_batch
+    attempts.clear()
+    with pytest.raises(RuntimeError):
+        me.heartbeat_batch([Order.from_json(jsons[0])])
+    assert len(attempts) == me.max_commit_attempts
+
+
+def test_candidates_pagination(sql_engine: SQLEngine):
+    """Check that candidates read one page at a time are in price-time 
+    priority, and that no candidate is skipped or repeated across pages
+
+    :param sql_engine: the SQLAlchemy engine used for connecting to database
+    :type sql_engine: SQLEngine
+    """
+    me = MatchingEngine(sql_engine, ignore_user_logic=True)
+    me.candidates_page_size = 2
+    resting_orders = [
+        Order(order_id=i, security_symbol="X", side="ask", size=10, 
+              price=price, active=True)
+        for i, price in enumerate([3, 1, 2, 1, 2, 1, 3], start=1)]
+    for order in resting_orders:
+        me.session.add(order); me.session.commit()
+    
+    market_bid = Order(security_symbol="X", side="bid", size=100, price=None)
+    assert [o.order_id for o in me.get_candidates(market_bid)] == [
+        2, 4, 6, 3, 5, 1, 7]
+    limit_bid = Order(security_symbol="X", side="bid", size=100, price=2)
+    assert [o.order_id for o in me.get_candidates(limit_bid)] == [
+        2, 4, 6, 3, 5]
@@ -6,10 +6,11 @@ from collections.abc import Iterable
 import typing as ty
 
 import pytest
+from sqlalchemy.dialects import mysql
 from sqlalchemy.engine import Engine as SQLEngine
 
 from chives.matchingengine.matchingengine import MatchingEngine
-from chives.models.models import Order, Transaction, User, Asset
+from chives.models.models import Order, Transaction, User, Asset, Company
 
 
 @pytest.fixture
@@ -52,3 +53,117 @@ def test_unmatched_market_order(matching_engine, user_inject):
     """
     user1 = user_inject("user1")
     assert matching_engine.session.query(User).get(1) is user1
+
+
+def test_asset_exchange(matching_engine, user_inject):
+    """Check that the seller gains cash, that the buyer gains stocks and loses 
+    cash, that the refund of a cancelled selling order is returned to the 
+    seller, and that the market price is the last transaction price
+
+    :param matching_engine: [description]
+    :type matching_engine: [type]
+    """
+    me = matching_engine
+    seller, buyer = user_inject("seller"), user_inject("buyer")
+    me.session.add_all([
+        Company(symbol="X", name="X", initial_value=100, initial_size=100, 
+                founder_id=seller.user_id, market_price=1),
+        # The seller's shares are already deducted at order submission
+        Asset(owner_id=seller.user_id, asset_symbol="X", asset_amount=0),
+        Asset(owner_id=seller.user_id, asset_symbol="_CASH", asset_amount=0),
+        Asset(owner_id=buyer.user_id, asset_symbol="_CASH", asset_amount=1000),
+    ])
+    me.session.commit()
+    seller_id, buyer_id = seller.user_id, buyer.user_id
+
+    test_orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=2,
+              owner_id=seller_id),
+        Order(order_id=2, security_symbol="X", side="ask", size=10, price=3,
+              owner_id=seller_id),
+        Order(order_id=3, security_symbol="X", side="bid", size=15, price=None,
+              owner_id=buyer_id, immediate_or_cancel=True),
+        # Order 4 is the suborder of order 2 with the 5 shares left over
+        Order(order_id=5, security_symbol="X", side="ask", size=10, price=4,
+              owner_id=seller_id, immediate_or_cancel=True),
+    ]
+    for test_order in test_orders:
+        me.session.add(test_order); me.session.commit()
+        me.heartbeat(incoming=test_order)
+
+    # The buyer takes 10 shares at $2 and 5 shares at $3; the last ask finds 
+    # no bid and its 10 shares are refunded
+    cash_volume = 10 * 2 + 5 * 3
+    assert me.session.query(Asset).get((seller_id, "_CASH")).asset_amount \
+        == cash_volume
+    assert me.session.query(Asset).get((seller_id, "X")).asset_amount == 10
+    assert me.session.query(Asset).get((buyer_id, "_CASH")).asset_amount \
+        == 1000 - cash_volume
+    assert me.session.query(Asset).get((buyer_id, "X")).asset_amount == 15
+    assert me.session.query(Company).get("X").market_price == 3
+
+
+@pytest.mark.parametrize("use_order_book", [False, True], 
+                         ids=["sql", "order_book"])
+def test_fixed_point_exchange(sql_engine, use_order_book):
+    """Check that orders of a security with a tick size are matched at 
+    integer ticks, with their prices rounded in favor of their owners, and 
+    that fixed-point cash is exchanged in exact minor units, including cash 
+    that has no minor units yet
+    """
+    me = MatchingEngine(sql_engine, use_order_book=use_order_book, 
+                        cash_minor_units=100, fixed_point_cash=True)
+    seller, buyer = User(username="seller", password_hash="password"), \
+        User(username="buyer", password_hash="password")
+    me.session.add_all([seller, buyer]); me.session.commit()
+    seller_id, buyer_id = seller.user_id, buyer.user_id
+    me.session.add_all([
+        # Each tick is 5 cents
+        Company(symbol="X", name="X", initial_value=100, initial_size=100, 
+                founder_id=seller_id, market_price=1, tick_size=5),
+        Asset(owner_id=buyer_id, asset_symbol="_CASH", asset_amount=1000.1),
+    ])
+    me.session.commit()
+
+    test_orders = [
+        # 10.07 is rounded up to 10.10, or 202 ticks
+        Order(order_id=1, security_symbol="X", side="ask", size=3, price=10.07,
+              owner_id=seller_id),
+        # 10.12 is rounded down to 10.10, which crosses the ask
+        Order(order_id=2, security_symbol="X", side="bid", size=3, price=10.12,
+              owner_id=buyer_id),
+    ]
+    for test_order in test_orders:
+        me.session.add(test_order); me.session.commit()
+        me.heartbeat(incoming=test_order)
+
+    ask = me.session.query(Order).get(1)
+    assert (ask.price_ticks, ask.price) == (202, 10.1)
+    transaction = me.session.query(Transaction).one()
+    assert (transaction.price_ticks, transaction.price) == (202, 10.1)
+    seller_cash = me.session.query(Asset).get((seller_id, "_CASH"))
+    assert (seller_cash.asset_amount_minor, seller_cash.asset_amount) \
+        == (3030, 30.3)
+    buyer_cash = me.session.query(Asset).get((buyer_id, "_CASH"))
+    assert (buyer_cash.asset_amount_minor, buyer_cash.asset_amount) \
+        == (100010 - 3030, 969.8)
+    assert me.session.query(Company).get("X").market_price == 10.1
+
+
+def test_fixed_point_mysql_upsert(sql_engine, monkeypatch):
+    """Check that on MySQL, which assigns from left to right, fixed-point 
+    cash assigns asset_amount_minor first, converting an asset_amount without 
+    minor units before it is changed, then derives asset_amount from it
+    """
+    me = MatchingEngine(sql_engine, cash_minor_units=100, 
+                        fixed_point_cash=True)
+    statements = []
+    monkeypatch.setattr(me.session.bind.dialect, "name", "mysql")
+    monkeypatch.setattr(me.session, "execute", statements.append)
+    me.apply_asset_deltas({(1, "_CASH"): 250})
+    sql = str(statements[0].compile(dialect=mysql.dialect()))
+    assignments = sql.split("ON DUPLICATE KEY UPDATE")[1].strip()
+    assert assignments.startswith("asset_amount_minor = (coalesce("
+                                  "assets.asset_amount_minor, round(")
+    assert assignments.endswith(", asset_amount = (assets.asset_amount_minor "
+                                "/ %s)")
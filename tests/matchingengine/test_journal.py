@@ -0,0 +1,124 @@
+"""
+Test cases for the matching engine's journal and its replay into the main 
+database
+"""
+import os
+import tempfile
+
+import pytest
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.matchingengine import snapshot
+from chives.matchingengine.journal import Journal
+from chives.matchingengine.matchingengine import MatchingEngine
+from chives.models import Order, Transaction
+
+
+@pytest.fixture
+def journal_path() -> str:
+    """Yield the path to a journal file that does not exist yet, then delete 
+    the journal file
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "journal")
+    yield path
+    if os.path.exists(path):
+        os.unlink(path)
+    os.rmdir(directory)
+
+
+def test_append_and_reopen(journal_path: str):
+    """Check that records survive re-opening the journal, and that a partially 
+    written record at the tail is truncated
+    """
+    journal = Journal(journal_path)
+    assert journal.append("input", {"order_id": 1}) == 1
+    assert journal.append("input", {"order_id": 2}) == 2
+    journal.append("output", {"incoming": 1}, seq=1)
+    journal.sync(); journal.close()
+    
+    # Simulate a crash in the middle of writing a record
+    with open(journal_path, "ab") as f:
+        f.write(b"\x00\x00\x01\x00garbage")
+    
+    reopened = Journal(journal_path)
+    assert reopened.journal_id == journal.journal_id
+    assert reopened.last_seq == 2
+    assert os.path.getsize(journal_path) == journal.offset
+    assert [(r.seq, r.body) for r in reopened.records(kind="input")] == [
+        (1, {"order_id": 1}), (2, {"order_id": 2})]
+    assert [r.seq for r in reopened.records(after_seq=1)] == [2]
+    assert reopened.append("input", {"order_id": 3}) == 3
+    reopened.close()
+
+
+def test_replay(sql_engine: SQLEngine, journal_path: str):
+    """Check that the journaled orders whose match results are not committed 
+    are replayed exactly once
+    """
+    journal = Journal(journal_path)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, journal=journal)
+    orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=100, price=1),
+        Order(order_id=2, security_symbol="X", side="bid", size=100, price=1)]
+    me.session.add_all(orders); me.session.commit()
+    seqs = [journal.append("input", json_dict) 
+            for json_dict in [{"order_id": 1, "security_symbol": "X", 
+                               "side": "ask", "size": 100, "price": 1},
+                              {"order_id": 2, "security_symbol": "X", 
+                               "side": "bid", "size": 100, "price": 1}]]
+    assert seqs == [1, 2]
+    journal.sync()
+    
+    # Only the first order is committed before the "crash"
+    first_record = next(journal.records())
+    me.heartbeat_batch([Order(**first_record.body)], [first_record])
+    assert me.last_journal_seq() == 1
+    assert me.session.query(Transaction).count() == 0
+
+    assert me.replay_journal() == 1
+    assert me.replay_journal() == 0
+    assert me.last_journal_seq() == 2
+    assert me.session.query(Transaction).count() == 1
+    outputs = list(journal.records(kind="output"))
+    assert [r.seq for r in outputs] == [1, 2]
+    assert outputs[1].body["transactions"][0][1:4] == [1, 2, 100]
+    journal.close()
+
+
+def test_checkpoint(sql_engine: SQLEngine, journal_path: str, tmp_path):
+    """Check that a journal re-opened from the position saved in a snapshot 
+    only reads the records after it, and still replays the uncommitted ones
+    """
+    journal = Journal(journal_path)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, journal=journal,
+                        use_order_book=True, snapshot_dir=str(tmp_path))
+    orders = [
+        Order(order_id=i, security_symbol="X", side="ask", size=10, price=i)
+        for i in range(1, 4)]
+    me.session.add_all(orders); me.session.commit()
+    records = me.journal_inputs([o.json for o in orders])
+    me.heartbeat_batch([Order(**records[0].body)], records[:1])
+    me.save_snapshot()
+    journal.close()
+
+    latest_snapshot = snapshot.load_latest(str(tmp_path))
+    checkpoint = (latest_snapshot.journal_id, latest_snapshot.journal_seq,
+                  latest_snapshot.journal_offset)
+    assert checkpoint == (journal.journal_id, 1, records[0].offset)
+    reopened = Journal(journal_path, checkpoint)
+    assert (reopened.start_seq, reopened.start_offset) == checkpoint[1:]
+    assert reopened.last_seq == 3
+    assert reopened.offset == os.path.getsize(journal_path)
+    # A checkpoint of another journal is ignored
+    other = Journal(journal_path, ("fedcba9876543210", 1, records[0].offset))
+    assert (other.start_seq, other.last_seq) == (0, 3)
+    other.close()
+
+    restarted = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                               journal=reopened, use_order_book=True,
+                               latest_snapshot=latest_snapshot)
+    assert restarted.replay_journal() == 2
+    assert [o.order_id for o in restarted.order_book.iter_orders("X")] == [
+        1, 2, 3]
+    reopened.close()
@@ -0,0 +1,79 @@
+"""
+Test cases for the in-memory order book, independently of the matching engine
+"""
+import datetime as dt
+
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives.matchingengine.orderbook import OrderBook
+from chives.models import Order
+
+
+def test_price_time_priority():
+    """Check that candidates are returned by best price first, then by the 
+    time at which they entered the order book
+    """
+    ob = OrderBook()
+    for order in [
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=2),
+        Order(order_id=2, security_symbol="X", side="ask", size=10, price=1),
+        Order(order_id=3, security_symbol="X", side="ask", size=10, price=2),
+        Order(order_id=4, security_symbol="X", side="ask", size=10, price=3),
+        Order(order_id=5, security_symbol="Y", side="ask", size=10, price=1),
+    ]:
+        ob.add(order)
+    
+    bid = Order(security_symbol="X", side="bid", size=100, price=2)
+    assert [o.order_id for o in ob.get_candidates(bid)] == [2, 1, 3]
+    market_bid = Order(security_symbol="X", side="bid", size=100, price=None)
+    assert [o.order_id for o in ob.get_candidates(market_bid)] == [2, 1, 3, 4]
+    ask = Order(security_symbol="X", side="ask", size=100, price=1)
+    assert list(ob.get_candidates(ask)) == []
+
+    ob.remove(2)
+    ob.add(Order(order_id=6, security_symbol="X", side="ask", size=5, price=2,
+                 parent_order_id=3), front=True)
+    assert [o.order_id for o in ob.get_candidates(bid)] == [6, 1, 3]
+    assert len(ob) == 5
+    assert 2 not in ob
+
+
+def test_same_owner_excluded():
+    """Check that orders from the same owner, and orders without an owner, 
+    are not returned as candidates for an owned incoming order
+    """
+    ob = OrderBook()
+    ob.add(Order(order_id=1, security_symbol="X", side="bid", size=10, 
+                 price=2, owner_id=1))
+    ob.add(Order(order_id=2, security_symbol="X", side="bid", size=10, 
+                 price=2, owner_id=None))
+    ob.add(Order(order_id=3, security_symbol="X", side="bid", size=10, 
+                 price=1, owner_id=2))
+    ask = Order(security_symbol="X", side="ask", size=10, price=1, owner_id=1)
+    assert [o.order_id for o in ob.get_candidates(ask)] == [3]
+
+
+def test_load(sql_engine: SQLEngine):
+    """Check that the order book is warm-loaded with the active and priced 
+    orders in the database
+    """
+    session = sessionmaker(bind=sql_engine)()
+    now = dt.datetime.utcnow()
+    session.add_all([
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=1, 
+              active=True, create_dttm=now),
+        Order(order_id=2, security_symbol="X", side="ask", size=10, price=1, 
+              active=True, create_dttm=now - dt.timedelta(seconds=1)),
+        Order(order_id=3, security_symbol="X", side="ask", size=10, price=1, 
+              active=False, create_dttm=now),
+        Order(order_id=4, security_symbol="X", side="bid", size=10, price=None,
+              active=True, create_dttm=now),
+    ])
+    session.commit()
+
+    ob = OrderBook()
+    ob.load(session)
+    bid = Order(security_symbol="X", side="bid", size=100, price=None)
+    assert [o.order_id for o in ob.get_candidates(bid)] == [2, 1]
+    assert len(ob) == 2
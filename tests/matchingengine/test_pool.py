@@ -0,0 +1,60 @@
+"""
+Test cases for the supervisor of a pool of matching engine processes, whose 
+workers are stand-ins that do not connect to RabbitMQ
+"""
+import time
+
+from chives.configs import DEFAULT_CONFIG
+from chives.matchingengine.pool import EnginePool, assign_shards, worker_config
+
+
+def idle_worker(config, use_async):
+    time.sleep(60)
+
+
+def test_assign_shards():
+    assert assign_shards([0, 1, 2, 3, 4], 2) == [[0, 2, 4], [1, 3]]
+    assert assign_shards([1, 3], 3) == [[1], [3], []]
+    config = worker_config(dict(DEFAULT_CONFIG, 
+        MATCHING_ENGINE_JOURNAL="/tmp/journal"), [1, 3])
+    assert config['MATCHING_ENGINE_SHARDS'] == "1,3"
+    assert config['MATCHING_ENGINE_JOURNAL'] == "/tmp/journal.1-3"
+
+
+def test_restart_and_resize():
+    """Check that a worker that exits is restarted, and that only the workers 
+    whose shards change are restarted when the pool is resized
+    """
+    rc = dict(DEFAULT_CONFIG, ORDER_QUEUE_SHARDS=4)
+    pool = EnginePool(rc, 2, target=idle_worker)
+    pool.min_backoff = 0
+    pool.start()
+    try:
+        assert pool.assignment == [[0, 2], [1, 3]]
+        crashed = pool.workers[0]
+        crashed.kill(); crashed.join()
+        pool.check(); pool.check()
+        assert pool.workers[0] is not crashed and pool.workers[0].is_alive()
+
+        pool.resize(3)
+        assert pool.assignment == [[0, 3], [1], [2]]
+        assert len(pool.workers) == 3
+        assert all(worker.is_alive() for worker in pool.workers.values())
+    finally:
+        pool.stop()
+    assert len(pool.workers) == 0
+
+    # With two shards, the third worker is idle, and removing it does not 
+    # affect the other two
+    rc = dict(DEFAULT_CONFIG, ORDER_QUEUE_SHARDS=2)
+    pool = EnginePool(rc, 3, target=idle_worker)
+    pool.start()
+    try:
+        assert pool.assignment == [[0], [1], []]
+        assert sorted(pool.workers) == [0, 1]
+        kept = dict(pool.workers)
+        pool.resize(2)
+        assert pool.workers == kept
+    finally:
+        pool.stop()
+    assert len(pool.workers) == 0
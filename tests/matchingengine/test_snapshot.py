@@ -0,0 +1,108 @@
+"""
+Test cases for order book snapshots and catching up from them
+"""
+import datetime as dt
+
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.matchingengine import snapshot
+from chives.matchingengine.matchingengine import MatchingEngine
+from chives.matchingengine.orderbook import OrderBook
+from chives.models import Order
+
+
+def book_state(order_book: OrderBook):
+    """Return the order book's orders in price-time priority as tuples
+    """
+    return {symbol: [(o.order_id, o.side, o.size, o.price, o.owner_id) 
+                     for o in order_book.iter_orders(symbol)]
+            for symbol in order_book.books}
+
+
+def test_roundtrip():
+    """Check that an order book read back from its snapshot has the same 
+    orders in the same price-time priority
+    """
+    ob = OrderBook()
+    now = dt.datetime(2020, 1, 1)
+    for order in [
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=2.5,
+              owner_id=1, all_or_none=True, create_dttm=now),
+        Order(order_id=3, security_symbol="X", side="ask", size=5, price=2.5,
+              parent_order_id=2, create_dttm=None),
+        Order(order_id=4, security_symbol="YY", side="bid", size=7, price=1,
+              owner_id=2, immediate_or_cancel=True, create_dttm=now),
+    ]:
+        ob.add(order)
+    
+    loaded = snapshot.loads(snapshot.dumps(ob, 4, journal_seq=3, 
+        journal_offset=100, journal_id="0123456789abcdef"))
+    assert (loaded.last_order_id, loaded.journal_seq, loaded.journal_offset,
+            loaded.journal_id) == (4, 3, 100, "0123456789abcdef")
+    # The creation time is in UTC whatever the local time zone
+    assert abs(loaded.create_dttm - dt.datetime.utcnow()) \
+        < dt.timedelta(minutes=1)
+    assert book_state(loaded.order_book) == book_state(ob)
+    order_1 = loaded.order_book.index[1]
+    assert order_1.all_or_none and not order_1.immediate_or_cancel
+    assert order_1.create_dttm == now
+    assert loaded.order_book.index[3].parent_order_id == 2
+    assert loaded.order_book.index[3].create_dttm is None
+
+
+def test_catch_up(sql_engine: SQLEngine, tmp_path):
+    """Check that an order book loaded from a snapshot and caught up with the 
+    orders since then is the same as one loaded from all active orders
+    """
+    snapshot_dir = str(tmp_path)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                        use_order_book=True, snapshot_dir=snapshot_dir)
+    orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=2),
+        Order(order_id=2, security_symbol="X", side="ask", size=10, price=1),
+        Order(order_id=3, security_symbol="X", side="ask", size=10, price=3),
+        Order(order_id=4, security_symbol="X", side="bid", size=15, price=2),
+        Order(order_id=5, security_symbol="X", side="bid", size=5, price=0.5),
+    ]
+    me.session.add_all(orders); me.session.commit()
+    jsons = [o.json for o in orders]
+    for json_str in jsons[:3]:
+        me.heartbeat(Order.from_json(json_str))
+    me.save_snapshot()
+    # Order 4 trades with order 2 and partially with order 1 after the 
+    # snapshot, leaving suborder 6
+    for json_str in jsons[3:]:
+        me.heartbeat(Order.from_json(json_str))
+
+    restarted = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                               use_order_book=True, snapshot_dir=snapshot_dir)
+    reloaded = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                              use_order_book=True)
+    assert book_state(restarted.order_book) == book_state(me.order_book)
+    assert book_state(reloaded.order_book) == book_state(me.order_book)
+    assert [o.order_id for o in restarted.order_book.iter_orders("X")] == [
+        6, 3, 5]
+    assert restarted.last_order_id == 6
+
+
+def test_catch_up_out_of_order(sql_engine: SQLEngine, tmp_path):
+    """Check that an order with a smaller order_id than the snapshot's, which 
+    is matched after the snapshot, is caught up
+    """
+    snapshot_dir = str(tmp_path)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                        use_order_book=True, snapshot_dir=snapshot_dir)
+    orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=10, price=2),
+        Order(order_id=2, security_symbol="X", side="ask", size=10, price=3),
+    ]
+    me.session.add_all(orders); me.session.commit()
+    jsons = [o.json for o in orders]
+    me.heartbeat(Order.from_json(jsons[1]))
+    me.save_snapshot()
+    me.heartbeat(Order.from_json(jsons[0]))
+
+    restarted = MatchingEngine(sql_engine, ignore_user_logic=True, 
+                               use_order_book=True, snapshot_dir=snapshot_dir)
+    assert [o.order_id for o in restarted.order_book.iter_orders("X")] == [
+        1, 2]
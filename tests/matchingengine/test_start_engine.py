@@ -0,0 +1,143 @@
+"""
+Test cases for start_engine, with a stand-in for the RabbitMQ connection that
+delivers a fixed list of messages
+"""
+import os
+import tempfile
+from types import SimpleNamespace
+import time
+
+import pytest
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives.benchmark import _bench_orders, order_tracing
+from chives.cli import parser
+from chives.matchingengine import matchingengine
+from chives.models import Transaction
+
+
+class StopConsuming(Exception):
+    pass
+
+
+class FakeChannel:
+    """Delivers the messages to the consumers, no more than prefetch_count of
+    them unacknowledged at a time, and raises StopConsuming once all of them
+    are acknowledged
+    """
+    def __init__(self, connection, bodies):
+        self.connection = connection
+        self.bodies = list(bodies)
+        self.delivered = 0
+        self.acked = 0
+        self.prefetch_count = 0
+        self.callbacks = []
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def queue_declare(self, **kwargs):
+        pass
+
+    def queue_bind(self, **kwargs):
+        pass
+
+    def basic_qos(self, prefetch_count, global_qos=False):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback):
+        self.callbacks.append(on_message_callback)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked = delivery_tag
+
+    def deliver(self) -> int:
+        n = 0
+        while self.delivered < len(self.bodies) \
+                and self.delivered - self.acked < self.prefetch_count:
+            self.delivered += 1; n += 1
+            method = SimpleNamespace(delivery_tag=self.delivered)
+            self.callbacks[0](self, method, None,
+                              self.bodies[self.delivered - 1])
+        return n
+
+    def start_consuming(self):
+        while self.deliver():
+            pass
+
+
+class FakeConnection:
+    bodies = []
+
+    def __init__(self, parameters):
+        self.ch = FakeChannel(self, self.bodies)
+
+    def channel(self):
+        return self.ch
+
+    def process_data_events(self, time_limit=0):
+        if self.ch.acked == len(self.ch.bodies):
+            raise StopConsuming()
+        if not self.ch.deliver():
+            time.sleep(time_limit or 0.001)
+
+
+@pytest.mark.parametrize("batch_size,use_journal", [
+    (1, False), (3, False), (3, True)])
+def test_start_engine(sql_engine: SQLEngine, monkeypatch, batch_size: int,
+                      use_journal: bool):
+    """Check that start_engine heartbeats every message it receives, one at a
+    time, in batches, or through the journal
+    """
+    session = sessionmaker(bind=sql_engine)()
+    bodies = [order.json for order in _bench_orders(session, 5, seed=0)]
+    session.close()
+    monkeypatch.setattr(FakeConnection, "bodies", bodies)
+    monkeypatch.setattr(matchingengine.pika, "BlockingConnection",
+                        FakeConnection)
+    directory = tempfile.mkdtemp()
+    config = {
+        "SQLALCHEMY_CONN": str(sql_engine.url),
+        "MATCHING_ENGINE_BATCH_SIZE": batch_size,
+        "MATCHING_ENGINE_BATCH_TIMEOUT_MS": 10,
+        "MATCHING_ENGINE_JOURNAL":
+            os.path.join(directory, "journal") if use_journal else ""
+    }
+    if batch_size > 1 or use_journal:
+        with pytest.raises(StopConsuming):
+            matchingengine.start_engine(config)
+    else:
+        matchingengine.start_engine(config)
+
+    session = sessionmaker(bind=sql_engine)()
+    # With a journal, messages are acknowledged before they are committed
+    deadline = time.monotonic() + 10
+    while session.query(Transaction).count() < 5 \
+            and time.monotonic() < deadline:
+        session.close(); time.sleep(0.05)
+    assert session.query(Transaction).count() == 5
+    assert order_tracing(session) == []
+    session.close()
+
+
+def test_consume_batches_without_timeout(monkeypatch):
+    """Check that with a batch timeout of 0, messages are still received and 
+    no batch is empty
+    """
+    monkeypatch.setattr(FakeConnection, "bodies", [b"1", b"2", b"3"])
+    ch = FakeConnection(None).channel()
+    batches = []
+    with pytest.raises(StopConsuming):
+        matchingengine.consume_batches(
+            ch, ["q"], batch_size=2, batch_timeout=0, on_batch=batches.append)
+    assert batches and all(batches)
+    assert [body for batch in batches for body in batch] == [b"1", b"2", b"3"]
+
+
+@pytest.mark.parametrize("option", ["--batch-size", "--batch-timeout-ms"])
+def test_reject_non_positive_batch_options(option: str):
+    with pytest.raises(SystemExit):
+        parser.parse_args(["start_engine", option, "0"])
+    assert getattr(parser.parse_args(["start_engine", option, "5"]),
+                   option[2:].replace("-", "_")) == 5
@@ -0,0 +1,96 @@
+"""
+Test cases for the broker-free benchmark of the matching engine and the 
+verification of its results
+"""
+import datetime as dt
+
+import pytest
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives.benchmark import benchmark_inproc, order_tracing, percentile
+from chives.models import Order, Transaction
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile(values, 1) == 100
+    assert percentile([3.0], 0.9) == 3
+
+
+@pytest.mark.parametrize("batch_size,rate", [(1, None), (4, 1000)])
+def test_benchmark_inproc(tmp_path, batch_size, rate):
+    """Check that every order is heartbeated, consistently, and timed
+    """
+    result = benchmark_inproc(10, sql_uri=f"sqlite:///{tmp_path / 'b.sqlite'}", 
+                              batch_size=batch_size, rate=rate)
+    assert result.n_orders == 20 and result.errors == []
+    assert 0 < result.p50 <= result.p90 <= result.p99 <= result.max
+    assert result.orders_per_second > 0
+
+
+def reference_order_tracing(session) -> list:
+    """The order-by-order checks that order_tracing expresses in SQL
+    """
+    errors = []
+    for order in session.query(Order).order_by(Order.order_id):
+        id_col = Transaction.bid_id if order.side == "bid" \
+            else Transaction.ask_id
+        volume = sum(t.size for t in session.query(Transaction).filter(
+            id_col == order.order_id))
+        suborder = session.query(Order).filter(
+            Order.parent_order_id == order.order_id).first()
+        if volume > order.size:
+            errors.append(f"{order} is over-traded with volume {volume}")
+        elif 0 < volume < order.size:
+            if suborder is None:
+                errors.append(f"{order} is partially fulfilled but no suborder is found")
+            elif suborder.size + volume != order.size:
+                errors.append(f"{order}, its remains {suborder}, and trade volume {volume} are inconsistent")
+            elif order.immediate_or_cancel and suborder.cancelled_dttm is None:
+                errors.append(f"{order} is IOC, but its remains {suborder} is not cancelled")
+        elif volume == 0 and not order.active and order.cancelled_dttm is None:
+            errors.append(f"{order} is not traded at all, but it is neither active nor cancelled")
+    return errors
+
+
+def test_order_tracing(sql_engine: SQLEngine):
+    """Check that each kind of inconsistency is found, in the order of the 
+    orders' IDs, which need not be contiguous
+    """
+    session = sessionmaker(bind=sql_engine)()
+    now = dt.datetime.utcnow()
+    orders = [
+        # Fully traded with 20, then over-traded with 21
+        (10, "ask", 10, False, None, None), (20, "bid", 10, False, None, None),
+        (21, "bid", 5, False, None, None),
+        # Partially traded with 31 without a suborder
+        (30, "ask", 10, False, None, None), (31, "bid", 4, False, None, None),
+        # Partially traded with 41 with a suborder of the wrong size
+        (40, "ask", 10, False, None, None), (41, "bid", 4, False, None, None),
+        (42, "ask", 5, True, None, 40),
+        # IOC, partially traded with 51, remains not cancelled
+        (50, "bid", 10, False, None, None), (51, "ask", 4, False, None, None),
+        (52, "bid", 6, False, None, 50),
+        # Neither traded, active nor cancelled, then cancelled
+        (60, "bid", 1, False, None, None), (61, "bid", 1, False, now, None),
+    ]
+    session.add_all([Order(order_id=i, security_symbol="X", side=side, 
+        size=size, price=1, active=active, cancelled_dttm=cancelled, 
+        parent_order_id=parent, immediate_or_cancel=(i == 50))
+        for i, side, size, active, cancelled, parent in orders])
+    trades = [(10, 20, 10), (10, 21, 5), (30, 31, 4), (40, 41, 4), (51, 50, 4)]
+    session.add_all([Transaction(transaction_id=i, security_symbol="X", 
+        size=size, price=1, ask_id=ask, bid_id=bid, aggressor_order_id=bid, 
+        resting_order_id=ask if i != 1 else 21)
+        for i, (ask, bid, size) in enumerate(trades)])
+    session.commit()
+
+    errors = order_tracing(session)
+    assert errors == reference_order_tracing(session)
+    assert [(e.split(",")[0], e.split(" ")[-1]) for e in errors] == [
+        ("<Order(id=10", "15"), ("<Order(id=30", "found"), 
+        ("<Order(id=40", "inconsistent"), ("<Order(id=50", "cancelled"), 
+        ("<Order(id=52", "cancelled"), ("<Order(id=60", "cancelled")]
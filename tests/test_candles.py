@@ -0,0 +1,131 @@
+"""
+Test cases for the candles that the matching engine keeps for the stock charts
+"""
+import datetime as dt
+
+import random
+
+import pandas as pd
+from sqlalchemy.dialects import mysql
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives.blueprints.api import aggregate_stock_chart
+from chives.candles import (
+    CANDLE_SPANS, aggregate_candles, backfill_candles, bucket_index, 
+    bucket_start, chart_data_points, price_stats, read_candles, sql_candles)
+from chives.matchingengine.matchingengine import MatchingEngine
+from chives.models import Candle, Order, Transaction
+
+
+def test_bucket_start():
+    dttm = dt.datetime(2020, 11, 5, 13, 27, 31)
+    assert bucket_start(dttm, 600) == dt.datetime(2020, 11, 5, 13, 20)
+    assert bucket_start(dttm, 86400) == dt.datetime(2020, 11, 5)
+    # 1970-01-01 is a Thursday
+    assert bucket_start(dttm, 7 * 86400) == dt.datetime(2020, 11, 5)
+
+
+def test_engine_candles(sql_engine: SQLEngine):
+    """Check that the candles kept by the matching engine agree with the 
+    transactions, both in the chart and after a backfill
+    """
+    me = MatchingEngine(sql_engine, ignore_user_logic=True)
+    orders = [
+        Order(order_id=1, security_symbol="X", side="ask", size=100, price=10),
+        Order(order_id=2, security_symbol="X", side="ask", size=50, price=11),
+        Order(order_id=3, security_symbol="X", side="bid", size=120, price=12),
+        Order(order_id=5, security_symbol="X", side="ask", size=40, price=9),
+        Order(order_id=6, security_symbol="X", side="bid", size=40, price=None),
+    ]
+    for order in orders:
+        me.session.add(order); me.session.commit()
+        me.heartbeat(order)
+
+    transactions = me.session.query(Transaction).order_by(
+        Transaction.transaction_id).all()
+    assert [t.price for t in transactions] == [10, 11, 9]
+    # The transactions are made within a second, so they are all in one 
+    # weekly candle
+    candle = me.session.query(Candle).filter(
+        Candle.span == max(CANDLE_SPANS)).one()
+    assert (candle.open, candle.high, candle.low, candle.close) == (10, 11, 9, 9)
+    assert (candle.volume, candle.n_trades) == (160, 3)
+
+    candles = read_candles(me.session, "X", "day")
+    df = pd.DataFrame({
+        "transact_dttm": [t.transact_dttm for t in transactions],
+        "price": [t.price for t in transactions]})
+    assert chart_data_points(candles) == aggregate_stock_chart(df, "day")
+    max_price, min_price, price_std = price_stats(candles)
+    assert (max_price, min_price) == (11, 9)
+    assert abs(price_std - df['price'].std()) < 1e-9
+
+    incremental = [(c.span, c.start_dttm, c.open, c.high, c.low, c.close, 
+        c.volume) for c in me.session.query(Candle).order_by(Candle.span)]
+    me.session.close()
+    assert backfill_candles(sql_engine) == len(incremental)
+    assert incremental == [(c.span, c.start_dttm, c.open, c.high, c.low, 
+        c.close, c.volume) for c in me.session.query(Candle).order_by(
+            Candle.span)]
+
+
+def test_sql_candles(sql_engine: SQLEngine):
+    """Check that the candles aggregated within the database are the same as 
+    those aggregated from the transactions in Python
+    """
+    random.seed(0)
+    session = sessionmaker(bind=sql_engine)()
+    start = dt.datetime(2020, 11, 5)
+    transactions = [Transaction(
+        transaction_id=i + 1, security_symbol=random.choice("XY"),
+        size=random.randint(1, 100), price=round(random.uniform(10, 100), 2),
+        ask_id=1, bid_id=2, aggressor_order_id=2, resting_order_id=i + 3,
+        transact_dttm=start + dt.timedelta(minutes=i * 7)) for i in range(300)]
+    session.add_all(transactions); session.commit()
+
+    for span in CANDLE_SPANS:
+        expected = aggregate_candles(transactions, spans=[span])
+        candles = sql_candles(session, span)
+        assert len(candles) == len(expected)
+        for c in candles:
+            d = expected[(c.security_symbol, c.span, c.start_dttm)]
+            assert (c.open, c.high, c.low, c.close, c.volume, c.n_trades) \
+                == (d.open, d.high, d.low, d.close, d.volume, d.n_trades)
+            assert abs(c.price_sum - d.price_sum) < 1e-6
+
+    since = start + dt.timedelta(hours=12, minutes=5)
+    candles = sql_candles(session, 600, symbol="X", since=since)
+    assert candles[0].start_dttm == dt.datetime(2020, 11, 5, 12)
+    assert set(c.security_symbol for c in candles) == {"X"}
+    session.close()
+
+
+def test_sql_candles_fallback(sql_engine: SQLEngine, monkeypatch):
+    """Check that on a database without a bucket expression, the candles are 
+    aggregated from the transactions instead
+    """
+    session = sessionmaker(bind=sql_engine)()
+    start = dt.datetime(2020, 11, 5)
+    session.add_all([Transaction(
+        transaction_id=i + 1, security_symbol="X", size=10, price=price,
+        ask_id=1, bid_id=2, aggressor_order_id=2, resting_order_id=i + 3,
+        transact_dttm=start + dt.timedelta(minutes=i * 4)) 
+        for i, price in enumerate([10, 12, 9, 11])])
+    session.commit()
+    expected = [(c.start_dttm, c.open, c.high, c.low, c.close, c.volume) 
+                for c in sql_candles(session, 600, symbol="X")]
+
+    monkeypatch.setattr("chives.candles.SQL_BUCKET_DIALECTS", ())
+    assert [(c.start_dttm, c.open, c.high, c.low, c.close, c.volume) 
+            for c in sql_candles(session, 600, symbol="X")] == expected == [
+        (start, 10, 12, 9, 9, 30), 
+        (start + dt.timedelta(minutes=10), 11, 11, 11, 11, 10)]
+    assert sql_candles(session, 600, symbol="Y") == []
+    session.close()
+
+
+def test_mysql_bucket_index():
+    expression = bucket_index("mysql", Transaction.transact_dttm, 600)
+    assert str(expression.compile(dialect=mysql.dialect())) == \
+        "timestampdiff(SECOND, %s, transactions.transact_dttm) DIV %s"
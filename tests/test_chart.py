@@ -0,0 +1,49 @@
+"""
+Test cases for the aggregation of transactions into the stock chart, against 
+the straightforward bucket-by-bucket aggregation
+"""
+import datetime as dt
+from math import floor
+import random
+
+import pandas as pd
+import pytest
+
+from chives.blueprints.api import aggregate_stock_chart
+from chives.candles import CandleStickDataPoint, UNIX_START, ZOOM_CONFIGS
+
+
+def reference_stock_chart(df: pd.DataFrame, zoom: str):
+    agg_tspan = ZOOM_CONFIGS[zoom].agg_tspan
+    global_agg_start = (df['transact_dttm'].min() - UNIX_START) // agg_tspan \
+        * agg_tspan + UNIX_START
+    bucket_idx = ((df['transact_dttm'] - global_agg_start) / agg_tspan).apply(
+        floor)
+    output, prior_close = [], None
+    for idx in bucket_idx.unique():
+        part = df.loc[bucket_idx == idx]
+        open = prior_close if prior_close else round(part['price'].iloc[0], 2)
+        prior_close = close = round(part['price'].iloc[-1], 2)
+        output.append(CandleStickDataPoint(
+            t=(global_agg_start + idx * agg_tspan - UNIX_START).total_seconds(), 
+            o=open, 
+            h=round(part['price'].max(), 2), l=round(part['price'].min(), 2), 
+            c=close))
+    return output
+
+
+@pytest.mark.parametrize("zoom", list(ZOOM_CONFIGS))
+def test_aggregate_stock_chart(zoom: str):
+    random.seed(zoom)
+    now = dt.datetime(2020, 11, 5, 13, 27, 31)
+    cutoff = now - ZOOM_CONFIGS[zoom].cutoff_offset
+    df = pd.DataFrame({
+        "transact_dttm": sorted(
+            cutoff + (now - cutoff) * random.random() for i in range(500)),
+        "price": [random.uniform(10, 100) for i in range(500)]
+    })
+
+    shuffled = df.sample(frac=1, random_state=0)
+    assert aggregate_stock_chart(shuffled, zoom) \
+        == reference_stock_chart(df, zoom)
+    assert aggregate_stock_chart(df.head(0), zoom) == []
@@ -0,0 +1,75 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import sessionmaker
+
+from chives.fixedpoint import (
+    add_cash, cash_to_minor, migrate_fixed_point, price_to_ticks, 
+    ticks_to_price)
+from chives.models import Asset, Company, Order, User
+
+
+def test_price_to_ticks():
+    # 10.07 * 100 is 1006.9999999999999 in floating point
+    assert price_to_ticks(10.07, 1, 100) == 1007
+    assert price_to_ticks(10.07, 5, 100, "bid") == 201
+    assert price_to_ticks(10.07, 5, 100, "ask") == 202
+    assert price_to_ticks(10.05, 5, 100, "ask") == 201
+    assert ticks_to_price(201, 5, 100) == 10.05
+    assert cash_to_minor(0.1 + 0.2, 100) == 30
+
+
+def test_add_cash():
+    cash = Asset(asset_symbol="_CASH", asset_amount=0.1)
+    add_cash(cash, 0.2, 0)
+    assert cash.asset_amount_minor is None
+    cash = Asset(asset_symbol="_CASH", asset_amount=0.1)
+    add_cash(cash, 0.2, 100)
+    assert (cash.asset_amount_minor, cash.asset_amount) == (30, 0.3)
+
+
+def test_migrate_fixed_point(sql_engine):
+    session = sessionmaker(bind=sql_engine)()
+    user = User(username="user", password_hash="password")
+    session.add(user); session.commit()
+    session.add_all([
+        Company(symbol="X", name="X", initial_value=100, initial_size=100,
+                founder_id=user.user_id, market_price=1.234),
+        Company(symbol="Y", name="Y", initial_value=100, initial_size=100,
+                founder_id=user.user_id, market_price=1.234),
+        Asset(owner_id=user.user_id, asset_symbol="_CASH", asset_amount=12.34),
+        Order(order_id=1, security_symbol="X", side="ask", size=1, price=10.07),
+        Order(order_id=2, security_symbol="X", side="bid", size=1, price=None),
+        Order(order_id=3, security_symbol="Y", side="ask", size=1, price=10.07),
+    ])
+    session.commit()
+
+    migrate_fixed_point(sql_engine, {"X": 5}, 100, fixed_point_cash=True)
+    session.expire_all()
+    assert session.query(Company).get("X").tick_size == 5
+    assert session.query(Company).get("X").market_price == 1.25
+    assert session.query(Company).get("Y").tick_size is None
+    assert (session.query(Order).get(1).price_ticks, 
+            session.query(Order).get(1).price) == (201, 10.05)
+    assert session.query(Order).get(2).price_ticks is None
+    assert session.query(Order).get(3).price_ticks is None
+    cash = session.query(Asset).get((user.user_id, "_CASH"))
+    assert (cash.asset_amount_minor, cash.asset_amount) == (1234, 12.34)
+
+
+def test_migrate_fixed_point_columns(sql_engine):
+    """Check that the fixed-point columns are added to a database created 
+    without them
+    """
+    with sql_engine.begin() as conn:
+        conn.execute("ALTER TABLE companies DROP COLUMN tick_size")
+        conn.execute("ALTER TABLE assets DROP COLUMN asset_amount_minor")
+    session = sessionmaker(bind=sql_engine)()
+    session.execute("INSERT INTO companies (symbol, name, initial_value, "
+                    "initial_size, market_price) VALUES ('X', 'X', 1, 1, 1)")
+    session.commit()
+
+    migrate_fixed_point(sql_engine, {"X": 5}, 100)
+    assert "tick_size" in [
+        c["name"] for c in inspect(sql_engine).get_columns("companies")]
+    assert "asset_amount_minor" in [
+        c["name"] for c in inspect(sql_engine).get_columns("assets")]
+    assert session.query(Company).get("X").tick_size == 5
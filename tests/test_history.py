@@ -0,0 +1,84 @@
+"""
+Test cases for the users' trade histories
+"""
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives.history import backfill_trade_owners, page_cursor, user_transactions
+from chives.matchingengine.matchingengine import MatchingEngine
+from chives.models import Order, Transaction, User
+from chives.webserver import create_app
+
+
+def test_engine_trade_owners(sql_engine: SQLEngine):
+    """Check that the matching engine copies the owners of the orders into 
+    the transactions, and that a user's history is paged newest first
+    """
+    me = MatchingEngine(sql_engine, ignore_user_logic=True)
+    me.session.add_all([User(user_id=i, username=f"u{i}", password_hash="x")
+                        for i in (1, 2, 3)])
+    orders = [Order(order_id=i, security_symbol="X", side="ask", size=1, 
+                    price=10, owner_id=1) for i in range(1, 6)]
+    orders.append(Order(order_id=6, security_symbol="X", side="bid", size=3, 
+                        price=10, owner_id=2))
+    orders.append(Order(order_id=7, security_symbol="X", side="bid", size=2, 
+                        price=10, owner_id=3))
+    for order in orders:
+        me.session.add(order); me.session.commit()
+        me.heartbeat(order)
+
+    transactions = me.session.query(Transaction).order_by(
+        Transaction.transaction_id).all()
+    assert [(t.buyer_id, t.seller_id) for t in transactions] == \
+        [(2, 1)] * 3 + [(3, 1)] * 2
+    first = user_transactions(me.session, 1, limit=3)
+    assert len(first) == 3
+    second = user_transactions(me.session, 1, limit=3, 
+                               before=page_cursor(first))
+    assert [t.transaction_id for t in first + second] == [5, 4, 3, 2, 1]
+    assert user_transactions(me.session, 1, limit=3, 
+                             before=page_cursor(second)) == []
+    assert [t.transaction_id for t in user_transactions(me.session, 3)] \
+        == [5, 4]
+
+
+def test_backfill_trade_owners(sql_engine: SQLEngine):
+    """Check that the backfill adds the missing indexes and fills in the 
+    owners of existing transactions, chunk by chunk
+    """
+    with sql_engine.begin() as conn:
+        conn.execute("DROP INDEX ix_transactions_buyer_dttm")
+    session = sessionmaker(bind=sql_engine)()
+    session.add_all([
+        Order(order_id=1, security_symbol="X", side="ask", size=1, owner_id=3),
+        Order(order_id=2, security_symbol="X", side="bid", size=1, owner_id=4),
+        Order(order_id=3, security_symbol="X", side="ask", size=1, owner_id=5),
+        Order(order_id=4, security_symbol="X", side="bid", size=1, owner_id=3)])
+    session.add_all([
+        Transaction(transaction_id=1, security_symbol="X", size=1, price=1, 
+                    ask_id=1, bid_id=2, aggressor_order_id=2, 
+                    resting_order_id=1),
+        Transaction(transaction_id=2, security_symbol="X", size=1, price=1, 
+                    ask_id=3, bid_id=4, aggressor_order_id=3, 
+                    resting_order_id=4)])
+    session.commit()
+
+    backfill_trade_owners(sql_engine, chunk_size=1)
+    assert "ix_transactions_buyer_dttm" in [
+        i["name"] for i in inspect(sql_engine).get_indexes("transactions")]
+    assert session.query(Transaction.buyer_id, Transaction.seller_id).order_by(
+        Transaction.transaction_id).all() == [(4, 3), (3, 5)]
+
+
+@pytest.mark.parametrize("query", [
+    "before_id=1", "before_dttm=2020-11-05T13:27:31", 
+    "before_dttm=yesterday&before_id=1", 
+    "before_dttm=2020-11-05T13:27:31&before_id=x"])
+def test_malformed_cursor(sql_engine: SQLEngine, tmp_path, query: str):
+    app = create_app({
+        "SQLALCHEMY_CONN": str(sql_engine.url), "LOGIN_DISABLED": True,
+        "RESPONSE_CACHE_PATH": str(tmp_path / "cache.sqlite")})
+    response = app.test_client().get(f"/exchange/recent_transactions?{query}")
+    assert response.status_code == 400
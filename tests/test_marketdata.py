@@ -0,0 +1,149 @@
+"""
+Test cases for the market data published by the matching engine, using the
+in-process stand-in for the fanout exchange
+"""
+import threading
+from types import SimpleNamespace
+
+import pika
+import pytest
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives import marketdata
+from chives.db import get_market_data
+from chives.marketdata import LocalMarketDataBus, MarketDataCache, Quote
+from chives.matchingengine.matchingengine import MatchingEngine
+from chives.models import Company, Order
+from chives.webserver import create_app
+
+
+def static_orders():
+    return [
+        Order(order_id=1, security_symbol="X", side="ask", size=100, price=10),
+        Order(order_id=2, security_symbol="X", side="ask", size=50, price=11),
+        Order(order_id=3, security_symbol="X", side="bid", size=120, price=12),
+    ]
+
+
+@pytest.mark.parametrize("use_order_book", [False, True],
+                         ids=["sql", "order_book"])
+def test_trades_and_quotes(sql_engine: SQLEngine, use_order_book: bool):
+    """Check that trades are published after each commit, and quotes only
+    when the top of the book changes
+    """
+    bus = LocalMarketDataBus()
+    events, cache = [], MarketDataCache()
+    bus.subscribe(events.append)
+    bus.subscribe(cache.apply)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True,
+                        use_order_book=use_order_book, market_data=bus)
+    for order in static_orders():
+        me.session.add(order); me.session.commit()
+        me.heartbeat(order)
+
+    # The second ask does not change the best ask, so it is not quoted
+    assert [(e["type"], e.get("transaction_id"), e.get("price"), e.get("size"))
+            for e in events] == [
+        ("quote", None, None, None),
+        ("trade", 1, 10, 100), ("trade", 2, 11, 20),
+        ("quote", None, None, None)]
+    assert events[0]["ask"] == 10 and events[0]["ask_size"] == 100
+    assert events[1]["aggressor_side"] == "bid"
+    assert cache.last_price("X") == 11
+    assert cache.best_bid_ask("X") == Quote(None, 0, 11, 30)
+    assert cache.last_price("Y") is None
+
+
+def test_batch_and_cache_load(sql_engine: SQLEngine):
+    """Check that a batch publishes its trades and the final top of the book
+    once, which agrees with a cache primed from the database
+    """
+    bus = LocalMarketDataBus()
+    events = []
+    bus.subscribe(events.append)
+    me = MatchingEngine(sql_engine, ignore_user_logic=True, market_data=bus)
+    orders = static_orders()
+    # User logic is ignored, so the market price is not updated by trades
+    me.session.add(Company(symbol="X", name="X", initial_value=1100,
+                           initial_size=100, market_price=11))
+    me.session.add_all(orders); me.session.commit()
+    me.heartbeat_batch(orders)
+
+    assert [e["type"] for e in events] == ["trade", "trade", "quote"]
+    cache = MarketDataCache()
+    cache.load(me.session)
+    assert cache.last_price("X") == 11
+    assert cache.best_bid_ask("X") == Quote(
+        events[-1]["bid"], events[-1]["bid_size"],
+        events[-1]["ask"], events[-1]["ask_size"]) == Quote(None, 0, 11, 30)
+
+
+def test_cache_started_per_process(sql_engine: SQLEngine, monkeypatch):
+    """Check that the consumer is started on first use rather than by 
+    create_app, and started again, with the cache primed again, in the child 
+    of a fork
+    """
+    started = []
+    monkeypatch.setattr(marketdata, "start_market_data_consumer",
+                        lambda cache, conn_params: started.append(cache))
+    session = sessionmaker(bind=sql_engine)()
+    session.add(Company(symbol="X", name="X", initial_value=1100,
+                        initial_size=100, market_price=11))
+    session.commit(); session.close()
+    app = create_app({
+        "SQLALCHEMY_CONN": str(sql_engine.url), "MARKET_DATA": True,
+        "RESPONSE_CACHE_TTL": 0})
+    assert started == []
+
+    with app.app_context():
+        cache = get_market_data()
+        get_market_data()
+    assert started == [cache] and cache.last_price("X") == 11
+
+    # As if forked from the process that started it, with a stale price
+    cache.apply({"type": "trade", "symbol": "X", "price": 5})
+    cache.pid = -1
+    with app.app_context():
+        get_market_data()
+    assert started == [cache, cache] and cache.last_price("X") == 11
+
+
+def test_cache_reloaded_on_reconnect(sql_engine: SQLEngine, monkeypatch):
+    """Check that the consumer reloads the cache from the database each time 
+    it connects, so that the events published while it was disconnected are 
+    not lost
+    """
+    session = sessionmaker(bind=sql_engine)()
+    session.add(Company(symbol="X", name="X", initial_value=1100,
+                        initial_size=100, market_price=11))
+    session.commit(); session.close()
+    connections, reconnected = [], threading.Event()
+
+    def start_consuming():
+        if len(connections) == 1:
+            # Traded while the consumer is disconnected
+            engine_session = sessionmaker(bind=sql_engine)()
+            engine_session.query(Company).get("X").market_price = 12
+            engine_session.commit(); engine_session.close()
+            raise pika.exceptions.AMQPConnectionError("disconnected")
+        reconnected.set()
+        # Consume nothing more; the consumer thread is a daemon
+        threading.Event().wait()
+
+    def connect(conn_params):
+        connections.append(conn_params)
+        ch = SimpleNamespace(
+            exchange_declare=lambda **kwargs: None,
+            queue_declare=lambda **kwargs: SimpleNamespace(
+                method=SimpleNamespace(queue="q")),
+            queue_bind=lambda **kwargs: None,
+            basic_consume=lambda **kwargs: None,
+            start_consuming=start_consuming)
+        return SimpleNamespace(channel=lambda: ch, is_open=True)
+
+    monkeypatch.setattr(marketdata.pika, "BlockingConnection", connect)
+    cache = MarketDataCache(conn_params="rabbitmq", sql_engine=sql_engine)
+    cache.start()
+    assert reconnected.wait(timeout=5)
+    assert len(connections) == 2 and cache.last_price("X") == 12
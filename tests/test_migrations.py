@@ -0,0 +1,48 @@
+"""
+Test cases for the migration of existing databases to the current models
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.benchmark import benchmark_indexes
+from chives.migrations import migrate
+from chives.models import Transaction
+
+
+def test_migrate(sql_engine: SQLEngine):
+    """Check that migrate adds the missing tables, columns and indexes, and 
+    that running it again changes nothing
+    """
+    with sql_engine.begin() as conn:
+        conn.execute("DROP INDEX ix_orders_book")
+        conn.execute("DROP TABLE candles")
+        # SQLite cannot drop a column with a foreign key, so recreate the 
+        # transactions table without buyer_id and seller_id
+        conn.execute("DROP TABLE transactions")
+        conn.execute("CREATE TABLE transactions (transaction_id INTEGER "
+                     "PRIMARY KEY, security_symbol VARCHAR(10) NOT NULL)")
+    changes = migrate(sql_engine)
+    assert changes["orders"] == ["ix_orders_book"]
+    assert changes["candles"] == ["candles"]
+    assert set(changes["transactions"]) >= {
+        "buyer_id", "seller_id", "ix_transactions_symbol_dttm"}
+    inspector = inspect(sql_engine)
+    assert set(c.name for c in Transaction.__table__.columns) == set(
+        c["name"] for c in inspector.get_columns("transactions"))
+    assert migrate(sql_engine) == dict()
+
+
+def test_benchmark_indexes(tmp_path):
+    """Check that the hot queries use the indexes once they are created
+    """
+    results = benchmark_indexes(f"sqlite:///{tmp_path / 'bench.sqlite'}", 
+                                n_orders=2000, n_runs=1)
+    assert set(results) == {"candidates", "recent_orders", "chart", "history"}
+    for name, index in [("candidates", "ix_orders_book"), 
+                        ("recent_orders", "ix_orders_owner_dttm"),
+                        ("chart", "ix_transactions_symbol_dttm"), 
+                        ("history", "ix_transactions_buyer_dttm")]:
+        before_plan, _ = results[name]["before"]
+        after_plan, _ = results[name]["after"]
+        assert not any(index in step for step in before_plan)
+        assert any(index in step for step in after_plan)
@@ -0,0 +1,41 @@
+"""
+Test cases for the valuation of users' portfolios
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import Engine as SQLEngine
+from sqlalchemy.orm import sessionmaker
+
+from chives.marketdata import MarketDataCache
+from chives.models import Asset, Company, User
+from chives.portfolio import Position, value_portfolio
+
+
+def test_value_portfolio(sql_engine: SQLEngine):
+    """Check that a portfolio is valued in one query, at the last prices of 
+    the market data cache where there are any
+    """
+    session = sessionmaker(bind=sql_engine)()
+    session.add(User(user_id=1, username="holder", password_hash="x"))
+    session.add_all([Company(symbol=s, name=s, initial_value=100, 
+                             initial_size=100, market_price=p) 
+                     for s, p in (("X", 2), ("Y", 3))])
+    session.add_all([
+        Asset(owner_id=1, asset_symbol="_CASH", asset_amount=50),
+        Asset(owner_id=1, asset_symbol="Y", asset_amount=10),
+        Asset(owner_id=1, asset_symbol="X", asset_amount=5),
+        Asset(owner_id=1, asset_symbol="Z", asset_amount=0)])
+    session.commit()
+
+    statements = []
+    event.listen(sql_engine, "before_cursor_execute", 
+                 lambda *args: statements.append(args[2]))
+    portfolio = value_portfolio(session, 1)
+    assert len(statements) == 1
+    assert portfolio.cash == 50 and portfolio.net_worth == 50 + 10 + 30
+    assert portfolio.positions == [
+        Position("X", 5, 2, 10), Position("Y", 10, 3, 30)]
+
+    cache = MarketDataCache()
+    cache.apply({"type": "trade", "symbol": "X", "price": 4,
+                 "size": 1, "transaction_id": 1})
+    assert value_portfolio(session, 1, market_data=cache).net_worth == 100
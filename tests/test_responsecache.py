@@ -0,0 +1,95 @@
+"""
+Test cases for the response cache shared by the webserver's processes, and 
+for the conditional chart and quote responses built on it
+"""
+import os
+import tempfile
+import time
+
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.db import get_db
+from chives.models import Company, Order, Transaction
+from chives.responsecache import ResponseCache
+from chives.webserver import create_app
+
+
+def test_eviction():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "cache.sqlite")
+    cache = ResponseCache(path, ttl=60, max_entries=2)
+    cache.put("a|1", "a", b"a1")
+    cache.put("b|1", "b", b"b1")
+    # A new version replaces the other versions of the same request
+    cache.put("a|2", "a", b"a2")
+    assert cache.get("a|1") is None and cache.get("a|2").body == b"a2"
+    assert len(cache) == 2
+    # b is the least recently used entry
+    time.sleep(0.01); cache.get("a|2"); time.sleep(0.01)
+    cache.put("c|1", "c", b"c1")
+    assert cache.get("b|1") is None and len(cache) == 2
+    # Another process (or instance) sees the same entries; expired entries 
+    # are not returned
+    other = ResponseCache(path, ttl=0)
+    assert other.get("c|1").etag == cache.get("c|1").etag
+    other.put("d|1", "d", b"d1")
+    assert other.get("d|1") is None
+
+
+def test_conditional_chart(sql_engine: SQLEngine):
+    directory = tempfile.mkdtemp()
+    app = create_app({
+        "SQLALCHEMY_CONN": str(sql_engine.url), "LOGIN_DISABLED": True,
+        "RESPONSE_CACHE_PATH": os.path.join(directory, "cache.sqlite")})
+    client = app.test_client()
+    url = "/api/stock_chart_data?symbol=X&zoom=day"
+
+    def trade(transaction_id: int, price: float):
+        with app.app_context():
+            db = get_db()
+            db.add(Transaction(transaction_id=transaction_id, 
+                security_symbol="X", size=1, price=price, ask_id=1, bid_id=2,
+                aggressor_order_id=2, resting_order_id=transaction_id))
+            db.commit()
+
+    trade(1, 10)
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers["ETag"]
+    assert "Last-Modified" in first.headers
+    assert client.get(url, headers={
+        "If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    # A new trade changes the version, so the chart is rebuilt
+    trade(2, 11)
+    second = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert len(app.extensions['chives_response_cache']) == 1
+
+    with app.app_context():
+        db = get_db()
+        db.add(Company(symbol="X", name="X", initial_value=100, 
+                       initial_size=10, market_price=11))
+        db.commit()
+    quote = client.get("/api/quote?symbol=X")
+    assert quote.json["last_price"] == 11
+    assert client.get("/api/quote?symbol=X", headers={
+        "If-None-Match": quote.headers["ETag"]}).status_code == 304
+
+    # A submitted order is only on the book once the matching engine 
+    # activates it, which must change the quote's version
+    with app.app_context():
+        db = get_db()
+        db.add(Order(order_id=10, security_symbol="X", side="bid", size=1, 
+                     price=10.5, active=False, owner_id=1))
+        db.commit()
+    assert client.get("/api/quote?symbol=X", headers={
+        "If-None-Match": quote.headers["ETag"]}).status_code == 304
+    with app.app_context():
+        db = get_db()
+        db.query(Order).get(10).active = True
+        db.commit()
+    activated = client.get("/api/quote?symbol=X", headers={
+        "If-None-Match": quote.headers["ETag"]})
+    assert activated.status_code == 200
+    assert activated.json["bid"] == 10.5
@@ -0,0 +1,118 @@
+"""
+Test cases for the routing of incoming orders to shards
+"""
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from chives.models import Order
+from chives.routing import OrderPublisher, parse_shards, shard_of, shard_queue
+
+
+def test_shard_of_is_stable():
+    """Check that a symbol is always assigned to the same shard, and that all 
+    shards are used
+    """
+    symbols = ["FB", "GOOGL", "AAPL", "MSFT", "NTLX", "TSLA", "AMZN", "BENCH"]
+    assert [shard_of(s, 4) for s in symbols] == [shard_of(s, 4) for s in symbols]
+    assert all(shard_of(s, 1) == 0 for s in symbols)
+    assert set(shard_of(s, 4) for s in symbols) == {0, 1, 2, 3}
+    assert shard_queue(shard_of("AAPL", 4)).startswith("incoming_order.")
+
+
+def test_parse_shards():
+    assert parse_shards("", 3) == [0, 1, 2]
+    assert parse_shards("2,0,2", 3) == [0, 2]
+    with pytest.raises(ValueError):
+        parse_shards("3", 3)
+
+
+class FakeChannel:
+    is_open = True
+
+    def __init__(self):
+        self.published = []
+
+    def basic_publish(self, exchange, routing_key, body):
+        self.published.append((routing_key, body))
+
+
+def confirm(method, delivery_tag, multiple):
+    return SimpleNamespace(
+        method=method(delivery_tag=delivery_tag, multiple=multiple))
+
+
+def test_publisher_confirms():
+    """Check that the publisher forgets the orders that are acknowledged, 
+    including those acknowledged together, and publishes rejected orders again
+    """
+    publisher = OrderPublisher(None, 2, confirm=True)
+    publisher.ch = FakeChannel()
+    orders = [Order(order_id=i, security_symbol=s, side="bid", size=1)
+              for i, s in enumerate(["AAPL", "MSFT", "AAPL", "TSLA"], 1)]
+    publisher.pending.extend(
+        (str(shard_of(o.security_symbol, 2)), o.json) for o in orders)
+    publisher.flush()
+    assert not publisher.pending
+    assert [key for key, _ in publisher.ch.published] == [
+        str(shard_of(o.security_symbol, 2)) for o in orders]
+    assert sorted(publisher.unconfirmed) == [1, 2, 3, 4]
+
+    publisher.on_confirm(confirm(pika.spec.Basic.Ack, 2, True))
+    assert sorted(publisher.unconfirmed) == [3, 4]
+    # The rejected order is published again with the next delivery tag
+    publisher.on_confirm(confirm(pika.spec.Basic.Nack, 4, False))
+    assert sorted(publisher.unconfirmed) == [3, 5]
+    assert publisher.ch.published[-1] == publisher.ch.published[3]
+    publisher.on_confirm(confirm(pika.spec.Basic.Ack, 5, True))
+    assert not publisher.unconfirmed and publisher.wait(timeout=0)
+
+
+class FakeAsyncChannel(FakeChannel):
+    """Records the RPCs of an asynchronous channel, whose callbacks are only 
+    called once the test replies to them
+    """
+    def __init__(self):
+        super().__init__()
+        self.rpcs = []
+        self.replies = []
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def exchange_declare(self, **kwargs):
+        self.rpcs.append("Exchange.Declare")
+
+    def queue_declare(self, **kwargs):
+        self.rpcs.append("Queue.Declare")
+
+    def queue_bind(self, callback=None, **kwargs):
+        self.rpcs.append("Queue.Bind")
+        self.replies.append(callback)
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self.rpcs.append("Confirm.Select")
+        self.replies.append(callback)
+
+
+@pytest.mark.parametrize("confirm", [False, True])
+def test_publisher_waits_for_routing(confirm: bool):
+    """Check that a new channel publishes the queued orders only once the 
+    bindings exist, and the channel is in confirm mode with publisher confirms
+    """
+    publisher = OrderPublisher(None, 2, confirm=confirm)
+    publisher.conn = SimpleNamespace(is_open=True)
+    publisher.pending.append(("0", "order"))
+    ch = FakeAsyncChannel()
+    publisher.on_channel_open(ch)
+    publisher.flush()
+    assert ch.rpcs[-1] == ("Confirm.Select" if confirm else "Queue.Bind")
+    assert not ch.published and publisher.pending
+
+    # Only the last RPC has a callback, as RPCs are answered in order
+    assert [reply is not None for reply in ch.replies] == \
+        [False] * (len(ch.replies) - 1) + [True]
+    ch.replies[-1](None)
+    assert ch.published == [("0", "order")] and not publisher.pending
+    assert sorted(publisher.unconfirmed) == ([1] if confirm else [])
@@ -0,0 +1,102 @@
+"""
+Test cases for the webserver's database engine and sessions, and its JSON API
+"""
+import tempfile
+
+from sqlalchemy.engine import Engine as SQLEngine
+
+from chives.db import get_db
+from chives.models import Asset, Company, Order, User
+from chives.webserver import create_app
+
+
+def test_shared_engine(sql_engine: SQLEngine):
+    """Check that all requests share the engine created by create_app, and 
+    that each application context gets its own session
+    """
+    app = create_app({
+        "SQLALCHEMY_CONN": str(sql_engine.url), "LOGIN_DISABLED": True,
+        "RESPONSE_CACHE_PATH": tempfile.mktemp()})
+    sessions = []
+    for i in range(2):
+        with app.app_context():
+            db = get_db()
+            assert db.bind is app.extensions['chives_sql_engine']
+            sessions.append(db())
+    assert sessions[0] is not sessions[1]
+
+    stats = app.test_client().get("/debug/pool_stats").json
+    assert stats["pool"] == type(app.extensions['chives_sql_engine'].pool
+                                 ).__name__
+
+
+class FakePublisher:
+    healthy = True
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, orders):
+        self.published.extend(orders)
+
+
+def test_order_batch(sql_engine: SQLEngine):
+    """Check that a batch of orders reserves the shares of its ask orders, 
+    and is inserted and published as a whole or not at all
+    """
+    app = create_app({
+        "SQLALCHEMY_CONN": str(sql_engine.url), 
+        "RESPONSE_CACHE_PATH": tempfile.mktemp()})
+    publisher = app.extensions['chives_order_publisher'] = FakePublisher()
+    with app.app_context():
+        db = get_db()
+        db.add(User(user_id=1, username="maker", password_hash="x"))
+        db.add_all([Company(symbol=s, name=s, initial_value=100, 
+                            initial_size=100, market_price=1) 
+                    for s in ("X", "Y")])
+        db.add(Asset(owner_id=1, asset_symbol="X", asset_amount=100))
+        db.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "1"
+
+    batch = [
+        {"security_symbol": "X", "side": "ask", "size": 60, "price": 2},
+        {"security_symbol": "Y", "side": "bid", "size": 10},
+        {"security_symbol": "X", "side": "ask", "size": 40, "price": 3.5}]
+    order_ids = client.post("/api/orders/batch", json=batch).json["order_ids"]
+    assert len(order_ids) == 3 and order_ids == sorted(order_ids)
+    assert [(o.order_id, o.security_symbol, o.size, o.immediate_or_cancel) 
+            for o in publisher.published] == [
+        (order_ids[0], "X", 60, False), (order_ids[1], "Y", 10, True),
+        (order_ids[2], "X", 40, False)]
+    with app.app_context():
+        assert get_db().query(Asset).get((1, "X")).asset_amount == 0
+
+    # Not enough shares left, so nothing is inserted
+    response = client.post("/api/orders/batch", json=batch[:1])
+    assert response.status_code == 400
+    response = client.post("/api/orders/batch", json=[
+        {"security_symbol": "Y", "side": "bid", "size": 0}, {"side": "buy"}])
+    assert response.status_code == 400
+    assert [e["index"] for e in response.json["errors"]] == [0, 1]
+    with app.app_context():
+        assert get_db().query(Order).count() == 3
+    assert len(publisher.published) == 3
+    # The reserved shares are no longer part of the portfolio
+    assert client.get("/api/portfolio").json == {
+        "cash": 0, "net_worth": 0, "positions": []}
+    assert client.get("/exchange/dashboard").status_code == 200
+
+    # Back-to-back batches of the same user each get their own orders
+    bids = [{"security_symbol": s, "side": "bid", "size": n, "price": 1}
+            for s, n in [("X", 1), ("Y", 2)]]
+    first = client.post("/api/orders/batch", json=bids).json["order_ids"]
+    second = client.post("/api/orders/batch", json=bids).json["order_ids"]
+    assert len(set(first + second)) == 4
+    with app.app_context():
+        db = get_db()
+        for order_ids in (first, second):
+            assert [(db.query(Order).get(i).security_symbol, 
+                     db.query(Order).get(i).size) for i in order_ids] == [
+                ("X", 1), ("Y", 2)]
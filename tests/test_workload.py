@@ -0,0 +1,84 @@
+"""
+Test cases for the synthetic workload generator and its order stream files
+"""
+from collections import Counter
+
+import pytest
+
+from chives.benchmark import benchmark_inproc
+from chives.workload import (
+    generate_workload, read_workload, write_workload, zipf_weights)
+
+
+def test_generate_workload_is_seeded():
+    assert generate_workload(200, seed=1) == generate_workload(200, seed=1)
+    assert generate_workload(200, seed=1) != generate_workload(200, seed=2)
+
+
+def test_generate_workload_mix():
+    workload = generate_workload(
+        20000, n_symbols=20, zipf_s=1.2, n_users=50, rate=500,
+        market_ratio=0.2, aon_ratio=0.1, ioc_ratio=0.3, seed=0)
+    orders = workload.orders
+    # The most popular security gets its Zipf share of the orders
+    counts = Counter(o["security_symbol"] for o in orders).most_common()
+    assert counts[0][1] / len(orders) == pytest.approx(
+        zipf_weights(20, 1.2)[0], abs=0.02)
+    assert counts[0][1] > 10 * counts[-1][1]
+    # Poisson arrivals at the mean rate
+    assert orders[-1]["t"] == pytest.approx(len(orders) / 500, rel=0.05)
+    assert all(a["t"] <= b["t"] for a, b in zip(orders, orders[1:]))
+
+    market = [o for o in orders if o["price"] is None]
+    limit = [o for o in orders if o["price"] is not None]
+    assert len(market) / len(orders) == pytest.approx(0.2, abs=0.02)
+    assert all(o["immediate_or_cancel"] for o in market)
+    assert sum(o["all_or_none"] for o in limit) / len(limit) \
+        == pytest.approx(0.1, abs=0.02)
+    assert sum(o["immediate_or_cancel"] for o in limit) / len(limit) \
+        == pytest.approx(0.3, abs=0.02)
+    assert not any(o["all_or_none"] and o["immediate_or_cancel"]
+                   for o in orders)
+    assert {o["owner_id"] for o in orders} == set(range(1, 51))
+
+
+def test_generate_workload_prices():
+    workload = generate_workload(
+        5000, zipf_s=0, market_prices={"AAPL": 100.0, "PENNY": 0.05},
+        volatility=0.001, seed=0)
+    for symbol, start in [("AAPL", 100.0), ("PENNY", 0.05)]:
+        prices = [o["price"] for o in workload.orders
+                  if o["security_symbol"] == symbol and o["price"]]
+        assert min(prices) >= 0.01
+        assert start / 2 < sum(prices) / len(prices) < start * 2
+    # Asks never sell more than their owners hold
+    sold = Counter()
+    for o in workload.orders:
+        if o["side"] == "ask":
+            sold[(o["owner_id"], o["security_symbol"])] += o["size"]
+    for (owner_id, symbol), size in sold.items():
+        assert size <= workload.holdings[owner_id][symbol]
+
+
+def test_workload_file(tmp_path):
+    workload = generate_workload(100, n_symbols=3, n_users=5, seed=0)
+    path = tmp_path / "workload.jsonl"
+    write_workload(path, workload)
+    assert read_workload(path) == workload
+
+    path.write_text('{"format": "something-else"}\n')
+    with pytest.raises(ValueError):
+        read_workload(path)
+
+
+@pytest.mark.parametrize("use_order_book", [False, True])
+def test_benchmark_workload(tmp_path, use_order_book):
+    """Check that a workload replays consistently
+    """
+    path = tmp_path / "workload.jsonl"
+    write_workload(path, generate_workload(
+        100, n_symbols=3, n_users=5, rate=10000, seed=0))
+    result = benchmark_inproc(sql_uri=f"sqlite:///{tmp_path / 'b.sqlite'}",
+                              batch_size=4, use_order_book=use_order_book,
+                              workload=str(path), replay_arrivals=True)
+    assert result.n_orders == 100 and result.errors == []